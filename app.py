@@ -4,13 +4,35 @@ import json
 import logging
 import sys
 import traceback 
+import gzip
+import base64
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_left, bisect_right
+from functools import wraps, lru_cache
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, g, has_request_context
+from flask.globals import request_ctx
+from werkzeug.security import safe_join
 from requests_oauthlib import OAuth2Session
 from google.oauth2 import service_account
 from google.oauth2.service_account import Credentials
 import gspread
 import gspread.exceptions
+import requests
+import shared_cache
+import snapshot_store
+from earnings_heatmap import EarningsHeatmap
+from sheet_table import SheetTable
+
+try:
+    import brotli  # opcional: si no está instalado se comprime solo con gzip
+except ImportError:
+    brotli = None
 
 # ----------------------------
 # CONFIG / LOGGING
@@ -53,7 +75,8 @@ BONUS_RULES = {
 GASTOS_WS_NAME = "TripCounter_Gastos"
 GASTOS_HEADERS = ["Fecha", "Hora", "Monto", "Categoría", "Descripción"]
 PRESUPUESTO_WS_NAME = "TripCounter_Presupuesto"
-PRESUPUESTO_HEADERS = ["alias", "categoria", "monto", "tipo", "fecha_pago", "pagado"] 
+# "id": identificador estable del ítem (las filas se corren al borrar; ver PRESUPUESTO: IDS ESTABLES)
+PRESUPUESTO_HEADERS = ["alias", "categoria", "monto", "tipo", "fecha_pago", "pagado", "id"]
 EXTRAS_WS_NAME = "TripCounter_Extras"
 EXTRAS_HEADERS = ["Fecha","Numero","Hora inicio","Hora fin","Monto","Total"]
 KM_WS_NAME = "TripCounter_Kilometraje"
@@ -69,8 +92,30 @@ SUMMARIES_HEADERS = [
     "Bono Total",
     "Gasto Total",
     "Ganancia Neta",
-    "Productividad S/KM"
+    "Productividad S/KM",
+    "Calculado",  # fecha del cálculo: solo es snapshot si se calculó con el mes ya cerrado
 ]
+# Cabeceras esperadas por hoja (warm-up y caché)
+SHEET_HEADERS = {
+    PRESUPUESTO_WS_NAME: PRESUPUESTO_HEADERS,
+    TRIPS_WS_NAME: TRIPS_HEADERS,
+    BONUS_WS_NAME: BONUS_HEADERS,
+    GASTOS_WS_NAME: GASTOS_HEADERS,
+    EXTRAS_WS_NAME: EXTRAS_HEADERS,
+    KM_WS_NAME: KM_HEADERS,
+    SUMMARIES_WS_NAME: SUMMARIES_HEADERS,
+}
+
+# Columnas numéricas por hoja: se convierten una sola vez al cargar la caché
+NUMERIC_COLUMNS = {
+    TRIPS_WS_NAME: ("Numero", "Monto", "Propina", "Aeropuerto", "Total"),
+    BONUS_WS_NAME: ("Bono total",),
+    GASTOS_WS_NAME: ("Monto",),
+    PRESUPUESTO_WS_NAME: ("monto",),
+    EXTRAS_WS_NAME: ("Numero", "Monto", "Total"),
+    KM_WS_NAME: ("KM Inicio", "KM Fin", "Recorrido"),
+    SUMMARIES_WS_NAME: tuple(SUMMARIES_HEADERS[1:-1]),
+}
 # --- ID DE HOJA CRÍTICA (PRESENTE EN ENTORNO DE RENDER) ---
 PRESUPUESTO_SHEET_ID = os.environ.get("PRESUPUESTO_SHEET_ID")
 TRIPS_SHEET_ID = os.environ.get("TRIPS_SHEET_ID")
@@ -81,63 +126,1242 @@ KM_SHEET_ID = os.environ.get("KM_SHEET_ID")
 SUMMARIES_SHEET_ID = os.environ.get("SUMMARIES_SHEET_ID")
 
 
+# ----------------------------
+# TIEMPOS POR PETICIÓN (Server-Timing + log de peticiones lentas)
+# ----------------------------
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 1000))
+# Perfilador por muestreo (opcional): PROFILE_SLOW_REQUESTS=1 muestrea la pila del hilo
+# de cada petición y, si resulta lenta, escribe en el log las pilas más frecuentes.
+PROFILE_SLOW_REQUESTS = os.environ.get("PROFILE_SLOW_REQUESTS") == "1"
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5))
+PROFILE_TOP_STACKS = 10
+
+class RequestTiming:
+    """
+    Fases medidas durante una petición (milisegundos acumulados por nombre). Con lock:
+    las lecturas en paralelo de varias hojas suman desde sus propios hilos.
+
+    sheets_ms es tiempo de reloj con al menos una llamada a Google en curso (la unión de
+    los intervalos): con llamadas en paralelo, la suma de sus duraciones (sheets_call_ms)
+    supera el tiempo real de espera y no sirve para separar "python" del total.
+    """
+    __slots__ = ("start", "phases", "sheets_calls", "sheets_ms", "sheets_call_ms",
+                 "sheets_active", "sheets_since", "sampler", "lock")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.sheets_calls = 0
+        self.sheets_ms = 0.0
+        self.sheets_call_ms = 0.0
+        self.sheets_active = 0
+        self.sheets_since = None
+        self.sampler = None
+        self.lock = threading.Lock()
+
+    def add(self, name, ms):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + ms
+
+    def sheets_call_started(self):
+        now = time.perf_counter()
+        with self.lock:
+            if self.sheets_active == 0:
+                self.sheets_since = now
+            self.sheets_active += 1
+        return now
+
+    def sheets_call_finished(self, started):
+        now = time.perf_counter()
+        with self.lock:
+            self.sheets_calls += 1
+            self.sheets_call_ms += (now - started) * 1000
+            self.sheets_active -= 1
+            if self.sheets_active == 0:
+                self.sheets_ms += (now - self.sheets_since) * 1000
+
+    def total_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+def _current_timing():
+    return g.get("timing") if has_request_context() else None
+
+@contextmanager
+def timed_phase(name):
+    """Mide un bloque y lo suma a la fase 'name' de la petición actual (no-op fuera de una petición)."""
+    timing = _current_timing()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, (time.perf_counter() - start) * 1000)
+
+def timed(name):
+    """Decorador: mide cada llamada a la función como la fase 'name'."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed_phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def timed_sheets_call():
+    """Mide una llamada HTTP a Google (con la descarga completa de la respuesta) para la petición actual."""
+    timing = _current_timing()
+    if timing is None:
+        yield
+        return
+    started = timing.sheets_call_started()
+    try:
+        yield
+    finally:
+        timing.sheets_call_finished(started)
+
+class StackSampler(threading.Thread):
+    """Muestrea la pila de un hilo cada PROFILE_INTERVAL_MS hasta que se detiene."""
+
+    def __init__(self, thread_id):
+        super().__init__(name="request-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.samples = {}
+        self._stop_event = threading.Event()
+
+    def run(self):
+        interval = PROFILE_INTERVAL_MS / 1000
+        while not self._stop_event.wait(interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = tuple(f"{fs.filename.rsplit('/', 1)[-1]}:{fs.lineno}:{fs.name}" for fs in traceback.extract_stack(frame)[-12:])
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def stop(self):
+        self._stop_event.set()
+
+    def top(self, n=PROFILE_TOP_STACKS):
+        ranked = sorted(self.samples.items(), key=lambda kv: kv[1], reverse=True)[:n]
+        return [{"samples": count, "stack": list(stack)} for stack, count in ranked]
+
+@app.before_request
+def start_request_timing():
+    g.timing = RequestTiming()
+    if PROFILE_SLOW_REQUESTS:
+        g.timing.sampler = StackSampler(threading.get_ident())
+        g.timing.sampler.start()
+
+@app.after_request
+def emit_request_timing(response):
+    timing = _current_timing()
+    if timing is None:
+        return response
+    if timing.sampler is not None:
+        timing.sampler.stop()
+
+    total = timing.total_ms()
+    metrics = [f"{name};dur={ms:.1f}" for name, ms in timing.phases.items()]
+    metrics.append(f'sheets;dur={timing.sheets_ms:.1f};desc="{timing.sheets_calls} calls"')
+    # Ambos son tiempo de reloj, así que no se descuentan llamadas en paralelo dos veces
+    metrics.append(f"python;dur={max(total - timing.sheets_ms, 0.0):.1f}")
+    metrics.append(f"total;dur={total:.1f}")
+    response.headers["Server-Timing"] = ", ".join(metrics)
+
+    if total >= SLOW_REQUEST_MS:
+        log_line = {
+            "event": "slow_request",
+            "route": request.url_rule.rule if request.url_rule else request.path,
+            "method": request.method,
+            "status": response.status_code,
+            "total_ms": round(total, 1),
+            "phases": {name: round(ms, 1) for name, ms in timing.phases.items()},
+            "sheets_calls": timing.sheets_calls,
+            "sheets_ms": round(timing.sheets_ms, 1),
+            "sheets_call_ms": round(timing.sheets_call_ms, 1),
+        }
+        if timing.sampler is not None:
+            log_line["profile"] = timing.sampler.top()
+        app.logger.warning(json.dumps(log_line, ensure_ascii=False))
+    return response
+
+
+# ----------------------------
+# COMPRESIÓN Y ASSETS ESTÁTICOS CON HUELLA
+# ----------------------------
+# Los conductores usan datos móviles con mala señal: las respuestas JSON y los estáticos
+# de texto se comprimen (brotli si el cliente y el servidor lo soportan, si no gzip) y
+# url_for('static', ...) agrega ?v=<hash del contenido>. Una URL con la huella correcta
+# se cachea un año (immutable); al cambiar el archivo cambia la URL.
+# Los streams (SSE) y las respuestas pequeñas no se comprimen.
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/javascript", "text/javascript", "text/css",
+    "text/html", "text/plain", "text/csv", "image/svg+xml",
+}
+STATIC_MAX_AGE = 365 * 24 * 3600
+_STATIC_FINGERPRINTS = {}  # filename -> (mtime, size, huella)
+_STATIC_COMPRESSED = {}    # (ruta, etag, encoding) -> bytes comprimidos
+
+def static_fingerprint(filename):
+    """Huella corta del contenido de un archivo de static/ (None si no existe)."""
+    path = safe_join(app.static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except (TypeError, OSError):
+        return None
+    cached = _STATIC_FINGERPRINTS.get(filename)
+    if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _STATIC_FINGERPRINTS[filename] = (stat.st_mtime, stat.st_size, digest)
+    return digest
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        digest = static_fingerprint(values["filename"])
+        if digest:
+            values["v"] = digest
+
+def _preferred_encoding():
+    if brotli is not None and request.accept_encodings["br"]:
+        return "br"
+    if request.accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+def _compress(data, encoding, static):
+    # Los estáticos se comprimen una vez por versión: vale la pena el nivel máximo
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if static else 5)
+    return gzip.compress(data, compresslevel=9 if static else COMPRESS_LEVEL, mtime=0)
+
+@app.after_request
+def cache_and_compress_response(response):
+    is_static = request.endpoint == "static"
+    if is_static and response.status_code in (200, 304):
+        version = request.args.get("v")
+        if version and version == static_fingerprint(request.view_args.get("filename", "")):
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+
+    if (response.status_code != 200 or request.method == "HEAD"
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or "Content-Encoding" in response.headers
+            or (response.is_streamed and not response.direct_passthrough)):
+        return response
+    response.vary.add("Accept-Encoding")
+
+    encoding = _preferred_encoding()
+    if encoding is None:
+        return response
+
+    etag, _ = response.get_etag()
+    cache_key = (request.path, etag, encoding)
+    compressed = _STATIC_COMPRESSED.get(cache_key) if is_static and etag else None
+    if compressed is None:
+        response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        compressed = _compress(data, encoding, is_static)
+        if len(compressed) >= len(data):
+            return response
+        if is_static and etag:
+            if len(_STATIC_COMPRESSED) >= 256:
+                _STATIC_COMPRESSED.clear()
+            _STATIC_COMPRESSED[cache_key] = compressed
+    else:
+        # Se reutiliza la versión comprimida: el archivo abierto por send_file no se lee
+        if hasattr(response.response, "close"):
+            response.call_on_close(response.response.close)
+        response.direct_passthrough = False
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        # Mismo contenido, otra codificación: ETag débil (If-None-Match compara en modo débil)
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# ----------------------------
+# CIRCUIT BREAKER DE GOOGLE SHEETS (modo degradado)
+# ----------------------------
+# Tras SHEETS_BREAKER_FAILURES errores seguidos (429, 5xx o fallo de red) el circuito se
+# abre: durante SHEETS_BREAKER_RESET segundos ninguna llamada sale hacia Google, las
+# lecturas se sirven desde la última copia en caché (marcadas con X-Data-Stale) y los
+# POST se encolan (ver COLA DE ESCRITURAS). Pasado ese tiempo se deja pasar una sola
+# llamada de prueba: si responde bien el circuito se cierra y se reenvía la cola.
+SHEETS_BREAKER_FAILURES = int(os.environ.get("SHEETS_BREAKER_FAILURES", 5))
+SHEETS_BREAKER_RESET = float(os.environ.get("SHEETS_BREAKER_RESET", 30))
+
+class SheetsUnavailable(Exception):
+    """Google Sheets no está disponible (circuito abierto): no se intentó la llamada."""
+
+class SheetsCircuitBreaker:
+    """Estados: closed (normal) -> open (falla rápido) -> half_open (una llamada de prueba)."""
+
+    def __init__(self, failure_threshold, reset_timeout, on_open=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_open = on_open
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """True mientras no toca intentar (circuito abierto y sin llamada de prueba pendiente)."""
+        with self._lock:
+            return self.state == "open" and time.time() < self.opened_at + self.reset_timeout
+
+    def would_refuse(self):
+        """
+        True si allow_request() rechazaría ahora la llamada (abierto, o la llamada de prueba
+        ya está en curso), sin consumir la prueba del estado half_open.
+        """
+        with self._lock:
+            if self.state == "open":
+                return time.time() < self.opened_at + self.reset_timeout
+            return self.state == "half_open" and self._trial_in_flight
+
+    def seconds_until_trial(self):
+        with self._lock:
+            if self.state != "open":
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.time())
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() >= self.opened_at + self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                app.logger.info("✅ Google Sheets respondió: circuito cerrado.")
+            self.state = "closed"
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self._trial_in_flight = False
+            opened = self.state == "half_open" or (
+                self.state == "closed" and self.failures >= self.failure_threshold)
+            if opened:
+                self.state = "open"
+                self.opened_at = time.time()
+        if opened:
+            app.logger.error(f"🔌 Circuito de Google Sheets abierto ({self.failures} fallos). Último error: {error}")
+            if self.on_open:
+                self.on_open()
+
+    def status(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "retry_in": round(max(0.0, self.opened_at + self.reset_timeout - time.time()), 1) if self.opened_at else None,
+                "last_error": self.last_error,
+            }
+
+SHEETS_BREAKER = SheetsCircuitBreaker(
+    SHEETS_BREAKER_FAILURES, SHEETS_BREAKER_RESET, on_open=lambda: start_sheets_recovery())
+
+class SheetsBreakerAdapter(requests.adapters.HTTPAdapter):
+    """Adaptador HTTP del cliente gspread: toda llamada a Google pasa por el circuit breaker."""
+
+    def send(self, request, **kwargs):
+        if not SHEETS_BREAKER.allow_request():
+            raise SheetsUnavailable(f"Circuito abierto: no se llama a {request.url.split('?')[0]}")
+        try:
+            with timed_sheets_call():
+                response = super().send(request, **kwargs)
+                if not kwargs.get("stream"):
+                    # Se descarga aquí el cuerpo: response.elapsed solo cubre hasta las cabeceras
+                    # y un get_all_records grande tarda más en bajar que en responder.
+                    response.content
+        except requests.RequestException as e:
+            SHEETS_BREAKER.record_failure(e)
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            SHEETS_BREAKER.record_failure(f"HTTP {response.status_code}")
+        else:
+            SHEETS_BREAKER.record_success()
+        return response
+
+class UnavailableWorksheet:
+    """
+    Pestaña que no se pudo abrir con el circuito abierto. get_all_records_cached la acepta
+    (sirve la copia en caché); cualquier otra operación lanza SheetsUnavailable.
+    """
+    def __init__(self, ws_name):
+        self.ws_name = ws_name
+
+    def __getattr__(self, name):
+        raise SheetsUnavailable(f"{self.ws_name}: Google Sheets no disponible")
+
+class LazyWorksheet:
+    """Pestaña que se abre en el primer acceso real (las lecturas servidas desde caché no la abren)."""
+    def __init__(self, opener):
+        self._opener = opener
+        self._ws = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._ws is None:
+            with self._lock:
+                if self._ws is None:
+                    self._ws = self._opener()
+        return getattr(self._ws, name)
+
+def mark_stale(ws_name):
+    """Anota que la respuesta actual usa una copia vieja de la hoja (ver flag_stale_response)."""
+    if has_request_context():
+        g.setdefault("stale_sheets", set()).add(ws_name)
+
+@app.after_request
+def flag_stale_response(response):
+    stale = g.get("stale_sheets")
+    if stale:
+        response.headers["X-Data-Stale"] = "true"
+        response.headers["X-Data-Stale-Sheets"] = ",".join(sorted(stale))
+    return response
+
+@app.errorhandler(SheetsUnavailable)
+def sheets_unavailable(e):
+    return jsonify({
+        "error": "sheets_unavailable",
+        "message": "Google Sheets no está disponible en este momento. Inténtalo de nuevo en unos minutos.",
+        "retry_in": SHEETS_BREAKER.status()["retry_in"],
+    }), 503
+
+def sheets_health_check():
+    """Llamada mínima a Sheets (fila de cabeceras de una pestaña ya abierta) para probar el circuito."""
+    client = get_gspread_client()
+    opened = [ws for owner, ws in WORKSHEETS.values() if owner is client]
+    ws = opened[0] if opened else ensure_sheet_with_headers(client, PRESUPUESTO_WS_NAME, PRESUPUESTO_HEADERS)
+    ws.row_values(1)
+
+_RECOVERY = {"thread": None}
+_RECOVERY_LOCK = threading.Lock()
+
+def start_sheets_recovery():
+    """Lanza (una vez por proceso) el hilo que prueba Sheets hasta cerrar el circuito."""
+    with _RECOVERY_LOCK:
+        thread = _RECOVERY["thread"]
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=_sheets_recovery_loop, name="sheets-recovery", daemon=True)
+        _RECOVERY["thread"] = thread
+        thread.start()
+
+def _sheets_recovery_loop():
+    while SHEETS_BREAKER.state != "closed":
+        time.sleep(max(SHEETS_BREAKER.seconds_until_trial(), 0.1))
+        if SHEETS_BREAKER.state == "closed":
+            break  # una petición de usuario ya hizo de llamada de prueba
+        try:
+            sheets_health_check()
+        except Exception as e:
+            app.logger.warning(f"⚠️ Google Sheets sigue sin responder: {e}")
+    replay_queued_writes()
+
+
 # ----------------------------
 # CACHE DE DATOS (CRÍTICO PARA RESOLVER EL ERROR 429)
 # ----------------------------
-CACHE = {}
+CACHE = OrderedDict()  # ws_name -> {'data': SheetTable, 'expires', 'generation', 'signal'} (orden LRU)
 CACHE_TTL = 5  # Tiempo de vida del caché en segundos
+# Presupuesto de memoria de la caché local (Render free: 512 MB por instancia)
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 128 * 1024 * 1024))
+_CACHE_LOCK = threading.Lock()
+
+# Capa compartida entre workers de gunicorn (SQLite local). SHARED_CACHE_PATH="" la desactiva.
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", shared_cache.DEFAULT_PATH)
+SHARED_CACHE = shared_cache.SharedCache(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else None
+SHARED_FILL_WAIT = 5.0  # segundos máximos esperando a que otro worker termine de leer la hoja
+
+# Snapshots en disco para arrancar con datos (SNAPSHOT_DIR="" los desactiva). En Render
+# conviene apuntarlo a un disco persistente para que sobrevivan a los deploys.
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", snapshot_store.DEFAULT_DIR)
+SNAPSHOTS = snapshot_store.SnapshotStore(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+# Segundos que se sirve un snapshot recién cargado antes de exigir reconciliarlo con Sheets
+SNAPSHOT_GRACE = float(os.environ.get("SNAPSHOT_GRACE", 30))
+SNAPSHOT_STATE = {"loaded": {}}
+# Un solo hilo escribe los snapshots: la petición que descargó la hoja no espera al disco
+_SNAPSHOT_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-writer")
+
+def _cache_generation(ws_name):
+    return SHARED_CACHE.generation(ws_name) if SHARED_CACHE else 0
+
+def _cache_get(ws_name):
+    with _CACHE_LOCK:
+        entry = CACHE.get(ws_name)
+        if entry is not None:
+            CACHE.move_to_end(ws_name)
+        return entry
+
+def _cache_set(ws_name, data, expires, generation, signal=None, snapshot=False):
+    """
+    Guarda la hoja en la caché local y expulsa las menos usadas si se supera CACHE_MAX_BYTES.
+    snapshot=True marca una copia cargada de disco que aún no se comparó con Sheets.
+    """
+    with _CACHE_LOCK:
+        CACHE[ws_name] = {'data': data, 'expires': expires, 'generation': generation, 'signal': signal,
+                          'snapshot': snapshot}
+        CACHE.move_to_end(ws_name)
+        total = sum(e['data'].nbytes for e in CACHE.values())
+        while total > CACHE_MAX_BYTES and len(CACHE) > 1:
+            evicted_name, evicted = CACHE.popitem(last=False)
+            total -= evicted['data'].nbytes
+            app.logger.warning(f"⚠️ Caché local llena: se expulsa {evicted_name} ({evicted['data'].nbytes} bytes)")
+
+def cache_stats():
+    """Medidor de memoria de la caché local (y RSS del proceso en Linux)."""
+    with _CACHE_LOCK:
+        sheets = {name: {"rows": len(e['data']), "bytes": e['data'].nbytes} for name, e in CACHE.items()}
+    stats = {
+        "entries": len(sheets),
+        "bytes": sum(v["bytes"] for v in sheets.values()),
+        "budget_bytes": CACHE_MAX_BYTES,
+        "sheets": sheets,
+    }
+    try:
+        with open("/proc/self/statm") as f:
+            stats["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    return stats
+
+def _to_table(ws_name, records):
+    return SheetTable.from_records(records, SHEET_HEADERS.get(ws_name, []), NUMERIC_COLUMNS.get(ws_name, ()))
+
+def invalidate_cache(ws_name):
+    """Invalida la hoja en este worker y en todos los demás (después de cada escritura)."""
+    with _CACHE_LOCK:
+        CACHE.pop(ws_name, None)
+    if SHARED_CACHE:
+        SHARED_CACHE.invalidate(ws_name)
+    if SNAPSHOTS:
+        # Por el mismo hilo que los guarda: queda después de cualquier guardado pendiente
+        _SNAPSHOT_WRITER.submit(SNAPSHOTS.discard, ws_name)
+
+def replace_cached_table(ws_name, table):
+    """
+    Tras una escritura propia cuyo efecto ya se conoce, publica la copia corregida en vez de
+    descargar la hoja: invalida (los demás workers ven la generación nueva) y guarda la tabla
+    en esa generación, local y compartida. Sin señal de cambio: al expirar se vuelve a leer.
+    """
+    invalidate_cache(ws_name)
+    generation = _cache_generation(ws_name)
+    expires = time.time() + CACHE_TTL
+    _cache_set(ws_name, table, expires, generation)
+    if SHARED_CACHE:
+        SHARED_CACHE.put(ws_name, table.to_bytes(), expires, generation)
+
+def save_snapshot(ws_name, data, generation, signal):
+    """Escribe en disco (en segundo plano) la copia recién descargada de la hoja."""
+    if SNAPSHOTS:
+        _SNAPSHOT_WRITER.submit(SNAPSHOTS.save, ws_name, data.to_marshal(), generation, signal)
+
+def load_snapshots():
+    """
+    Carga en la caché local los snapshots de disco. Se llama al importar el módulo: con
+    preload_app los workers heredan las tablas por fork y la primera petición se sirve sin
+    tocar Sheets (marcada como vieja). warm_up() las reconcilia después con el probe.
+    """
+    if not SNAPSHOTS:
+        return {}
+    started = time.time()
+    loaded = {}
+    for ws_name in SHEET_HEADERS:
+        snap = SNAPSHOTS.load(ws_name)
+        if snap is None:
+            continue
+        meta, payload = snap
+        generation = _cache_generation(ws_name)
+        if meta.get("generation", 0) != generation:
+            # Otro worker escribió en la hoja después de guardarlo (una descarga que empezó
+            # antes de la escritura puede guardar su copia después de borrarse el snapshot)
+            app.logger.info(f"💾 Snapshot de {ws_name} descartado: generación {meta.get('generation')} != {generation}")
+            continue
+        try:
+            data = SheetTable.from_marshal(payload, NUMERIC_COLUMNS.get(ws_name, ()))
+        except (ValueError, TypeError, EOFError) as e:
+            app.logger.warning(f"⚠️ Snapshot de {ws_name} ilegible: {e}")
+            continue
+        _cache_set(ws_name, data, time.time() + SNAPSHOT_GRACE, generation, meta.get("signal"), snapshot=True)
+        loaded[ws_name] = {"rows": len(data), "saved_at": meta["saved_at"], "signal": meta.get("signal")}
+    SNAPSHOT_STATE["loaded"] = loaded
+    if loaded:
+        app.logger.info(f"💾 {len(loaded)} snapshots cargados de {SNAPSHOT_DIR} en {time.time() - started:.3f}s")
+    return loaded
+
+def _expire_local(ws_name):
+    """Vence la copia local sin borrarla (sigue sirviendo como copia vieja y para el probe)."""
+    with _CACHE_LOCK:
+        entry = CACHE.get(ws_name)
+        if entry is not None:
+            entry['expires'] = 0
+
+load_snapshots()
+
+# --- Detección de cambios barata antes de volver a descargar una hoja ---
+# Un "probe" recibe (ws, ws_name) y devuelve una señal (str) que cambia cuando la hoja
+# cambia, o None si no la puede obtener (en ese caso se descarga la hoja completa).
+# Las escrituras de la app ya invalidan por generación; el probe detecta las ediciones
+# hechas fuera de la app (p. ej. a mano en Google Sheets).
+def drive_modified_probe(ws, ws_name):
+    """Señal = modifiedTime del archivo en Drive (una llamada de metadatos)."""
+    return ws.spreadsheet.get_lastUpdateTime()
+
+def row_count_probe(ws, ws_name):
+    """Señal = número de filas con fecha (no detecta ediciones de celdas existentes)."""
+    return str(len(ws.col_values(1)))
+
+_PROBE_STATE = {"drive_failed": False}
+
+def _default_change_probe(ws, ws_name):
+    """Drive modifiedTime y, si el alcance drive.file no lo permite, conteo de filas."""
+    if not _PROBE_STATE["drive_failed"]:
+        try:
+            return drive_modified_probe(ws, ws_name)
+        except gspread.exceptions.APIError as e:
+            if e.code not in (403, 404):
+                raise  # 429 / 5xx: caída temporal, no falta de permisos
+            app.logger.warning(f"⚠️ Probe de Drive no disponible ({e}); se usa el conteo de filas.")
+            _PROBE_STATE["drive_failed"] = True
+    return row_count_probe(ws, ws_name)
+
+_CHANGE_PROBE_MODES = {
+    "auto": _default_change_probe,
+    "drive": drive_modified_probe,
+    "rows": row_count_probe,
+    "none": None,
+}
+CHANGE_PROBE = _CHANGE_PROBE_MODES.get(os.environ.get("CHANGE_PROBE", "auto"), _default_change_probe)
+CHANGE_PROBES = {}  # ws_name -> probe (sobrescribe CHANGE_PROBE para esa hoja)
+
+def set_change_probe(probe, ws_name=None):
+    """Reemplaza el probe global o el de una hoja (p. ej. un stub local en pruebas)."""
+    global CHANGE_PROBE
+    if ws_name is None:
+        CHANGE_PROBE = probe
+    else:
+        CHANGE_PROBES[ws_name] = probe
+
+def _probe_signal(ws, ws_name):
+    probe = CHANGE_PROBES.get(ws_name, CHANGE_PROBE)
+    if probe is None:
+        return None
+    try:
+        signal = probe(ws, ws_name)
+        return None if signal is None else str(signal)
+    except Exception as e:
+        app.logger.warning(f"⚠️ Probe de cambios falló para {ws_name}: {e}")
+        return None
+
+def _load_shared(ws_name, generation, now, allow_expired=False):
+    """
+    Retorna la entrada de la capa compartida si es de la generación actual
+    (y no expiró, salvo allow_expired). La guarda también en la caché local.
+    """
+    if not SHARED_CACHE:
+        return None
+    entry = SHARED_CACHE.get(ws_name)
+    if entry is None:
+        return None
+    entry_generation, expires, blob, signal = entry
+    if entry_generation != generation or (now >= expires and not allow_expired):
+        return None
+    local = _cache_get(ws_name)
+    if local and local['generation'] == generation and local.get('signal') == signal:
+        # Misma copia que ya tenemos: no hace falta volver a deserializar
+        data = local['data']
+    else:
+        data = SheetTable.from_bytes(blob, NUMERIC_COLUMNS.get(ws_name, ()))
+    _cache_set(ws_name, data, expires, generation, signal)
+    return _cache_get(ws_name)
+
+def _stale_or_raise(ws_name, generation, now, error):
+    """Última copia conocida (compartida o local, aunque haya expirado) marcada como vieja."""
+    entry = _load_shared(ws_name, generation, now, allow_expired=True) or _cache_get(ws_name)
+    if entry is None:
+        raise error
+    mark_stale(ws_name)
+    return entry['data']
 
 def get_all_records_cached(ws, ws_name):
     """
     Retorna todos los registros de la hoja, usando caché si los datos
     no han expirado (TTL). Solo aplica a operaciones GET.
+    Orden: caché local del worker -> caché compartida -> probe de cambios -> Google Sheets.
+    Con el circuito abierto o si Sheets falla, retorna la última copia (marcada como vieja).
+    Retorna un SheetTable (filas compactas con r.get(...) como los dicts de gspread).
     """
     now = time.time()
     cache_key = ws_name
+    generation = _cache_generation(cache_key)
     
-    # 1. Intentar servir desde caché
-    if cache_key in CACHE and now < CACHE[cache_key]['expires']:
+    # 1. Intentar servir desde caché (local y, si no, la compartida entre workers)
+    entry = _cache_get(cache_key)
+    if entry and entry.get('generation', 0) == generation and now < entry['expires']:
         # app.logger.info(f"Serving {ws_name} from cache.")
-        return CACHE[cache_key]['data']
+        if not entry['snapshot']:
+            return entry['data']
+        # Snapshot de disco sin reconciliar: mejor la copia de otro worker si ya la tiene
+        shared = _load_shared(cache_key, generation, now)
+        if shared is not None:
+            return shared['data']
+        mark_stale(cache_key)
+        return entry['data']
+
+    shared = _load_shared(cache_key, generation, now)
+    if shared is not None:
+        return shared['data']
+
+    # Circuito abierto: no se llama a Google, se sirve la última copia disponible
+    if SHEETS_BREAKER.is_open() or isinstance(ws, UnavailableWorksheet):
+        return _stale_or_raise(cache_key, generation, now, SheetsUnavailable(f"{ws_name}: circuito abierto"))
+
+    # Si otro worker ya está leyendo esta hoja, esperamos su resultado en vez de repetir la lectura
+    locked = True
+    if SHARED_CACHE:
+        locked = SHARED_CACHE.acquire_fill_lock(cache_key)
+        deadline = now + SHARED_FILL_WAIT
+        while not locked and time.time() < deadline:
+            time.sleep(0.05)
+            shared = _load_shared(cache_key, generation, time.time())
+            if shared is not None:
+                return shared['data']
+            locked = SHARED_CACHE.acquire_fill_lock(cache_key)
 
-    # 2. Leer de Google Sheets (consume cuota)
-    # app.logger.info(f"Reading {ws_name} from Google Sheets.")
     try:
-        data = ws.get_all_records()
+        # 2. La copia expiró: si la señal de cambio es la misma, solo extendemos su vida
+        stale = _load_shared(cache_key, generation, now, allow_expired=True) or _cache_get(cache_key)
+        with timed_phase("probe"):
+            signal = _probe_signal(ws, cache_key)
+        if (stale and stale['generation'] == generation and signal is not None
+                and stale.get('signal') == signal):
+            expires = time.time() + CACHE_TTL
+            _cache_set(cache_key, stale['data'], expires, generation, signal)
+            if SHARED_CACHE:
+                SHARED_CACHE.touch(cache_key, generation, expires)
+            return stale['data']
+
+        # 3. Leer de Google Sheets (consume cuota)
+        # app.logger.info(f"Reading {ws_name} from Google Sheets.")
+        with timed_phase("sheets_read"):
+            # Sin numericise de gspread: quita todas las comas ("6,50" -> 650); los números
+            # se convierten una sola vez en SheetTable con parse_number
+            records = ws.get_all_records(numericise_ignore=["all"])
+        data = _to_table(cache_key, records)
         
-        # 3. Guardar en caché
-        CACHE[cache_key] = {
-            'data': data,
-            'expires': now + CACHE_TTL
-        }
+        # 4. Guardar en caché (local, compartida y snapshot en disco)
+        expires = time.time() + CACHE_TTL
+        _cache_set(cache_key, data, expires, generation, signal)
+        if SHARED_CACHE:
+            SHARED_CACHE.put(cache_key, data.to_bytes(), expires, generation, signal)
+        save_snapshot(cache_key, data, generation, signal)
         return data
     except Exception as e:
         app.logger.error(f"Error reading {ws_name} from Sheets: {e}")
         # Si falla leer de sheets, devuelve lo que sea que esté en caché si existe, o levanta el error.
-        if cache_key in CACHE:
-             return CACHE[cache_key]['data']
-        raise
+        return _stale_or_raise(cache_key, generation, now, e)
+    finally:
+        if SHARED_CACHE and locked:
+            SHARED_CACHE.release_fill_lock(cache_key)
+
+# --- Lectura de varias hojas en paralelo ---
+# Cada lectura a Google es I/O (libera el GIL): las hojas que una petición necesita y que no
+# están frescas en la caché local se piden a la vez en un pool compartido del worker, en
+# lugar de una tras otra. SHEETS_FANOUT_WORKERS=0 vuelve a la lectura secuencial.
+SHEETS_FANOUT_WORKERS = int(os.environ.get("SHEETS_FANOUT_WORKERS", 4))
+SHEETS_POOL_SIZE = int(os.environ.get("SHEETS_POOL_SIZE", 16))
+_SHEETS_FANOUT = (ThreadPoolExecutor(max_workers=SHEETS_FANOUT_WORKERS, thread_name_prefix="sheets-fanout")
+                  if SHEETS_FANOUT_WORKERS > 0 else None)
+
+def _is_fresh_locally(ws_name):
+    entry = _cache_get(ws_name)
+    return (entry is not None and not entry['snapshot'] and time.time() < entry['expires']
+            and entry.get('generation', 0) == _cache_generation(ws_name))
+
+def _with_request_context(fn):
+    """
+    Envuelve fn para correr en otro hilo con la petición actual y su mismo `g`
+    (Server-Timing y hojas servidas viejas se anotan en la petición original).
+    """
+    if not has_request_context():
+        return fn
+    parent_ctx = request_ctx._get_current_object()
+    parent_g = g._get_current_object()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        app_ctx = app.app_context()
+        app_ctx.g = parent_g
+        with app_ctx, parent_ctx.copy():
+            return fn(*args, **kwargs)
+    return wrapper
+
+def get_sheets_cached(client, ws_names):
+    """
+    get_all_records_cached de varias hojas: retorna {ws_name: SheetTable}. Las que no
+    están frescas en la caché local se abren y se leen en paralelo.
+    """
+    def load(ws_name):
+        ws = ensure_sheet_with_headers(client, ws_name, SHEET_HEADERS[ws_name])
+        return get_all_records_cached(ws, ws_name)
+
+    pending = [name for name in ws_names if not _is_fresh_locally(name)]
+    if _SHEETS_FANOUT is None or len(pending) < 2:
+        return {name: load(name) for name in ws_names}
+
+    futures = {name: _SHEETS_FANOUT.submit(_with_request_context(load), name) for name in pending}
+    tables = {name: load(name) for name in ws_names if name not in futures}
+    for name, future in futures.items():
+        tables[name] = future.result()
+    return {name: tables[name] for name in ws_names}
+
+# --- Índices derivados: se calculan una vez por copia de la hoja ---
+# Cada SheetTable es inmutable: cuando la caché carga una copia nueva (escritura,
+# expiración con cambios, otro worker) el índice se reconstruye en el siguiente uso.
+DERIVED_INDEXES = {}  # (ws_name, index_name) -> (SheetTable, valor)
+_DERIVED_LOCK = threading.Lock()
+
+def derived_index(ws_name, index_name, table, builder):
+    """Retorna builder(table) reutilizando el resultado mientras la copia de la hoja sea la misma."""
+    key = (ws_name, index_name)
+    cached = DERIVED_INDEXES.get(key)
+    if cached is not None and cached[0] is table:
+        return cached[1]
+    value = builder(table)
+    with _DERIVED_LOCK:
+        DERIVED_INDEXES[key] = (table, value)
+    return value
+
+def set_derived_index(ws_name, index_name, table, value):
+    """Registra un índice ya calculado para `table` (p. ej. corregido localmente tras una escritura)."""
+    with _DERIVED_LOCK:
+        DERIVED_INDEXES[(ws_name, index_name)] = (table, value)
+
+# ----------------------------
+# IDEMPOTENCIA DE ESCRITURAS (reintentos de conexiones móviles inestables)
+# ----------------------------
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", 24 * 3600))  # segundos
+IDEMPOTENCY_PENDING_TTL = int(os.environ.get("IDEMPOTENCY_PENDING_TTL", 120))  # reserva de una petición en curso
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", 2000))
+# Las claves viven en la caché compartida (un reintento puede llegar a otro worker), hasta
+# IDEMPOTENCY_MAX_KEYS; este diccionario solo se usa si SQLite no está disponible.
+IDEMPOTENCY_STORE = OrderedDict()  # clave -> {'fingerprint', 'expires', 'response' (None = en curso)}
+IDEMPOTENCY_LOCK = threading.Lock()
+
+def _purge_idempotency_store(now):
+    """Elimina claves expiradas y recorta las más antiguas si se supera el límite."""
+    for key in [k for k, entry in IDEMPOTENCY_STORE.items() if entry['expires'] <= now]:
+        del IDEMPOTENCY_STORE[key]
+    while len(IDEMPOTENCY_STORE) > IDEMPOTENCY_MAX_KEYS:
+        IDEMPOTENCY_STORE.popitem(last=False)
+
+def _claim_idempotency_key(store_key, fingerprint, now):
+    """
+    Reserva la clave para esta petición. Retorna None si quedó reservada, o
+    (fingerprint, response) de la petición que ya la usó (response None = en curso).
+    """
+    pending_expires = now + IDEMPOTENCY_PENDING_TTL
+    if SHARED_CACHE:
+        claimed = SHARED_CACHE.claim_idempotency_key(store_key, fingerprint, pending_expires, IDEMPOTENCY_MAX_KEYS)
+        if claimed is not None:
+            is_new, entry = claimed
+            if is_new:
+                return None
+            stored_fingerprint, status, mimetype, body = entry
+            return stored_fingerprint, (None if status is None else (body, status, mimetype))
+
+    with IDEMPOTENCY_LOCK:
+        _purge_idempotency_store(now)
+        entry = IDEMPOTENCY_STORE.get(store_key)
+        if entry is not None:
+            return entry['fingerprint'], entry['response']
+        IDEMPOTENCY_STORE[store_key] = {'fingerprint': fingerprint, 'expires': pending_expires, 'response': None}
+    return None
+
+def _finish_idempotency_key(store_key, response):
+    """Guarda la respuesta (o libera la clave si fue un error del servidor)."""
+    with IDEMPOTENCY_LOCK:
+        local_entry = IDEMPOTENCY_STORE.get(store_key)
+        if local_entry is not None:
+            if response is None or response.status_code >= 500:
+                IDEMPOTENCY_STORE.pop(store_key, None)
+            else:
+                local_entry['expires'] = time.time() + IDEMPOTENCY_TTL
+                local_entry['response'] = (response.get_data(), response.status_code, response.mimetype)
+            return
+    if not SHARED_CACHE:
+        return
+    if response is None or response.status_code >= 500:
+        # Los errores del servidor no se guardan: el cliente debe poder reintentar
+        SHARED_CACHE.release_idempotency_key(store_key)
+    else:
+        SHARED_CACHE.finish_idempotency_key(
+            store_key, response.status_code, response.mimetype, response.get_data(), time.time() + IDEMPOTENCY_TTL
+        )
+
+def idempotent(view):
+    """
+    Decorador para endpoints de escritura. Si la petición trae la cabecera
+    'Idempotency-Key', la primera respuesta (no 5xx) se guarda y los reintentos con
+    la misma clave la reciben de vuelta sin volver a tocar Google Sheets, aunque
+    lleguen a otro worker.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        idem_key = request.headers.get("Idempotency-Key")
+        if request.method not in ("POST", "PUT", "DELETE") or not idem_key or not session.get('email'):
+            return view(*args, **kwargs)
+
+        # Con query string: /api/kilometraje?date=... escribe en otro día según el parámetro
+        store_key = json.dumps([session.get('email'), request.method, request.full_path.rstrip("?"), idem_key], ensure_ascii=False)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        existing = _claim_idempotency_key(store_key, fingerprint, time.time())
+        if existing is not None:
+            stored_fingerprint, stored_response = existing
+            if stored_fingerprint != fingerprint:
+                return jsonify({"error": "idempotency_key_reused", "message": "La clave de idempotencia ya se usó con otro contenido."}), 422
+            if stored_response is None:
+                return jsonify({"error": "request_in_progress", "message": "La petición original aún se está procesando."}), 409
+            body, status, mimetype = stored_response
+            replay = app.response_class(body, status=status, mimetype=mimetype)
+            replay.headers["Idempotent-Replayed"] = "true"
+            return replay
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            _finish_idempotency_key(store_key, None)
+            raise
+
+        _finish_idempotency_key(store_key, response)
+        return response
+    return wrapper
+
+# ----------------------------
+# COLA DE ESCRITURAS (circuito de Google Sheets abierto)
+# ----------------------------
+# Con el circuito abierto los POST no se pierden: se guardan (en la caché compartida,
+# visible para todos los workers) y se responde 202 {"status": "queued"}. Al cerrarse el
+# circuito se reenvían en orden contra el mismo endpoint, como si el usuario los enviara.
+# PUT/DELETE del presupuesto no se encolan: apuntan a un número de fila que podría
+# cambiar antes del reenvío, así que responden 503.
+REPLAY_ENVIRON_KEY = "tripcounter.write_replay"
+LOCAL_WRITE_QUEUE = OrderedDict()  # id -> (email, method, path, body) si no hay caché compartida
+_LOCAL_WRITE_IDS = {"next": 1}
+_WRITE_QUEUE_LOCK = threading.Lock()
+
+def enqueue_write(email, method, path, body):
+    body = json.dumps(body, ensure_ascii=False)
+    if SHARED_CACHE:
+        queue_id = SHARED_CACHE.enqueue_write(email, method, path, body)
+        if queue_id is not None:
+            return queue_id
+    with _WRITE_QUEUE_LOCK:
+        queue_id = f"local-{_LOCAL_WRITE_IDS['next']}"
+        _LOCAL_WRITE_IDS["next"] += 1
+        LOCAL_WRITE_QUEUE[queue_id] = (email, method, path, body)
+    return queue_id
+
+def queued_writes():
+    with _WRITE_QUEUE_LOCK:
+        pending = [(queue_id,) + item for queue_id, item in LOCAL_WRITE_QUEUE.items()]
+    return pending + (SHARED_CACHE.queued_writes() if SHARED_CACHE else [])
+
+def queued_write_count():
+    return len(LOCAL_WRITE_QUEUE) + (SHARED_CACHE.queued_write_count() if SHARED_CACHE else 0)
+
+def _remove_queued_write(queue_id):
+    with _WRITE_QUEUE_LOCK:
+        if LOCAL_WRITE_QUEUE.pop(queue_id, None) is not None:
+            return
+    if SHARED_CACHE:
+        SHARED_CACHE.delete_queued_write(queue_id)
+
+def _pin_write_date(body, today, now_hm, expense=False):
+    """
+    Fija 'fecha' (también en los items de listas, p. ej. /api/trips/bulk) al día en que se
+    recibió, y 'hora' de los gastos a la hora de recepción: si no, el reenvío las toma de su
+    propio reloj.
+    """
+    if isinstance(body, dict):
+        if not body.get("fecha"):
+            body["fecha"] = today
+        if expense and not body.get("hora"):
+            body["hora"] = now_hm
+        for key, value in body.items():
+            if isinstance(value, list):
+                for item in value:
+                    _pin_write_date(item, today, now_hm, expense=key == "expenses")
+    return body
+
+def queue_when_sheets_down(view):
+    """
+    Decorador para endpoints de escritura (va debajo de @idempotent, así un reintento del
+    cliente recibe el mismo 202 y no se encola dos veces).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # would_refuse y no is_open: en half_open con la prueba en curso la escritura también
+        # se rechazaría (SheetsUnavailable -> 500) y se perdería
+        if request.method == "GET" or not session.get('email') or not SHEETS_BREAKER.would_refuse():
+            return view(*args, **kwargs)
+        body = request.get_json(silent=True)
+        if request.method != "POST" or request.environ.get(REPLAY_ENVIRON_KEY) or not isinstance(body, dict):
+            raise SheetsUnavailable(f"{request.method} {request.path}: circuito abierto")
+        # Ruta con query string: p. ej. /api/kilometraje?date=... toma la fecha de ahí
+        path = request.full_path.rstrip("?")
+        now = datetime.now()
+        queue_id = enqueue_write(session['email'], request.method, path, _pin_write_date(
+            body, now.date().isoformat(), now.strftime('%H:%M'), expense=request.endpoint == "api_expenses"))
+        app.logger.warning(f"📥 Escritura encolada ({queue_id}) con Google Sheets no disponible: {request.method} {path}")
+        return jsonify({
+            "status": "queued",
+            "queued": True,
+            "queue_id": queue_id,
+            "message": "Google Sheets no está disponible: el registro se guardó y se enviará automáticamente.",
+        }), 202
+    return wrapper
+
+def replay_queued_writes():
+    """
+    Reenvía la cola en orden a través de la propia app. Se detiene si Sheets vuelve a
+    fallar (5xx); los 4xx (p. ej. duplicados) se descartan y quedan en el log.
+    Un candado compartido evita que dos workers reenvíen la misma cola.
+    """
+    if SHARED_CACHE and not SHARED_CACHE.acquire_fill_lock("__write_queue__", ttl=300):
+        return 0
+    replayed = 0
+    try:
+        http = app.test_client()
+        for queue_id, email, method, path, body in queued_writes():
+            if SHEETS_BREAKER.would_refuse():
+                break
+            with http.session_transaction() as replay_session:
+                replay_session['email'] = email
+            response = http.open(
+                path, method=method, data=body, content_type="application/json",
+                headers={"Idempotency-Key": f"replay-{queue_id}"},
+                environ_overrides={REPLAY_ENVIRON_KEY: True},
+            )
+            if response.status_code >= 500 or response.status_code == 409 and (
+                    (response.get_json(silent=True) or {}).get("error") == "request_in_progress"):
+                # 409 en curso: otro reenvío de la misma escritura aún no terminó (no es un rechazo)
+                app.logger.warning(f"⚠️ Reenvío de {queue_id} falló ({response.status_code}); se reintentará.")
+                break
+            if response.status_code >= 400:
+                app.logger.error(f"❌ Escritura encolada {queue_id} descartada ({response.status_code}): {method} {path} {body}")
+            _remove_queued_write(queue_id)
+            replayed += 1
+    finally:
+        if SHARED_CACHE:
+            SHARED_CACHE.release_fill_lock("__write_queue__")
+    if replayed:
+        app.logger.info(f"📤 {replayed} escrituras encoladas reenviadas a Google Sheets.")
+    return replayed
+
+# ----------------------------
+# EVENTOS EN VIVO (Server-Sent Events por usuario)
+# ----------------------------
+# Las escrituras publican lo que ya calcularon (viajes del día, bono, totales) y los
+# streams /api/events del mismo usuario lo reenvían: la pestaña que escribió no necesita
+# volver a pedir /api/trips y las demás pestañas/dispositivos quedan sincronizados.
+# Los eventos se guardan en la caché compartida para que lleguen a streams atendidos por
+# otros workers; en el mismo worker, además, una Condition despierta al stream al instante.
+SSE_MAX_STREAM = float(os.environ.get("SSE_MAX_STREAM", 300))  # segundos; EventSource reconecta solo
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", 4))  # por worker: no ocupar todos los hilos
+SSE_POLL_INTERVAL = 1.0  # segundos entre consultas de eventos de otros workers
+SSE_KEEPALIVE = 15.0
+EVENT_RETENTION = 600.0  # segundos que un evento puede recuperarse con Last-Event-ID
+
+class EventBus:
+    """Eventos por usuario: en la caché compartida (todos los workers) o en memoria del proceso."""
+
+    def __init__(self, shared, retention):
+        self.shared = shared
+        self.retention = retention
+        self._local = []  # (id, created, email, type, data) si no hay caché compartida
+        self._next_id = 1
+        self._cond = threading.Condition()
+
+    def publish(self, email, event_type, data):
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        with self._cond:
+            if self.shared:
+                event_id = self.shared.add_event(email, event_type, payload, self.retention)
+            else:
+                now = time.time()
+                event_id = self._next_id
+                self._next_id += 1
+                self._local = [e for e in self._local if e[1] >= now - self.retention]
+                self._local.append((event_id, now, email, event_type, payload))
+            self._cond.notify_all()
+        return event_id
+
+    def since(self, email, last_id):
+        if self.shared:
+            return self.shared.events_since(email, last_id)
+        with self._cond:
+            return [(e[0], e[3], e[4]) for e in self._local if e[2] == email and e[0] > last_id]
+
+    def last_id(self):
+        if self.shared:
+            return self.shared.last_event_id()
+        with self._cond:
+            return self._next_id - 1
+
+    def wait(self, timeout):
+        with self._cond:
+            self._cond.wait(timeout)
+
+EVENTS = EventBus(SHARED_CACHE, EVENT_RETENTION)
+_ACTIVE_STREAMS = {"count": 0}
+_STREAMS_LOCK = threading.Lock()
+
+def publish_event(event_type, data, email=None):
+    """Publica un evento para el usuario de la sesión (o `email`). Nunca interrumpe la escritura."""
+    email = email or session.get('email')
+    if not email:
+        return None
+    try:
+        return EVENTS.publish(email, event_type, data)
+    except Exception as e:
+        app.logger.warning(f"⚠️ No se pudo publicar el evento {event_type}: {e}")
+        return None
+
+def trips_day_event(fecha, trips_today, bonus):
+    """Payload del evento 'trips': viajes del día, bono y totales (lo que dibuja la página de viajes)."""
+    rows = [r.to_dict() if hasattr(r, "to_dict") else dict(r) for r in trips_today]
+    trips_total = round(sum(float(r.get("Total") or 0) for r in rows), 2)
+    return {
+        "fecha": fecha,
+        "trips": rows,
+        "new_bonus": bonus,
+        "day": {
+            "num_trips": len(rows),
+            "trips_total": trips_total,
+            "bonus": bonus,
+            "total_income": round(trips_total + bonus, 2),
+        },
+    }
 
 # ----------------------------
 # Debug inicial visible en Render logs
 # ----------------------------
-@app.before_request
 def startup_debug():
-    """Imprime variables de entorno clave solo una vez."""
-    if not getattr(app, "_startup_debug_done", False):
-        print("⚙️ DEBUG desde Flask startup:")
-        for key in ["GSPREAD_CLIENT_EMAIL", "FLASK_SECRET_KEY", "OAUTH_CLIENT_ID", "PRESUPUESTO_SHEET_ID", "TRIPS_SHEET_ID", "BONUS_SHEET_ID", "GASTOS_SHEET_ID", "EXTRAS_SHEET_ID", "KM_SHEET_ID", "SUMMARIES_SHEET_ID"]:
-            print(f"{key}: {'✅ OK' if os.getenv(key) else '❌ MISSING'}")
-        app._startup_debug_done = True
+    """Imprime variables de entorno clave (se llama una sola vez al importar el módulo)."""
+    print("⚙️ DEBUG desde Flask startup:")
+    for key in ["GSPREAD_CLIENT_EMAIL", "FLASK_SECRET_KEY", "OAUTH_CLIENT_ID", "PRESUPUESTO_SHEET_ID", "TRIPS_SHEET_ID", "BONUS_SHEET_ID", "GASTOS_SHEET_ID", "EXTRAS_SHEET_ID", "KM_SHEET_ID", "SUMMARIES_SHEET_ID"]:
+        print(f"{key}: {'✅ OK' if os.getenv(key) else '❌ MISSING'}")
+
+startup_debug()
 
 # ----------------------------
 # Google Sheets Client & Utilitarios
 # ----------------------------
+# Mapeo de nombres de hojas a variables de ID
+SHEET_ID_MAP = {
+    "TripCounter_Presupuesto": PRESUPUESTO_SHEET_ID,
+    "TripCounter_Trips": TRIPS_SHEET_ID,
+    "TripCounter_Bonuses": BONUS_SHEET_ID,
+    "TripCounter_Gastos": GASTOS_SHEET_ID,
+    "TripCounter_Extras": EXTRAS_SHEET_ID,
+    "TripCounter_Kilometraje": KM_SHEET_ID,
+    "TripCounter_Summaries": SUMMARIES_SHEET_ID,
+}
+
+# Cliente y pestañas abiertas por proceso: autorizar y abrir un archivo cuesta varias
+# llamadas HTTP, así que se hace una vez por worker (ver warm_up) y se reutiliza.
+_GSPREAD_CLIENT = None
+_GSPREAD_CLIENT_LOCK = threading.Lock()
+WORKSHEETS = {}  # ws_name -> (client, worksheet)
+
+class EmulatorSession(requests.Session):
+    """
+    Sesión HTTP que redirige las URLs de Google (Sheets v4 y Drive v3) a un emulador
+    local. Solo para pruebas de carga y desarrollo sin conexión.
+    """
+    GOOGLE_HOSTS = ("https://sheets.googleapis.com", "https://www.googleapis.com")
+
+    def __init__(self, host):
+        super().__init__()
+        self.base = f"http://{host}"
+
+    def request(self, method, url, *args, **kwargs):
+        for google_host in self.GOOGLE_HOSTS:
+            if url.startswith(google_host):
+                url = self.base + url[len(google_host):]
+                break
+        return super().request(method, url, *args, **kwargs)
+
+def instrument_gspread_client(client):
+    """
+    Hace pasar las llamadas HTTP a Google por el circuit breaker, que además las cuenta
+    y mide por petición (Server-Timing / log de lentas). El pool admite SHEETS_POOL_SIZE conexiones por host:
+    con el default de requests (10) los hilos de gthread y de la lectura en paralelo
+    descartarían conexiones y repetirían el handshake TLS.
+    """
+    http_session = client.http_client.session
+    # Un solo pool de conexiones keep-alive por worker, compartido por todos sus hilos
+    breaker_adapter = SheetsBreakerAdapter(pool_connections=4, pool_maxsize=SHEETS_POOL_SIZE)
+    http_session.mount("https://", breaker_adapter)
+    http_session.mount("http://", breaker_adapter)
+    return client
+
+@timed("client")
 def get_gspread_client():
+    """
+    Retorna el cliente de Google Sheets del proceso, creándolo la primera vez.
+    """
+    global _GSPREAD_CLIENT
+    if _GSPREAD_CLIENT is not None:
+        return _GSPREAD_CLIENT
+    with _GSPREAD_CLIENT_LOCK:
+        if _GSPREAD_CLIENT is None:
+            _GSPREAD_CLIENT = create_gspread_client()
+    return _GSPREAD_CLIENT
+
+def create_gspread_client():
     """
     Establece la conexión con Google Sheets reconstruyendo el JSON
     a partir de variables de entorno individuales (GSPREAD_*).
+    Con GSHEETS_EMULATOR_HOST (host:puerto) se conecta sin credenciales a un
+    servidor local que imita la API (loadtest/fake_sheets.py).
     """
+    emulator_host = os.getenv("GSHEETS_EMULATOR_HOST")
+    if emulator_host:
+        client = instrument_gspread_client(gspread.authorize(None, session=EmulatorSession(emulator_host)))
+        app.logger.info(f"🧪 Usando emulador de Google Sheets en {emulator_host}")
+        return client
+
     if not os.getenv("GSPREAD_PRIVATE_KEY") or not os.getenv("GSPREAD_CLIENT_EMAIL"):
         app.logger.error("❌ ERROR CRÍTICO DE CREDENCIALES: Faltan variables GSPREAD_PRIVATE_KEY o GSPREAD_CLIENT_EMAIL.")
         raise Exception("Error de configuración: Faltan variables de credenciales GSPREAD.")
@@ -167,34 +1391,33 @@ def get_gspread_client():
             ]
         )
 
-        client = gspread.authorize(credentials)
-        return client
+        return instrument_gspread_client(gspread.authorize(credentials))
     
     except Exception as e:
         app.logger.error(f"❌ ERROR CRÍTICO DE CREDENCIALES: Falló la reconstrucción o autorización. Detalle: {e}")
         raise Exception(f"Error de credenciales GSheets: {e}")
 
 # --- FUNCIÓN CORREGIDA FINAL (SOPORTE PARA TODOS LOS IDs) ---
-def ensure_sheet_with_headers(client, ws_name, headers, max_retries=3):
+@timed("open_sheet")
+def ensure_sheet_with_headers(client, ws_name, headers, max_retries=3, lazy=True):
     """
     Abre el Workbook (archivo) usando el ID si es una hoja crítica,
     o el nombre para archivos no críticos.
     """
+    # La pestaña ya se abrió y verificó en este proceso con el mismo cliente
+    cached = WORKSHEETS.get(ws_name)
+    if cached is not None and cached[0] is client:
+        return cached[1]
+    # Circuito abierto: sin reintentos ni esperas; las lecturas usarán la caché
+    if SHEETS_BREAKER.is_open():
+        return UnavailableWorksheet(ws_name)
+    # Recién arrancado con snapshot de disco: abrir la pestaña solo si se llega a usar
+    entry = _cache_get(ws_name)
+    if lazy and entry is not None and entry['snapshot']:
+        return LazyWorksheet(lambda: ensure_sheet_with_headers(client, ws_name, headers, max_retries, lazy=False))
+
     WORKBOOK_NAME = ws_name
-    SHEET_ID = None
-    
-    # Mapeo de nombres de hojas a variables de ID
-    ID_MAP = {
-        "TripCounter_Presupuesto": PRESUPUESTO_SHEET_ID,
-        "TripCounter_Trips": TRIPS_SHEET_ID,
-        "TripCounter_Bonuses": BONUS_SHEET_ID,
-        "TripCounter_Gastos": GASTOS_SHEET_ID,
-        "TripCounter_Extras": EXTRAS_SHEET_ID,
-        "TripCounter_Kilometraje": KM_SHEET_ID,
-        "TripCounter_Summaries": SUMMARIES_SHEET_ID,
-    }
-    
-    SHEET_ID = ID_MAP.get(WORKBOOK_NAME)
+    SHEET_ID = SHEET_ID_MAP.get(WORKBOOK_NAME)
 
     # Seleccionamos el método de apertura
     if SHEET_ID:
@@ -220,7 +1443,7 @@ def ensure_sheet_with_headers(client, ws_name, headers, max_retries=3):
                 app.logger.error(f"❌ ERROR CRÍTICO: Fallaron todos los {max_retries} intentos para abrir el archivo '{WORKBOOK_NAME}'. Error: {e}")
                 raise gspread.exceptions.SpreadsheetNotFound(f"Archivo '{WORKBOOK_NAME}' no encontrado después de reintentos (ID:{SHEET_ID}).") from e
         except Exception as e:
-            if attempt < max_retries - 1:
+            if attempt < max_retries - 1 and not SHEETS_BREAKER.is_open():
                 wait_time = 2 ** attempt
                 app.logger.warning(f"⚠️ Intento {attempt + 1} fallido por error inesperado. Reintentando en {wait_time}s. Error: {e}")
                 time.sleep(wait_time)
@@ -252,9 +1475,103 @@ def ensure_sheet_with_headers(client, ws_name, headers, max_retries=3):
         except:
             pass 
 
+    WORKSHEETS[ws_name] = (client, ws)
     return ws
 # --- FIN DE LA FUNCIÓN CORREGIDA FINAL ---
 
+def batch_update_cells(ws, cells):
+    """
+    Escribe varias celdas [(fila, columna, valor)] con una sola llamada (values.batchUpdate)
+    en lugar de un update_cell por celda. Usa USER_ENTERED igual que update_cell.
+    """
+    if not cells:
+        return None
+    data = [{"range": gspread.utils.rowcol_to_a1(row, col), "values": [[value]]} for row, col, value in cells]
+    return ws.batch_update(data, value_input_option=gspread.utils.ValueInputOption.user_entered)
+
+def delete_sheet_rows(ws, rows):
+    """Borra varias filas (números de hoja) con un solo batchUpdate, de la última a la primera."""
+    if not rows:
+        return None
+    return ws.spreadsheet.batch_update({"requests": [
+        {"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": row - 1, "endIndex": row}}}
+        for row in sorted(set(rows), reverse=True)
+    ]})
+
+
+# ----------------------------
+# WARM-UP DEL WORKER (llamado desde gunicorn.conf.py -> post_fork)
+# ----------------------------
+WARM_UP_WORKERS = int(os.environ.get("WARM_UP_WORKERS", len(SHEET_HEADERS)))
+WARM_STATE = {"status": "cold", "started": None, "finished": None, "errors": {}}
+_WARM_LOCK = threading.Lock()
+
+def warm_up():
+    """
+    Autoriza el cliente, abre todas las hojas de SHEET_ID_MAP en paralelo y precarga
+    la caché de cada una, para que la primera petición real no pague el arranque en frío.
+    """
+    WARM_STATE["started"] = time.time()
+    WARM_STATE["errors"] = {}
+    try:
+        client = get_gspread_client()
+    except Exception as e:
+        app.logger.error(f"❌ Warm-up: no se pudo autorizar el cliente de GSheets: {e}")
+        WARM_STATE["errors"]["client"] = str(e)
+        WARM_STATE["status"] = "failed"
+        return False
+
+    def _prime(ws_name):
+        ws = ensure_sheet_with_headers(client, ws_name, SHEET_HEADERS[ws_name])
+        entry = _cache_get(ws_name)
+        if entry is not None and entry['snapshot']:
+            # Reconciliar el snapshot de disco: el probe decide si basta con extenderlo
+            _expire_local(ws_name)
+        get_all_records_cached(ws, ws_name)
+
+    with ThreadPoolExecutor(max_workers=max(1, WARM_UP_WORKERS)) as pool:
+        futures = {pool.submit(_prime, ws_name): ws_name for ws_name in SHEET_HEADERS}
+        for future, ws_name in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                app.logger.error(f"❌ Warm-up: error precargando {ws_name}: {e}")
+                WARM_STATE["errors"][ws_name] = str(e)
+
+    WARM_STATE["finished"] = time.time()
+    WARM_STATE["status"] = "ready" if not WARM_STATE["errors"] else "failed"
+    app.logger.info(f"Warm-up {WARM_STATE['status']} en {WARM_STATE['finished'] - WARM_STATE['started']:.2f}s")
+    if WARM_STATE["status"] == "ready" and queued_write_count():
+        # Escrituras que quedaron encoladas (p. ej. un worker reiniciado durante una caída)
+        replay_queued_writes()
+    return WARM_STATE["status"] == "ready"
+
+def start_warm_up():
+    """Lanza warm_up() en un hilo de fondo (una sola vez por proceso, o de nuevo si falló)."""
+    with _WARM_LOCK:
+        if WARM_STATE["status"] in ("warming", "ready"):
+            return
+        WARM_STATE["status"] = "warming"
+    threading.Thread(target=warm_up, name="sheets-warm-up", daemon=True).start()
+
+@app.route("/ready")
+def readiness():
+    """Readiness check: 200 cuando el worker terminó el warm-up (o arrancó con snapshots de todas las hojas)."""
+    if WARM_STATE["status"] in ("cold", "failed"):
+        # Sin gunicorn.conf.py (p. ej. flask run) nadie lanzó el warm-up: lo lanzamos aquí
+        start_warm_up()
+    # Con snapshots de todas las hojas ya se puede servir mientras se reconcilian
+    from_snapshots = set(SNAPSHOT_STATE["loaded"]) >= set(SHEET_HEADERS)
+    code = 200 if WARM_STATE["status"] == "ready" or from_snapshots else 503
+    return jsonify({
+        "status": WARM_STATE["status"],
+        "errors": WARM_STATE["errors"],
+        "cache": cache_stats(),
+        "sheets": SHEETS_BREAKER.status(),
+        "queued_writes": queued_write_count(),
+        "snapshots": {name: info["rows"] for name, info in SNAPSHOT_STATE["loaded"].items()},
+    }), code
+
 
 # ----------------------------
 # FUNCIONES DE LÓGICA DE NEGOCIO
@@ -269,87 +1586,568 @@ def get_bonus_type(day_of_week):
         return 'DOM'
     return None
 
+def compile_bonus_rules(rules):
+    """
+    Convierte {tipo: {meta: bono}} en {tipo: (metas ordenadas, bonos acumulados)}.
+    acumulados[i] es el bono total con i metas cumplidas (acumulados[0] = 0.0), así el
+    bono de N viajes es acumulados[bisect_right(metas, N)].
+    """
+    compiled = {}
+    for bonus_type, goals in rules.items():
+        thresholds = tuple(sorted(goals))
+        totals = [0.0]
+        for goal in thresholds:
+            totals.append(totals[-1] + float(goals[goal]))
+        compiled[bonus_type] = (thresholds, tuple(totals))
+    return compiled
+
+BONUS_TIERS = compile_bonus_rules(BONUS_RULES)
+# Tabla por día de la semana (0=Lunes): evita resolver el tipo de bono en cada cálculo
+BONUS_TIERS_BY_WEEKDAY = tuple(BONUS_TIERS.get(get_bonus_type(d), ((), (0.0,))) for d in range(7))
+
+@lru_cache(maxsize=1024)
+def weekday_of(fecha):
+    """Día de la semana de una fecha 'YYYY-MM-DD' (None si no es válida)."""
+    try:
+        return date.fromisoformat(str(fecha)).weekday()
+    except ValueError:
+        return None
+
+def bonus_tier(fecha, num_trips):
+    """Retorna (metas, acumulados, metas cumplidas) para num_trips viajes en esa fecha."""
+    day_of_week = weekday_of(fecha)
+    if day_of_week is None:
+        return (), (0.0,), 0
+    thresholds, totals = BONUS_TIERS_BY_WEEKDAY[day_of_week]
+    return thresholds, totals, bisect_right(thresholds, num_trips)
+
 def calculate_current_bonus(records_today):
     """Calcula el bono total aplicable para el día basado en el número de viajes."""
     if not records_today:
         return 0.0
 
-    try:
-        trip_date = datetime.strptime(records_today[0]["Fecha"], '%Y-%m-%d').date()
-    except Exception:
-        return 0.0
-        
-    day_of_week = trip_date.weekday()
-    num_trips = len(records_today)
-    
-    rules = BONUS_RULES.get(get_bonus_type(day_of_week), {})
-    total_bonus = 0.0
-    
-    sorted_goals = sorted(rules.keys())
-    
-    for goal in sorted_goals:
-        if num_trips >= goal:
-            total_bonus += rules[goal]
+    _, totals, reached = bonus_tier(records_today[0]["Fecha"], len(records_today))
+    return totals[reached]
 
-    return total_bonus
+class TripRateHistogram:
+    """
+    Viajes por (día de la semana, hora de inicio) y días trabajados por día de la semana.
+    Se alimenta de la tabla de viajes cacheada: como la hoja solo crece por append, en cada
+    sync se procesan únicamente las filas nuevas; si la tabla se acorta o su última fila
+    procesada ya no coincide, se reconstruye desde cero.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.counts = [[0] * 24 for _ in range(7)]
+        self.days = [set() for _ in range(7)]
+        self.consumed = 0
+        self.last_key = None
+
+    @staticmethod
+    def _key(record):
+        return (str(record.get("Fecha")), str(record.get("Numero")), str(record.get("Hora inicio")))
+
+    def _add(self, record):
+        day_of_week = weekday_of(record.get("Fecha"))
+        try:
+            hour = int(str(record.get("Hora inicio")).split(":")[0])
+        except ValueError:
+            return
+        if day_of_week is None or not 0 <= hour < 24:
+            return
+        self.counts[day_of_week][hour] += 1
+        self.days[day_of_week].add(str(record.get("Fecha")))
+
+    def sync(self, records):
+        with self._lock:
+            if len(records) < self.consumed or (self.consumed and self._key(records[self.consumed - 1]) != self.last_key):
+                self._reset()
+            for i in range(self.consumed, len(records)):
+                self._add(records[i])
+            if len(records) > self.consumed:
+                self.consumed = len(records)
+                self.last_key = self._key(records[-1])
+
+    def hourly_rates(self, day_of_week):
+        """Viajes esperados por hora (promedio de los días trabajados) y días de muestra."""
+        with self._lock:
+            days = len(self.days[day_of_week])
+            counts = list(self.counts[day_of_week])
+        if not days:
+            return [0.0] * 24, 0
+        return [c / days for c in counts], days
+
+TRIP_RATES = TripRateHistogram()
+
+def project_minutes_to(trips_needed, rates, start):
+    """
+    Recorre el resto del día hora por hora acumulando los viajes esperados desde `start`
+    (datetime). Retorna (minutos hasta la meta o None si no se alcanza hoy, viajes esperados
+    hasta fin del día).
+    """
+    expected = 0.0
+    minute = start.hour * 60 + start.minute
+    elapsed = 0.0
+    found = None
+    while minute < 24 * 60:
+        hour, offset = divmod(minute, 60)
+        span = 60 - offset
+        gained = rates[hour] * span / 60
+        if found is None and gained > 0 and expected + gained >= trips_needed:
+            found = elapsed + (trips_needed - expected) / rates[hour] * 60
+        expected += gained
+        elapsed += span
+        minute += span
+    return (round(found) if found is not None else None), round(expected, 2)
 
 def update_daily_bonus_sheet(client, fecha, total_bonus):
     """Guarda o actualiza el bono diario total en la hoja 'TripCounter_Bonuses'."""
+    update_daily_bonuses_sheet(client, {fecha: total_bonus})
+    return total_bonus
+
+def update_daily_bonuses_sheet(client, bonuses_by_date):
+    """
+    Guarda o actualiza varios bonos diarios ({fecha: bono}) con una sola lectura,
+    un solo batch_update para las fechas existentes y un solo append_rows para las nuevas.
+    """
+    if not bonuses_by_date:
+        return bonuses_by_date
+
     ws_bonuses = ensure_sheet_with_headers(client, BONUS_WS_NAME, BONUS_HEADERS)
-    
+
     # Usamos la versión no-cached para operaciones que escriben/actualizan
-    records = ws_bonuses.get_all_records() 
-    found = False
-    
+    records = ws_bonuses.get_all_records()
+    row_by_date = {}
     for i, r in enumerate(records):
-        if str(r.get("Fecha")) == str(fecha):
-            row_index = i + 2 
-            col_index = BONUS_HEADERS.index("Bono total") + 1
-            ws_bonuses.update_cell(row_index, col_index, total_bonus)
-            found = True
-            break
-            
-    if not found:
-        new_row = [fecha, total_bonus]
-        ws_bonuses.append_row(new_row)
-        
+        row_by_date.setdefault(str(r.get("Fecha")), i + 2)
+
+    col_index = BONUS_HEADERS.index("Bono total") + 1
+    updates = []
+    new_rows = []
+    for fecha, total_bonus in bonuses_by_date.items():
+        row_index = row_by_date.get(str(fecha))
+        if row_index:
+            updates.append((row_index, col_index, total_bonus))
+        else:
+            new_rows.append([fecha, total_bonus])
+
+    if updates:
+        batch_update_cells(ws_bonuses, updates)
+    if new_rows:
+        ws_bonuses.append_rows(new_rows)
+
     # CRÍTICO: Invalidar la caché después de una escritura
-    CACHE.pop(BONUS_WS_NAME, None)
-    
-    return total_bonus
+    invalidate_cache(BONUS_WS_NAME)
+    for fecha in bonuses_by_date:
+        mark_month_dirty(fecha)
+
+    return bonuses_by_date
+
+def parse_trip_payload(body):
+    """
+    Valida el JSON de un viaje y retorna el diccionario normalizado.
+    Lanza ValueError("invalid_monto") si el monto no es numérico.
+    """
+    fecha = body.get("fecha") or date.today().isoformat()
+    hora_inicio = str(body.get("hora_inicio","")).strip()
+    hora_fin = str(body.get("hora_fin","")).strip()
+
+    try:
+        monto = float(body.get("monto", 0))
+    except Exception:
+        raise ValueError("invalid_monto")
+
+    propina = 0.0
+    try:
+        propina = float(body.get("propina", 0)) if body.get("propina") else 0.0
+    except Exception:
+        propina = 0.0
+
+    aeropuerto_flag = bool(body.get("aeropuerto", False))
+    aeropuerto_val = AIRPORT_FEE if aeropuerto_flag else 0.0
+    total = round(monto + propina + aeropuerto_val, 2)
+
+    return {
+        "fecha": fecha,
+        "hora_inicio": hora_inicio,
+        "hora_fin": hora_fin,
+        "monto": monto,
+        "propina": propina,
+        "aeropuerto": aeropuerto_val,
+        "total": total,
+    }
+
+def parse_extra_payload(body):
+    """Valida el JSON de un viaje extra. El monto inválido se toma como 0 (igual que /api/extras)."""
+    fecha = body.get("fecha") or date.today().isoformat()
+    hi = str(body.get("hora_inicio","")).strip()
+    hf = str(body.get("hora_fin","")).strip()
+    try:
+        monto = float(body.get("monto",0))
+    except Exception:
+        monto = 0.0
+    return {"fecha": fecha, "hora_inicio": hi, "hora_fin": hf, "monto": monto, "total": round(monto, 2)}
+
+def parse_expense_payload(body):
+    """
+    Valida el JSON de un gasto.
+    Lanza ValueError con el mensaje para el usuario si el monto no es válido.
+    """
+    fecha = body.get("fecha") or date.today().isoformat()
+    hora = body.get("hora") or datetime.now().strftime('%H:%M')
+    categoria = str(body.get("categoria", "")).strip()
+    descripcion = str(body.get("descripcion", "")).strip()
+
+    try:
+        monto = float(body.get("monto", 0))
+    except Exception:
+        raise ValueError("El monto debe ser numérico.")
+    if monto <= 0:
+        raise ValueError("El monto debe ser un valor positivo.")
+
+    return {"fecha": fecha, "hora": hora, "monto": monto, "categoria": categoria, "descripcion": descripcion}
+
+# --- Snapshots de meses cerrados (TripCounter_Summaries) ---
+# Un mes ya terminado no cambia salvo que una escritura caiga en él: se sirve desde
+# el resumen guardado (y su copia en memoria) y solo se recalcula si está marcado.
+# Un resumen calculado con el mes aún abierto no sirve como snapshot (las escrituras en
+# un mes abierto no lo marcan): se recalcula una vez cerrado. La copia en memoria vale
+# mientras no cambie la generación de TripCounter_Summaries (otro worker la recalculó).
+MONTHLY_SNAPSHOTS = {}  # "YYYY-MM" -> (generación de Summaries, reporte)
+DIRTY_MONTHS = set()    # se usa solo si la caché compartida está desactivada
+
+def month_key(year, month):
+    return f"{int(year):04d}-{int(month):02d}"
+
+def is_closed_month(year, month, today=None):
+    today = today or date.today()
+    return (int(year), int(month)) < (today.year, today.month)
+
+def month_end(year, month):
+    """Último día del mes."""
+    if int(month) == 12:
+        return date(int(year), 12, 31)
+    return date(int(year), int(month) + 1, 1) - timedelta(days=1)
+
+def is_final_summary(r, year, month):
+    """True si la fila de TripCounter_Summaries se calculó después de terminar el mes."""
+    return str(r.get("Calculado") or "") > month_end(year, month).isoformat()
+
+def mark_month_dirty(fecha):
+    """Marca el mes de 'fecha' (YYYY-MM-DD) para recalcular si es un mes cerrado."""
+    try:
+        year, month = int(str(fecha)[:4]), int(str(fecha)[5:7])
+    except ValueError:
+        return
+    if not is_closed_month(year, month):
+        return
+    key = month_key(year, month)
+    MONTHLY_SNAPSHOTS.pop(key, None)
+    if SHARED_CACHE:
+        SHARED_CACHE.add_mark(f"dirty_month:{key}")
+    else:
+        DIRTY_MONTHS.add(key)
+
+def is_month_dirty(key):
+    if SHARED_CACHE:
+        return SHARED_CACHE.has_mark(f"dirty_month:{key}")
+    return key in DIRTY_MONTHS
+
+def clear_month_dirty(key):
+    if SHARED_CACHE:
+        SHARED_CACHE.clear_mark(f"dirty_month:{key}")
+    DIRTY_MONTHS.discard(key)
+
+def summary_row_to_report(r):
+    """Convierte una fila de TripCounter_Summaries al formato de /api/monthly_report."""
+    def num(col):
+        value = r.get(col)
+        return float(value) if isinstance(value, (int, float)) else 0.0
+    return {
+        "month": int(r.get("Mes")),
+        "year": int(r.get("Año")),
+        "total_km": num("KM Recorrido"),
+        "total_trips": int(num("Viajes Totales")),
+        "total_gross_income": num("Ingreso Bruto"),
+        "total_bonus": num("Bono Total"),
+        "total_expenses": num("Gasto Total"),
+        "net_income": num("Ganancia Neta"),
+        "productivity_per_km": num("Productividad S/KM"),
+    }
+
+def get_closed_month_snapshot(client, year, month):
+    """
+    Reporte guardado de un mes cerrado (memoria -> TripCounter_Summaries en caché) o None
+    si no hay fila o si se calculó con el mes todavía abierto.
+    """
+    key = month_key(year, month)
+    generation = _cache_generation(SUMMARIES_WS_NAME)
+    cached = MONTHLY_SNAPSHOTS.get(key)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    ws_summaries = ensure_sheet_with_headers(client, SUMMARIES_WS_NAME, SUMMARIES_HEADERS)
+    for r in get_all_records_cached(ws_summaries, SUMMARIES_WS_NAME):
+        if str(r.get("Mes")) == str(month) and str(r.get("Año")) == str(year):
+            if not is_final_summary(r, year, month):
+                return None
+            report = summary_row_to_report(r)
+            MONTHLY_SNAPSHOTS[key] = (generation, report)
+            return report
+    return None
+
+# --- PRESUPUESTO: IDS ESTABLES ---
+# Cada ítem lleva un id en la columna "id". PUT/DELETE lo usan en lugar de la fila: tras un
+# delete_rows todas las filas siguientes se corren y un row_index guardado por el cliente (o
+# sacado de una copia vieja de la caché) podría apuntar a otro ítem.
+BUDGET_ID_COL = PRESUPUESTO_HEADERS.index("id") + 1
+BUDGET_ALIAS_COL = PRESUPUESTO_HEADERS.index("alias") + 1
+
+def new_budget_id():
+    # Con prefijo: gspread convierte a número los valores que lo parecen (p. ej. "12e4...")
+    return f"p{uuid.uuid4().hex[:11]}"
+
+def build_budget_id_map(records):
+    """({id: fila}, [filas sin id]) de la copia de la hoja de presupuesto."""
+    id_map, missing = {}, []
+    for row, r in enumerate(records, start=2):
+        item_id = r.get("id")
+        if item_id:
+            id_map[str(item_id)] = row
+        else:
+            missing.append(row)
+    return id_map, missing
+
+def ensure_budget_ids(ws, records):
+    """
+    Asigna id (una sola escritura en lote) a los ítems creados antes de existir la columna.
+    Un worker a la vez; relee la columna id para no pisar ids que otro acaba de asignar.
+    Retorna True si escribió (la caché queda invalidada).
+    """
+    _, missing = derived_index(PRESUPUESTO_WS_NAME, "ids", records, build_budget_id_map)
+    if not missing or SHEETS_BREAKER.is_open():
+        return False
+    if SHARED_CACHE and not SHARED_CACHE.acquire_fill_lock("__budget_ids__", ttl=30):
+        return False
+    try:
+        column = ws.col_values(BUDGET_ID_COL)
+        cells = [(row, BUDGET_ID_COL, new_budget_id()) for row in missing
+                 if row > len(column) or not column[row - 1]]
+        if cells:
+            batch_update_cells(ws, cells)
+            app.logger.info(f"Presupuesto: ids asignados a {len(cells)} ítems.")
+        invalidate_cache(PRESUPUESTO_WS_NAME)
+        return True
+    finally:
+        if SHARED_CACHE:
+            SHARED_CACHE.release_fill_lock("__budget_ids__")
+
+def get_budget_records(ws):
+    """Copia en caché del presupuesto, con ids asignados si faltaba alguno."""
+    records = get_all_records_cached(ws, PRESUPUESTO_WS_NAME)
+    try:
+        if ensure_budget_ids(ws, records):
+            records = get_all_records_cached(ws, PRESUPUESTO_WS_NAME)
+    except Exception as e:
+        app.logger.warning(f"⚠️ No se pudieron asignar ids de presupuesto: {e}")
+    return records
+
+def _budget_column_range(col):
+    letter = gspread.utils.rowcol_to_a1(1, col)[:-1]
+    return f"{letter}:{letter}"
+
+def read_budget_owners(ws, rows):
+    """{fila: (alias, id)} leídos de la hoja con una sola llamada (una fila completa por rango)."""
+    last_col = gspread.utils.rowcol_to_a1(1, len(PRESUPUESTO_HEADERS))[:-1]
+    found = ws.batch_get([f"A{row}:{last_col}{row}" for row in rows])
+    owners = {}
+    for row, vr in zip(rows, found):
+        values = vr[0] if vr and vr[0] else []
+        cell = lambda col: str(values[col - 1]) if len(values) >= col else ""
+        owners[row] = (cell(BUDGET_ALIAS_COL), cell(BUDGET_ID_COL))
+    return owners
+
+def resolve_budget_rows(ws, records, ids, owner):
+    """
+    Filas actuales de los ids pedidos que pertenecen a `owner`: retorna ({id: fila}, confiable).
+    El mapa en memoria se confirma leyendo solo esas filas (una llamada, id y alias); si algo
+    no coincide la copia estaba vieja: se usan las columnas id y alias de la hoja y
+    confiable=False (no se parchea la caché). Los ids que no existen o son de otro usuario
+    no aparecen en el resultado.
+    """
+    id_map, _ = derived_index(PRESUPUESTO_WS_NAME, "ids", records, build_budget_id_map)
+    rows = {item_id: id_map[item_id] for item_id in ids
+            if item_id in id_map and str(records[id_map[item_id] - 2].get("alias")) == owner}
+    if len(rows) == len(ids):
+        owners = read_budget_owners(ws, list(rows.values()))
+        if all(owners[row] == (owner, item_id) for item_id, row in rows.items()):
+            return rows, True
+    id_cells, alias_cells = ws.batch_get([_budget_column_range(BUDGET_ID_COL), _budget_column_range(BUDGET_ALIAS_COL)])
+    cell = lambda values, row: str(values[row - 1][0]) if len(values) >= row and values[row - 1] else ""
+    fresh = {}
+    for row in range(2, len(id_cells) + 1):
+        item_id = cell(id_cells, row)
+        if item_id and cell(alias_cells, row) == owner:
+            fresh[item_id] = row
+    return {item_id: fresh[item_id] for item_id in ids if item_id in fresh}, False
+
+def patch_budget_cache(records, paid_rows=(), deleted_rows=()):
+    """
+    Publica la copia ya corregida tras marcar o borrar filas (replace_cached_table) en lugar de
+    descargar la hoja otra vez. El mapa id->fila se corre localmente: cada fila borrada antes
+    que otra la sube un lugar.
+    """
+    paid, gone = set(paid_rows), set(deleted_rows)
+    deleted = sorted(gone)
+    pagado_idx = PRESUPUESTO_HEADERS.index("pagado")
+    rows = []
+    for row, r in enumerate(records, start=2):
+        if row in gone:
+            continue
+        values = [r.get(h, "") for h in PRESUPUESTO_HEADERS]
+        if row in paid:
+            values[pagado_idx] = "True"
+        rows.append(values)
+    table = SheetTable.from_records(rows, PRESUPUESTO_HEADERS, NUMERIC_COLUMNS[PRESUPUESTO_WS_NAME])
+
+    def shift(row):
+        return row - bisect_left(deleted, row)
+
+    id_map, missing = derived_index(PRESUPUESTO_WS_NAME, "ids", records, build_budget_id_map)
+    replace_cached_table(PRESUPUESTO_WS_NAME, table)
+    set_derived_index(PRESUPUESTO_WS_NAME, "ids", table, (
+        {item_id: shift(row) for item_id, row in id_map.items() if row not in gone},
+        [shift(row) for row in missing if row not in gone],
+    ))
+    return table
+
+def budget_target_rows(ws, body, owner):
+    """
+    Filas de un PUT/DELETE de presupuesto: retorna (ids, filas, records, confiable, error).
+    Usa 'id'/'ids'; 'row_index'/'row_indexes' se aceptan para páginas cargadas antes de
+    los ids y escrituras ya encoladas con ese formato (sin confirmar: nunca se parchea la caché).
+    Solo se aceptan ítems de `owner` (alias de la sesión); los de otro usuario dan 404.
+    """
+    records = get_all_records_cached(ws, PRESUPUESTO_WS_NAME)
+    ids = body.get("ids")
+    if ids is None and body.get("id"):
+        ids = [body.get("id")]
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            return None, None, None, False, (jsonify({"error":"missing_id"}), 400)
+        ids = list(dict.fromkeys(str(i) for i in ids))
+        rows, trusted = resolve_budget_rows(ws, records, ids, owner)
+        not_found = [i for i in ids if i not in rows]
+        if not_found:
+            return None, None, None, False, (jsonify({"error":"not_found", "message": "Algunos ítems ya no existen.", "ids": not_found}), 404)
+        return ids, sorted(rows.values()), records, trusted, None
+
+    row_indexes = body.get("row_indexes")
+    if row_indexes is None:
+        row_indexes = [body.get("row_index")] if body.get("row_index") else []
+    if not isinstance(row_indexes, list) or not row_indexes:
+        return None, None, None, False, (jsonify({"error":"missing_id"}), 400)
+    try:
+        row_indexes = sorted({int(r) for r in row_indexes})
+    except (TypeError, ValueError):
+        return None, None, None, False, (jsonify({"error":"invalid_row", "message": "Los índices de fila deben ser números."}), 400)
+    if row_indexes[0] < 2:
+        return None, None, None, False, (jsonify({"error":"invalid_row", "message": "No se puede modificar la fila de cabecera."}), 400)
+    owners = read_budget_owners(ws, row_indexes)
+    not_owned = [row for row in row_indexes if owners[row][0] != owner]
+    if not_owned:
+        return None, None, None, False, (jsonify({"error":"not_found", "message": "Algunos ítems ya no existen.", "row_indexes": not_owned}), 404)
+    return [], row_indexes, records, False, None
+
+def build_user_budget_index(records):
+    """Ítems de presupuesto por usuario, en orden de hoja: {alias: [dict con row_index]}."""
+    by_user = {}
+    for i, r in enumerate(records):
+        by_user.setdefault(r.get("alias"), []).append(dict(r.to_dict(), row_index=i + 2))
+    return by_user
+
+def build_due_date_index(records):
+    """
+    Índice de pagos pendientes por usuario: {alias: (ordinales_ordenados, items)}.
+    Solo incluye ítems no pagados con fecha_pago válida (los Gastos Variables no tienen fecha).
+    """
+    by_user = {}
+    for i, r in enumerate(records):
+        date_str = r.get("fecha_pago")
+        if not date_str or not str(date_str).strip():
+            continue
+        if str(r.get("pagado")).lower() == "true":
+            continue
+        try:
+            fp = datetime.strptime(str(date_str).strip(), "%Y-%m-%d").date()
+        except Exception:
+            continue
+        item = {
+            "categoria": r.get("categoria"),
+            "monto": r.get("monto"),
+            "fecha_pago": fp.isoformat(),
+            "row_index": i + 2,
+            "id": r.get("id") or "",
+        }
+        by_user.setdefault(r.get("alias"), []).append((fp.toordinal(), item))
+
+    index = {}
+    for alias, entries in by_user.items():
+        entries.sort(key=lambda e: e[0])
+        index[alias] = ([e[0] for e in entries], [e[1] for e in entries])
+    return index
+
+def get_due_reminders(records, email, today=None):
+    """
+    Recordatorios del usuario: ítems que vencen hoy ('due') o en 3 días ('3days').
+    Usa el índice por fecha (bisect) en lugar de recorrer la hoja.
+    """
+    today = today or date.today()
+    ordinals, items = derived_index(PRESUPUESTO_WS_NAME, "due_dates", records, build_due_date_index).get(email, ([], []))
+    reminders = []
+    for days_left, reminder_type in ((3, "3days"), (0, "due")):
+        target = today.toordinal() + days_left
+        lo = bisect_left(ordinals, target)
+        hi = bisect_right(ordinals, target, lo)
+        reminders.extend(dict(item, type=reminder_type) for item in items[lo:hi])
+    # Mismo orden que la hoja (como antes del índice)
+    reminders.sort(key=lambda r: r["row_index"])
+    return reminders
 
 def calculate_daily_summary(client, target_date):
     """
     Calcula los totales de Ingresos, Egresos y Kilometraje para una fecha dada.
     target_date debe ser un string en formato YYYY-MM-DD.
     """
-    # 1. Obtener datos de Viajes e Ingresos (Trips) - USANDO CACHE
-    ws_trips = ensure_sheet_with_headers(client, TRIPS_WS_NAME, TRIPS_HEADERS)
-    trips_records = get_all_records_cached(ws_trips, TRIPS_WS_NAME)
+    # Las cuatro hojas del día se leen a la vez (las que no estén ya en caché) - USANDO CACHE
+    sheets = get_sheets_cached(client, [TRIPS_WS_NAME, GASTOS_WS_NAME, KM_WS_NAME, BONUS_WS_NAME])
+
+    # 1. Obtener datos de Viajes e Ingresos (Trips)
+    trips_records = sheets[TRIPS_WS_NAME]
     trips_today = [r for r in trips_records if str(r.get("Fecha")) == str(target_date)]
     
     total_gross_income = sum(float(r.get("Total", 0)) for r in trips_today)
     num_trips = len(trips_today)
 
-    # 2. Obtener datos de Gastos - USANDO CACHE
-    ws_gastos = ensure_sheet_with_headers(client, GASTOS_WS_NAME, GASTOS_HEADERS)
-    gastos_records = get_all_records_cached(ws_gastos, GASTOS_WS_NAME)
+    # 2. Obtener datos de Gastos
+    gastos_records = sheets[GASTOS_WS_NAME]
     gastos_today = [r for r in gastos_records if str(r.get("Fecha")) == str(target_date)]
     
     total_expenses = sum(float(r.get("Monto", 0)) for r in gastos_today)
 
-    # 3. Obtener datos de Kilometraje - USANDO CACHE
-    ws_km = ensure_sheet_with_headers(client, KM_WS_NAME, KM_HEADERS)
-    km_records = get_all_records_cached(ws_km, KM_WS_NAME)
+    # 3. Obtener datos de Kilometraje
+    km_records = sheets[KM_WS_NAME]
     km_record = next((r for r in km_records if str(r.get("Fecha")) == str(target_date)), None)
     
     total_km_recorrido = int(km_record.get("Recorrido", 0)) if km_record and km_record.get("Recorrido") else 0
 
     # 4. Calcular el Ingreso Neto y la Productividad
     
-    # Bono del día - USANDO CACHE
-    ws_bonuses = ensure_sheet_with_headers(client, BONUS_WS_NAME, BONUS_HEADERS)
-    bonus_records = get_all_records_cached(ws_bonuses, BONUS_WS_NAME)
+    # Bono del día
+    bonus_records = sheets[BONUS_WS_NAME]
     current_bonus = next((float(r.get('Bono total', 0.0)) for r in bonus_records if str(r.get("Fecha")) == str(target_date)), 0.0)
 
     # Ingreso total (Viajes + Bono)
@@ -374,6 +2172,140 @@ def calculate_daily_summary(client, target_date):
     }
 
 
+# ----------------------------
+# LISTADOS: RANGO DE FECHAS Y CURSORES
+# ----------------------------
+# Los GET de listas aceptan ?date= (un día), ?from=&to= (rango inclusivo), ?limit= y
+# ?cursor=. El cursor es opaco (base64 de la clave (Fecha, fila) del último ítem devuelto);
+# si quedan ítems, el siguiente va en la cabecera X-Next-Cursor. Así el tamaño de la
+# respuesta no depende de cuánto historial tenga la hoja.
+LIST_DEFAULT_LIMIT = int(os.environ.get("LIST_DEFAULT_LIMIT", 500))
+LIST_MAX_LIMIT = int(os.environ.get("LIST_MAX_LIMIT", 2000))
+
+class InvalidListArgs(ValueError):
+    """Parámetro de listado inválido (date/from/to/limit/cursor): la petición responde 400."""
+
+LIST_ERROR_MESSAGES = {
+    "invalid_date": "Las fechas deben tener formato YYYY-MM-DD.",
+    "invalid_limit": "limit debe ser un número positivo.",
+    "invalid_cursor": "El cursor no es válido.",
+}
+
+@app.errorhandler(InvalidListArgs)
+def invalid_list_args(e):
+    code = str(e)
+    return jsonify({"error": code, "message": LIST_ERROR_MESSAGES.get(code, code)}), 400
+
+def build_date_index(records):
+    """Claves (Fecha, fila) ordenadas de las filas con fecha válida (fila = número en la hoja)."""
+    return sorted(
+        (str(r.get("Fecha")), i + 2)
+        for i, r in enumerate(records)
+        if weekday_of(r.get("Fecha")) is not None
+    )
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """Clave del cursor como tupla; InvalidListArgs si no es un cursor válido."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise InvalidListArgs("invalid_cursor") from e
+    if not isinstance(key, list) or not key:
+        raise InvalidListArgs("invalid_cursor")
+    return tuple(key)
+
+def parse_list_args(default_date=None):
+    """
+    Lee date/from/to/limit/cursor de la query. Retorna (desde, hasta, limit, cursor) o
+    lanza InvalidListArgs. Sin fechas se usa default_date (p. ej. hoy).
+    """
+    args = request.args
+    for value in (args.get("date"), args.get("from"), args.get("to")):
+        if value and weekday_of(value) is None:
+            raise InvalidListArgs("invalid_date")
+    start = args.get("from") or args.get("date")
+    end = args.get("to") or args.get("date")
+    if not start and not end:
+        start = end = default_date
+    start, end = start or "", end or "9999-12-31"
+    try:
+        limit = int(args.get("limit", LIST_DEFAULT_LIMIT))
+    except ValueError:
+        raise InvalidListArgs("invalid_limit") from None
+    if limit < 1:
+        raise InvalidListArgs("invalid_limit")
+    cursor = decode_cursor(args["cursor"]) if args.get("cursor") else None
+    return start, end, min(limit, LIST_MAX_LIMIT), cursor
+
+def records_in_range(ws_name, records, start, end):
+    """Filas con start <= Fecha <= end, en orden de fecha y de hoja (búsqueda binaria en el índice)."""
+    keys = derived_index(ws_name, "by_date", records, build_date_index)
+    lo = bisect_left(keys, (start,))
+    hi = bisect_right(keys, (end, sys.maxsize))
+    return [records[row - 2] for _, row in keys[lo:hi]]
+
+def page_by_date(ws_name, records, start, end, limit, cursor=None):
+    """Página de filas en [start, end] a partir del cursor. Retorna (filas, siguiente cursor o None)."""
+    keys = derived_index(ws_name, "by_date", records, build_date_index)
+    lo = bisect_left(keys, (start,))
+    hi = bisect_right(keys, (end, sys.maxsize))
+    if cursor is not None:
+        try:
+            lo = max(lo, bisect_right(keys, cursor))
+        except TypeError:
+            raise InvalidListArgs("invalid_cursor")
+    page = keys[lo:min(hi, lo + limit)]
+    next_cursor = encode_cursor(page[-1]) if lo + limit < hi else None
+    return [records[row - 2] for _, row in page], next_cursor
+
+def page_of(items, key, limit, cursor=None):
+    """Igual que page_by_date para listas ya ordenadas por `key` (p. ej. número de fila)."""
+    keys = [key(item) for item in items]
+    try:
+        lo = bisect_right(keys, cursor) if cursor is not None else 0
+    except TypeError:
+        raise InvalidListArgs("invalid_cursor")
+    page = items[lo:lo + limit]
+    next_cursor = encode_cursor(keys[lo + limit - 1]) if lo + limit < len(items) else None
+    return page, next_cursor
+
+def paginated(payload, next_cursor):
+    response = jsonify(payload)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+# ----------------------------
+# REGISTRO DE USUARIOS CONOCIDOS
+# ----------------------------
+# Alias con al menos un ítem de presupuesto. Evita descargar la hoja completa en cada login
+# (los logins se concentran al inicio del turno): se construye desde la copia cacheada de
+# TripCounter_Presupuesto y se actualiza en cada POST de presupuesto de este proceso.
+KNOWN_USERS = {"aliases": set(), "source": None}
+_KNOWN_USERS_LOCK = threading.Lock()
+
+def remember_user(alias):
+    with _KNOWN_USERS_LOCK:
+        KNOWN_USERS["aliases"].add(alias)
+
+def is_known_user(client, alias):
+    """True si el alias ya tiene presupuesto (según el registro o la copia cacheada de la hoja)."""
+    if alias in KNOWN_USERS["aliases"]:
+        return True
+    ws_pres = ensure_sheet_with_headers(client, PRESUPUESTO_WS_NAME, PRESUPUESTO_HEADERS)
+    records = get_all_records_cached(ws_pres, PRESUPUESTO_WS_NAME)
+    with _KNOWN_USERS_LOCK:
+        # Copia nueva de la hoja (p. ej. otro worker agregó un usuario): se vuelve a recorrer
+        if KNOWN_USERS["source"] is not records:
+            KNOWN_USERS["aliases"].update(str(r.get("alias")) for r in records)
+            KNOWN_USERS["source"] = records
+        return alias in KNOWN_USERS["aliases"]
+
+
 # ----------------------------
 # ROUTES: Auth
 # ----------------------------
@@ -402,20 +2334,17 @@ def oauth2callback():
         app.logger.info(f"User logged in: {session.get('email')}")
         
         # --- LÓGICA DE VERIFICACIÓN DE NUEVO USUARIO ---
-        client = get_gspread_client()
-        ws_pres = ensure_sheet_with_headers(client, PRESUPUESTO_WS_NAME, PRESUPUESTO_HEADERS)
-        
         email_to_check = session.get('email')
         is_new_user = False
         
-        # Leemos sin caché para asegurar que no nos falle el POST inicial si no hay datos
-        records = ws_pres.get_all_records()
-        if not any(r.get("alias") == email_to_check for r in records):
-             is_new_user = True
+        # Registro en memoria + copia cacheada del presupuesto (sin leer la hoja completa).
+        # Si Sheets no responde, el login sigue: se trata como usuario conocido.
+        try:
+            is_new_user = not is_known_user(get_gspread_client(), email_to_check)
+        except Exception as e:
+            app.logger.warning(f"⚠️ No se pudo verificar si {email_to_check} es nuevo: {e}")
         
-        # Si el usuario es nuevo, invalidamos la caché de presupuesto inmediatamente antes de redirigir.
         if is_new_user:
-            CACHE.pop(PRESUPUESTO_WS_NAME, None)
             app.logger.info(f"Nuevo usuario {email_to_check} detectado. Redirigiendo a Presupuesto.")
             flash('¡Bienvenido/a! Por favor, agrega tus primeros ítems de presupuesto para empezar.', 'success')
             return redirect(url_for("presupuesto_page"))
@@ -452,44 +2381,11 @@ def index():
         # B. Intentar cargar los recordatorios
         try:
             ws_pres = ensure_sheet_with_headers(client, PRESUPUESTO_WS_NAME, PRESUPUESTO_HEADERS)
-            # USANDO CACHE
-            records = get_all_records_cached(ws_pres, PRESUPUESTO_WS_NAME)
+            # USANDO CACHE (con los ids que usan los botones "Marcar como pagado")
+            records = get_budget_records(ws_pres)
             
-            today = date.today()
-            
-            for i, r in enumerate(records):
-                # Solo procesamos si hay fecha de pago (es decir, si no es Gasto Variable)
-                if not r.get("fecha_pago"):
-                    continue 
-
-                try:
-                    date_str = r.get("fecha_pago")
-                    if not date_str or not date_str.strip():
-                        continue 
-                        
-                    fp = datetime.strptime(date_str, "%Y-%m-%d").date()
-                    
-                except Exception:
-                    continue
-                
-                days_left = (fp - today).days
-                
-                if str(r.get("pagado")).lower() == "true":
-                    continue
-                
-                reminder_data = {
-                    "categoria": r.get("categoria"),
-                    "monto": r.get("monto"),
-                    "row_index": i + 2
-                }
-                
-                if days_left == 3:
-                    reminder_data["type"] = "3days"
-                    reminders.append(reminder_data)
-                elif days_left == 0:
-                    reminder_data["type"] = "due"
-                    reminders.append(reminder_data)
-                    
+            reminders = get_due_reminders(records, email)
+
         except Exception as e:
             app.logger.error(f"❌ Error cargando recordatorios desde la hoja: {e}")
             flash(f'⚠️ Error al cargar los recordatorios: {e}', 'warning')
@@ -502,6 +2398,26 @@ def index():
     return render_template("home.html", email=email, reminders=reminders)
 
 
+@app.route("/api/reminders", methods=["GET"])
+def api_reminders():
+    """
+    GET: recordatorios de pago del usuario (vencen hoy o en 3 días), los mismos de la Home.
+    """
+    email = session.get('email')
+    if not email:
+        return jsonify({"error":"not_authenticated"}), 401
+
+    try:
+        client = get_gspread_client()
+        ws_pres = ensure_sheet_with_headers(client, PRESUPUESTO_WS_NAME, PRESUPUESTO_HEADERS)
+        records = get_budget_records(ws_pres)
+    except Exception as e:
+        app.logger.error(f"Error en API Reminders al conectar a GSheets: {e}")
+        return jsonify({"error": f"Error de conexión a la base de datos: {e}"}), 500
+
+    return jsonify({"reminders": get_due_reminders(records, email)})
+
+
 @app.route("/viajes")
 def viajes_page():
     if not session.get('email'):
@@ -596,9 +2512,12 @@ def monthly_report_page():
 # API: Trips (Ruta Unificada)
 # ----------------------------
 @app.route("/api/trips", methods=["GET", "POST"])
+@idempotent
+@queue_when_sheets_down
 def api_trips():
     """
-    GET: optional ?date=YYYY-MM-DD returns trips and bonus for that date (defaults to today)
+    GET: optional ?date=YYYY-MM-DD returns trips and bonus for that date (defaults to today);
+         ?from=&to= for a range, ?limit= and ?cursor= (next page cursor in X-Next-Cursor)
     POST: Registers a trip, recalculates, and updates the daily bonus.
     """
     if not session.get('email'):
@@ -614,36 +2533,31 @@ def api_trips():
 
 
     if request.method == "GET":
-        qdate = request.args.get("date") or date.today().isoformat()
+        start, end, limit, cursor = parse_list_args(date.today().isoformat())
         
-        all_trips = get_all_records_cached(ws_trips, TRIPS_WS_NAME)
-        filtered_trips = [r for r in all_trips if str(r.get("Fecha")) == str(qdate)]
+        sheets = get_sheets_cached(client, [TRIPS_WS_NAME, BONUS_WS_NAME])
+        filtered_trips, next_cursor = page_by_date(TRIPS_WS_NAME, sheets[TRIPS_WS_NAME], start, end, limit, cursor)
         
-        all_bonuses = get_all_records_cached(ws_bonuses, BONUS_WS_NAME)
-        current_bonus = next((float(r.get('Bono total', 0.0)) for r in all_bonuses if str(r.get("Fecha")) == str(qdate)), 0.0)
+        # Bono del día (o suma de los bonos del rango, igual en todas las páginas)
+        bonuses = records_in_range(BONUS_WS_NAME, sheets[BONUS_WS_NAME], start, end)
+        current_bonus = sum((float(r.get('Bono total') or 0.0) for r in bonuses), 0.0)
         
-        return jsonify({"trips": filtered_trips, "bonus": current_bonus})
+        return paginated({"trips": [r.to_dict() for r in filtered_trips], "bonus": current_bonus}, next_cursor)
 
     # POST (Registro de Viaje)
     body = request.get_json() or {}
-    fecha = body.get("fecha") or date.today().isoformat()
-    hora_inicio = str(body.get("hora_inicio","")).strip()
-    hora_fin = str(body.get("hora_fin","")).strip()
-    
     try:
-        monto = float(body.get("monto", 0))
-    except Exception:
+        trip = parse_trip_payload(body)
+    except ValueError:
         return jsonify({"error":"invalid_monto"}), 400
-        
-    propina = 0.0
-    try:
-        propina = float(body.get("propina", 0)) if body.get("propina") else 0.0
-    except Exception:
-        propina = 0.0
-            
-    aeropuerto_flag = bool(body.get("aeropuerto", False))
-    aeropuerto_val = AIRPORT_FEE if aeropuerto_flag else 0.0 
-    total = round(monto + propina + aeropuerto_val, 2)
+
+    fecha = trip["fecha"]
+    hora_inicio = trip["hora_inicio"]
+    hora_fin = trip["hora_fin"]
+    monto = trip["monto"]
+    propina = trip["propina"]
+    aeropuerto_val = trip["aeropuerto"]
+    total = trip["total"]
 
     # Obtenemos los viajes sin cachear para el POST
     all_trips = ws_trips.get_all_records()
@@ -661,7 +2575,8 @@ def api_trips():
         app.logger.info(f"New trip appended: {row}")
         
         # Invalida la caché de TRIPS después de la escritura
-        CACHE.pop(TRIPS_WS_NAME, None) 
+        invalidate_cache(TRIPS_WS_NAME) 
+        mark_month_dirty(fecha)
         
         # Volvemos a leer sin cachear para calcular el bono correctamente
         all_trips_after_post = ws_trips.get_all_records()
@@ -669,6 +2584,7 @@ def api_trips():
         
         current_bonus = calculate_current_bonus(trips_today)
         update_daily_bonus_sheet(client, fecha, current_bonus) # Ya invalida la caché de BONUS
+        publish_event("trips", trips_day_event(fecha, trips_today, current_bonus))
         
     except Exception as e:
         app.logger.error(f"Error al registrar viaje o actualizar bono: {e}")
@@ -676,13 +2592,170 @@ def api_trips():
     
     return jsonify({"status":"ok","trip":dict(zip(TRIPS_HEADERS,row)), "new_bonus": current_bonus}), 201
 
+# ----------------------------
+# API: Importación masiva (turno completo sin conexión)
+# ----------------------------
+def _time_sort_key(value):
+    """'H:MM' o 'HH:MM' -> (minutos, texto); las horas inválidas quedan al final del día."""
+    try:
+        hh, mm = str(value).split(":")[:2]
+        return (int(hh) * 60 + int(mm), str(value))
+    except ValueError:
+        return (24 * 60, str(value))
+
+def _assign_numbered_rows(items, existing_records):
+    """
+    Descarta duplicados (contra la hoja y dentro del mismo lote) y asigna 'Numero'
+    consecutivo por fecha. Retorna (items_aceptados, duplicados).
+    """
+    seen = {(str(r.get("Fecha")), str(r.get("Hora inicio")), str(r.get("Hora fin"))) for r in existing_records}
+    count_by_date = {}
+    for r in existing_records:
+        key = str(r.get("Fecha"))
+        count_by_date[key] = count_by_date.get(key, 0) + 1
+
+    accepted = []
+    duplicates = []
+    for item in sorted(items, key=lambda t: (str(t["fecha"]), _time_sort_key(t["hora_inicio"]))):
+        key = (str(item["fecha"]), item["hora_inicio"], item["hora_fin"])
+        if key in seen:
+            duplicates.append(item)
+            continue
+        seen.add(key)
+        count_by_date[key[0]] = count_by_date.get(key[0], 0) + 1
+        item["numero"] = count_by_date[key[0]]
+        accepted.append(item)
+    return accepted, duplicates
+
+@app.route("/api/trips/bulk", methods=["POST"])
+@idempotent
+@queue_when_sheets_down
+def api_trips_bulk():
+    """
+    POST: JSON con listas opcionales 'trips', 'extras' y 'expenses' (mismo formato que los
+    endpoints individuales). Valida y elimina duplicados en memoria, escribe con un solo
+    append_rows por hoja y recalcula el bono una sola vez por fecha afectada.
+    """
+    if not session.get('email'):
+        return jsonify({"error":"not_authenticated"}), 401
+
+    body = request.get_json() or {}
+    trips_in = body.get("trips") or []
+    extras_in = body.get("extras") or []
+    expenses_in = body.get("expenses") or []
+
+    if not isinstance(trips_in, list) or not isinstance(extras_in, list) or not isinstance(expenses_in, list):
+        return jsonify({"error": "invalid_format", "message": "'trips', 'extras' y 'expenses' deben ser listas."}), 400
+
+    # 1. Validar todo antes de tocar Sheets (el lote se rechaza completo si hay errores)
+    errors = []
+    for kind, items in (("trip", trips_in), ("extra", extras_in), ("expense", expenses_in)):
+        for i, item in enumerate(items):
+            if item is not None and not isinstance(item, dict):
+                errors.append({"type": kind, "index": i, "error": "invalid_item", "message": "Cada ítem debe ser un objeto JSON."})
+    if errors:
+        return jsonify({"error": "validation_failed", "details": errors}), 400
+
+    trips = []
+    for i, item in enumerate(trips_in):
+        try:
+            trips.append(parse_trip_payload(item or {}))
+        except ValueError:
+            errors.append({"type": "trip", "index": i, "error": "invalid_monto"})
+    extras = [parse_extra_payload(item or {}) for item in extras_in]
+    expenses = []
+    for i, item in enumerate(expenses_in):
+        try:
+            expenses.append(parse_expense_payload(item or {}))
+        except ValueError as e:
+            errors.append({"type": "expense", "index": i, "error": "monto_invalido", "message": str(e)})
+
+    if errors:
+        return jsonify({"error": "validation_failed", "details": errors}), 400
+
+    try:
+        client = get_gspread_client()
+    except Exception as e:
+        app.logger.error(f"Error en API Bulk al conectar a GSheets: {e}")
+        return jsonify({"error": f"Error de conexión a la base de datos: {e}"}), 500
+
+    result = {"status": "ok", "trips": [], "extras": [], "expenses": [], "duplicates": {"trips": 0, "extras": 0}, "bonuses": {}}
+
+    try:
+        # 2. Viajes: una lectura sin caché, un append_rows y un upsert de bonos por lote
+        if trips:
+            ws_trips = ensure_sheet_with_headers(client, TRIPS_WS_NAME, TRIPS_HEADERS)
+            all_trips = ws_trips.get_all_records()
+            accepted, duplicates = _assign_numbered_rows(trips, all_trips)
+            result["duplicates"]["trips"] = len(duplicates)
+
+            rows = [[t["fecha"], t["numero"], t["hora_inicio"], t["hora_fin"], t["monto"], t["propina"], t["aeropuerto"], t["total"]] for t in accepted]
+            if rows:
+                ws_trips.append_rows(rows)
+                invalidate_cache(TRIPS_WS_NAME)
+                for row in rows:
+                    mark_month_dirty(row[0])
+                app.logger.info(f"Bulk: {len(rows)} trips appended")
+
+                # El bono depende solo del número de viajes del día: existentes + nuevos
+                affected_dates = {str(t["fecha"]) for t in accepted}
+                bonuses = {}
+                trips_by_date = {}
+                for fecha in sorted(affected_dates):
+                    trips_today = [r for r in all_trips if str(r.get("Fecha")) == fecha]
+                    trips_today += [dict(zip(TRIPS_HEADERS, row)) for row in rows if str(row[0]) == fecha]
+                    trips_by_date[fecha] = trips_today
+                    bonuses[fecha] = calculate_current_bonus(trips_today)
+                update_daily_bonuses_sheet(client, bonuses)
+                result["bonuses"] = bonuses
+                for fecha, trips_today in trips_by_date.items():
+                    publish_event("trips", trips_day_event(fecha, trips_today, bonuses[fecha]))
+
+            result["trips"] = [dict(zip(TRIPS_HEADERS, row)) for row in rows]
+
+        # 3. Extras: misma lógica de duplicados y numeración que /api/extras
+        if extras:
+            ws_extras = ensure_sheet_with_headers(client, EXTRAS_WS_NAME, EXTRAS_HEADERS)
+            accepted, duplicates = _assign_numbered_rows(extras, ws_extras.get_all_records())
+            result["duplicates"]["extras"] = len(duplicates)
+
+            rows = [[x["fecha"], x["numero"], x["hora_inicio"], x["hora_fin"], x["monto"], x["total"]] for x in accepted]
+            if rows:
+                ws_extras.append_rows(rows)
+                invalidate_cache(EXTRAS_WS_NAME)
+                app.logger.info(f"Bulk: {len(rows)} extras appended")
+            result["extras"] = [dict(zip(EXTRAS_HEADERS, row)) for row in rows]
+
+        # 4. Gastos: no tienen deduplicación (igual que /api/expenses)
+        if expenses:
+            ws_gastos = ensure_sheet_with_headers(client, GASTOS_WS_NAME, GASTOS_HEADERS)
+            rows = [[x["fecha"], x["hora"], x["monto"], x["categoria"], x["descripcion"]] for x in expenses]
+            ws_gastos.append_rows(rows)
+            invalidate_cache(GASTOS_WS_NAME)
+            for row in rows:
+                mark_month_dirty(row[0])
+            app.logger.info(f"Bulk: {len(rows)} expenses appended")
+            result["expenses"] = [dict(zip(GASTOS_HEADERS, row)) for row in rows]
+            for fecha in sorted({str(row[0]) for row in rows}):
+                publish_event("expenses", {"fecha": fecha, "expenses": [
+                    e for e in result["expenses"] if str(e["Fecha"]) == fecha]})
+
+    except Exception as e:
+        app.logger.error(f"Error en importación masiva: {e}")
+        return jsonify({"error": "Error interno al interactuar con Sheets.", "partial": result}), 500
+
+    return jsonify(result), 201
+
 # ----------------------------
 # API: Expenses (Gastos)
 # ----------------------------
 @app.route("/api/expenses", methods=["GET", "POST"])
+@idempotent
+@queue_when_sheets_down
 def api_expenses():
     """
-    GET: optional ?date=YYYY-MM-DD returns expenses for that date (defaults to today)
+    GET: optional ?date=YYYY-MM-DD returns expenses for that date (defaults to today);
+         ?from=&to= for a range, ?limit= and ?cursor= (next page cursor in X-Next-Cursor)
     POST: JSON with keys: fecha (optional), hora (optional), monto, categoria, descripcion
     """
     if not session.get('email'):
@@ -696,34 +2769,28 @@ def api_expenses():
         return jsonify({"error": f"Error de conexión a la base de datos: {e}"}), 500
 
     if request.method == "GET":
-        qdate = request.args.get("date") or date.today().isoformat()
+        start, end, limit, cursor = parse_list_args(date.today().isoformat())
         
         all_expenses = get_all_records_cached(ws_gastos, GASTOS_WS_NAME)
-        filtered_expenses = [r for r in all_expenses if str(r.get("Fecha")) == str(qdate)]
+        filtered_expenses, next_cursor = page_by_date(GASTOS_WS_NAME, all_expenses, start, end, limit, cursor)
         
-        return jsonify(filtered_expenses)
+        return paginated([r.to_dict() for r in filtered_expenses], next_cursor)
     
     body = request.get_json() or {}
-    
-    fecha = body.get("fecha") or date.today().isoformat()
-    hora = body.get("hora") or datetime.now().strftime('%H:%M')
-    categoria = str(body.get("categoria", "")).strip()
-    descripcion = str(body.get("descripcion", "")).strip()
-    
     try:
-        monto = float(body.get("monto", 0))
-        if monto <= 0:
-            return jsonify({"error": "monto_invalido", "message": "El monto debe ser un valor positivo."}), 400
-    except Exception:
-        return jsonify({"error": "monto_invalido", "message": "El monto debe ser numérico."}), 400
+        expense = parse_expense_payload(body)
+    except ValueError as e:
+        return jsonify({"error": "monto_invalido", "message": str(e)}), 400
 
     try:
-        row = [fecha, hora, monto, categoria, descripcion]
+        row = [expense["fecha"], expense["hora"], expense["monto"], expense["categoria"], expense["descripcion"]]
         ws_gastos.append_row(row)
         app.logger.info(f"New expense appended: {row}")
         
         # Invalida la caché de GASTOS después de la escritura
-        CACHE.pop(GASTOS_WS_NAME, None) 
+        invalidate_cache(GASTOS_WS_NAME) 
+        mark_month_dirty(expense["fecha"])
+        publish_event("expenses", {"fecha": expense["fecha"], "expenses": [dict(zip(GASTOS_HEADERS, row))]})
         
     except Exception as e:
         app.logger.error(f"Error al registrar gasto: {e}")
@@ -736,6 +2803,8 @@ def api_expenses():
 # API: Extras
 # ----------------------------
 @app.route("/api/extras", methods=["GET","POST"])
+@idempotent
+@queue_when_sheets_down
 def api_extras():
     if not session.get('email'):
         return jsonify({"error":"not_authenticated"}), 401
@@ -748,19 +2817,18 @@ def api_extras():
         return jsonify({"error": f"Error de conexión a la base de datos: {e}"}), 500
 
     if request.method == "GET":
-        qdate = request.args.get("date") or date.today().isoformat()
+        # ?date= (hoy por defecto) o ?from=&to=, con ?limit= y ?cursor= (ver LISTADOS)
+        start, end, limit, cursor = parse_list_args(date.today().isoformat())
         records = get_all_records_cached(ws, EXTRAS_WS_NAME)
-        filtered = [r for r in records if str(r.get("Fecha")) == str(qdate)]
-        return jsonify(filtered)
+        filtered, next_cursor = page_by_date(EXTRAS_WS_NAME, records, start, end, limit, cursor)
+        return paginated([r.to_dict() for r in filtered], next_cursor)
 
     body = request.get_json() or {}
-    fecha = body.get("fecha") or date.today().isoformat()
-    hi = str(body.get("hora_inicio","")).strip()
-    hf = str(body.get("hora_fin","")).strip()
-    try:
-        monto = float(body.get("monto",0))
-    except Exception:
-        monto = 0.0
+    extra = parse_extra_payload(body)
+    fecha = extra["fecha"]
+    hi = extra["hora_inicio"]
+    hf = extra["hora_fin"]
+    monto = extra["monto"]
 
     # Obtenemos los registros sin cachear para la comprobación de duplicados
     records = ws.get_all_records()
@@ -771,7 +2839,7 @@ def api_extras():
 
     same_date_count = sum(1 for r in records if str(r.get("Fecha")) == str(fecha))
     numero = same_date_count + 1
-    total = round(monto,2)
+    total = extra["total"]
 
     try:
         row = [fecha, numero, hi, hf, monto, total]
@@ -779,7 +2847,7 @@ def api_extras():
         app.logger.info(f"New extra appended: {row}")
         
         # Invalida la caché de EXTRAS después de la escritura
-        CACHE.pop(EXTRAS_WS_NAME, None) 
+        invalidate_cache(EXTRAS_WS_NAME) 
         
     except Exception as e:
         app.logger.error(f"Error al registrar extra: {e}")
@@ -791,6 +2859,8 @@ def api_extras():
 # API: Presupuesto
 # ----------------------------
 @app.route("/api/presupuesto", methods=["GET","POST","PUT","DELETE"])
+@idempotent
+@queue_when_sheets_down
 def api_presupuesto():
     if not session.get('email'):
         return jsonify({"error":"not_authenticated"}), 401
@@ -804,9 +2874,15 @@ def api_presupuesto():
 
 
     if request.method == "GET":
-        # USANDO CACHE para la lista de presupuestos
-        records = get_all_records_cached(ws, PRESUPUESTO_WS_NAME)
-        return jsonify(records)
+        # USANDO CACHE: solo los ítems del usuario, con su id (para PUT/DELETE) y su fila actual (row_index).
+        # ?from=&to= filtran por fecha_pago (los Gastos Variables no tienen fecha); ?limit= y ?cursor=
+        start, end, limit, cursor = parse_list_args()
+        records = get_budget_records(ws)
+        items = derived_index(PRESUPUESTO_WS_NAME, "by_user", records, build_user_budget_index).get(session['email'], [])
+        if request.args.get("from") or request.args.get("to") or request.args.get("date"):
+            items = [item for item in items if item.get("fecha_pago") and start <= str(item["fecha_pago"]) <= end]
+        page, next_cursor = page_of(items, lambda item: (item["row_index"],), limit, cursor)
+        return paginated(page, next_cursor)
 
     if request.method == "POST":
         body = request.get_json() or {}
@@ -834,11 +2910,12 @@ def api_presupuesto():
             return jsonify({"error": "monto_invalido", "message": "El monto debe ser numérico."}), 400
 
         try:
-            row = [alias, categoria, monto, tipo_gasto, fecha_pago, "False"]
+            row = [alias, categoria, monto, tipo_gasto, fecha_pago, "False", new_budget_id()]
             ws.append_row(row)
             
             # Invalida la caché de PRESUPUESTO después de la escritura
-            CACHE.pop(PRESUPUESTO_WS_NAME, None) 
+            invalidate_cache(PRESUPUESTO_WS_NAME) 
+            remember_user(alias)
             
         except Exception as e:
             app.logger.error(f"Error al registrar presupuesto: {e}")
@@ -847,42 +2924,46 @@ def api_presupuesto():
         return jsonify({"status":"ok","entry":dict(zip(PRESUPUESTO_HEADERS,row))}), 201
 
     if request.method == "PUT":
+        # Acepta 'id' o 'ids' para marcar varios ítems a la vez (o 'row_index'/'row_indexes', ver budget_target_rows)
         body = request.get_json() or {}
-        row_index = body.get("row_index")
-        if not row_index:
-            return jsonify({"error":"missing_row_index"}), 400
+        ids, rows, records, trusted, error = budget_target_rows(ws, body, session['email'])
+        if error:
+            return error
         try:
-            # Marcar como pagado
-            ws.update_cell(int(row_index), PRESUPUESTO_HEADERS.index("pagado") + 1, "True")
+            # Marcar como pagado (una sola llamada para todas las filas)
+            pagado_col = PRESUPUESTO_HEADERS.index("pagado") + 1
+            batch_update_cells(ws, [(r, pagado_col, "True") for r in rows])
             
-            # Invalida la caché de PRESUPUESTO después de la escritura
-            CACHE.pop(PRESUPUESTO_WS_NAME, None) 
+            # Con las filas confirmadas se corrige la copia en caché; si no, se invalida
+            if trusted:
+                patch_budget_cache(records, paid_rows=rows)
+            else:
+                invalidate_cache(PRESUPUESTO_WS_NAME) 
             
-            return jsonify({"status":"ok"}), 200
+            return jsonify({"status":"ok", "updated": rows, "ids": ids}), 200
         except Exception as e:
             app.logger.error(f"Error actualizando celda en GSheets: {e}")
             return jsonify({"error":f"Error al actualizar la hoja: {e}"}), 500
             
     # --- NUEVA LÓGICA DELETE ---
     if request.method == "DELETE":
-        # Nota: Los datos DELETE se envían en el body o query params, usaremos body para el row_index
+        # Nota: Los datos DELETE se envían en el body: 'id' o 'ids' (o 'row_index' por compatibilidad)
         body = request.get_json() or {}
-        row_index = body.get("row_index")
-        if not row_index:
-            return jsonify({"error":"missing_row_index"}), 400
+        ids, rows, records, trusted, error = budget_target_rows(ws, body, session['email'])
+        if error:
+            return error
             
         try:
-            row_index = int(row_index)
-            if row_index < 2: # No se puede borrar la fila de cabecera (Fila 1)
-                 return jsonify({"error":"invalid_row", "message": "No se puede eliminar la fila de cabecera."}), 400
-                 
-            # Eliminación de la fila en Google Sheets
-            ws.delete_rows(row_index)
+            # Eliminación de las filas en Google Sheets (una sola llamada)
+            delete_sheet_rows(ws, rows)
             
-            # Invalida la caché de PRESUPUESTO después de la escritura
-            CACHE.pop(PRESUPUESTO_WS_NAME, None) 
+            # Las filas siguientes se corren: se corrige la copia en caché (y el mapa id->fila)
+            if trusted:
+                patch_budget_cache(records, deleted_rows=rows)
+            else:
+                invalidate_cache(PRESUPUESTO_WS_NAME) 
             
-            return jsonify({"status":"ok", "message": f"Fila {row_index} eliminada."}), 200
+            return jsonify({"status":"ok", "deleted": ids, "message": f"{len(rows)} ítem(s) eliminado(s)."}), 200
             
         except Exception as e:
             app.logger.error(f"Error eliminando fila en GSheets: {e}")
@@ -892,6 +2973,8 @@ def api_presupuesto():
 # API: Kilometraje
 # ----------------------------
 @app.route("/api/kilometraje", methods=["GET", "POST"])
+@idempotent
+@queue_when_sheets_down
 def api_kilometraje():
     """
     POST: Registra el KM de inicio O actualiza el KM de fin para el día.
@@ -907,9 +2990,15 @@ def api_kilometraje():
         app.logger.error(f"Error en API Kilometraje al conectar a GSheets: {e}")
         return jsonify({"error": f"Error de conexión a la base de datos: {e}"}), 500
         
-    qdate = request.args.get("date") or date.today().isoformat()
+    # POST: la fecha también puede venir en el body (la envía el formulario y la fija la cola de escrituras)
+    body = (request.get_json(silent=True) or {}) if request.method == "POST" else {}
+    qdate = request.args.get("date") or body.get("fecha") or date.today().isoformat()
     # Leemos sin caché para operaciones que pueden ser de escritura/actualización
-    all_records = ws.get_all_records() 
+    # (el GET usa la caché: así también funciona con el circuito abierto)
+    if request.method == "POST":
+        all_records = ws.get_all_records()
+    else:
+        all_records = get_all_records_cached(ws, KM_WS_NAME)
     
     existing_record_index = -1
     for i, r in enumerate(all_records):
@@ -924,13 +3013,11 @@ def api_kilometraje():
         km_record = next((r for r in all_records_cached if str(r.get("Fecha")) == str(qdate)), None)
         
         if km_record:
-            return jsonify(km_record) 
+            return jsonify(km_record.to_dict()) 
         else:
             return jsonify({"status": "no_record", "message": "No hay registro de kilometraje para este día."}), 200
 
     # --- Lógica POST (Registrar/Actualizar) ---
-    body = request.get_json() or {}
-    
     km_value = body.get("km_value")
     action = body.get("action")
     notes = body.get("notas", "")
@@ -949,7 +3036,8 @@ def api_kilometraje():
             ws.append_row(row)
             
             # Invalida la caché de KM después de la escritura
-            CACHE.pop(KM_WS_NAME, None) 
+            invalidate_cache(KM_WS_NAME) 
+            mark_month_dirty(qdate)
             
             return jsonify({"status": "start_recorded", "km_inicio": km_value}), 201
 
@@ -969,11 +3057,16 @@ def api_kilometraje():
             KM_FIN_COL = KM_HEADERS.index("KM Fin") + 1
             RECORRIDO_COL = KM_HEADERS.index("Recorrido") + 1
             
-            ws.update_cell(existing_record_index, KM_FIN_COL, km_fin)
-            ws.update_cell(existing_record_index, RECORRIDO_COL, recorrido)
+            # Una sola escritura para ambas celdas
+            batch_update_cells(ws, [
+                (existing_record_index, KM_FIN_COL, km_fin),
+                (existing_record_index, RECORRIDO_COL, recorrido),
+            ])
             
             # Invalida la caché de KM después de la actualización
-            CACHE.pop(KM_WS_NAME, None) 
+            invalidate_cache(KM_WS_NAME) 
+            mark_month_dirty(qdate)
+            publish_event("km", {"fecha": qdate, "km_inicio": km_inicio, "km_fin": km_fin, "recorrido": recorrido})
             
             return jsonify({"status": "end_recorded", "km_fin": km_fin, "recorrido": recorrido}), 200
 
@@ -1002,6 +3095,9 @@ def api_summary():
         # calculate_daily_summary usa caching internamente
         summary_data = calculate_daily_summary(client, target_date)
         return jsonify(summary_data)
+    except SheetsUnavailable:
+        # Circuito abierto y sin copia en caché: 503 del manejador común, no un error interno
+        raise
     except Exception as e:
         app.logger.error(f"Error generando resumen: {e}")
         # Si el error es una cuota excedida, retornamos un error 503 (Service Unavailable)
@@ -1010,6 +3106,175 @@ def api_summary():
             
         return jsonify({"error": "Error interno al calcular el resumen."}), 500
 
+# ----------------------------
+# API: Proyección de bono
+# ----------------------------
+@app.route("/api/bonus/projection", methods=["GET"])
+def api_bonus_projection():
+    """
+    GET: optional ?date=YYYY-MM-DD (defaults to today). Meta actual y siguiente del bono,
+    viajes que faltan y tiempo estimado según el ritmo histórico de ese día de la semana y hora.
+    """
+    if not session.get('email'):
+        return jsonify({"error":"not_authenticated"}), 401
+
+    qdate = request.args.get("date") or date.today().isoformat()
+    day_of_week = weekday_of(qdate)
+    if day_of_week is None:
+        return jsonify({"error": "invalid_format", "message": "La fecha debe tener formato YYYY-MM-DD."}), 400
+
+    try:
+        client = get_gspread_client()
+        ws_trips = ensure_sheet_with_headers(client, TRIPS_WS_NAME, TRIPS_HEADERS)
+        all_trips = get_all_records_cached(ws_trips, TRIPS_WS_NAME)
+    except SheetsUnavailable:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error en proyección de bono: {e}")
+        return jsonify({"error": "Error interno al calcular la proyección."}), 500
+
+    TRIP_RATES.sync(all_trips)
+    num_trips = sum(1 for r in all_trips if str(r.get("Fecha")) == qdate)
+    thresholds, totals, reached = bonus_tier(qdate, num_trips)
+
+    result = {
+        "fecha": qdate,
+        "bonus_type": get_bonus_type(day_of_week),
+        "num_trips": num_trips,
+        "current_tier": reached,
+        "current_bonus": totals[reached],
+        "tiers": [{"trips": t, "total_bonus": totals[i + 1]} for i, t in enumerate(thresholds)],
+        "next_goal": None,
+        "trips_to_next": 0,
+        "next_bonus": None,
+        "projection": None,
+    }
+    if reached == len(thresholds):
+        return jsonify(result)
+
+    result["next_goal"] = thresholds[reached]
+    result["trips_to_next"] = thresholds[reached] - num_trips
+    result["next_bonus"] = totals[reached + 1]
+
+    # Desde ahora si es hoy; para otras fechas, desde el inicio del día
+    now = datetime.now()
+    start = now if qdate == now.date().isoformat() else datetime.fromisoformat(qdate)
+    rates, days_sampled = TRIP_RATES.hourly_rates(day_of_week)
+    minutes, expected_trips = project_minutes_to(result["trips_to_next"], rates, start)
+    result["projection"] = {
+        "from": start.strftime("%H:%M"),
+        "days_sampled": days_sampled,
+        "expected_trips_rest_of_day": expected_trips,
+        "expected_minutes": minutes,
+        "eta": (start + timedelta(minutes=minutes)).strftime("%H:%M") if minutes is not None else None,
+    }
+    return jsonify(result)
+
+# ----------------------------
+# API: Mapa de calor de ganancias
+# ----------------------------
+WEEKDAY_LABELS = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+EARNINGS_HEATMAP = EarningsHeatmap()
+
+@app.route("/api/analytics/heatmap", methods=["GET"])
+def api_earnings_heatmap():
+    """
+    GET: matrices 7x24 (filas Lunes..Domingo, columnas hora de inicio) con ganancia y viajes
+    promedio por hora trabajada y duración promedio, sobre todo el historial de viajes y extras.
+    optional ?top=N (default 5) para las mejores franjas por ganancia.
+    """
+    if not session.get('email'):
+        return jsonify({"error":"not_authenticated"}), 401
+
+    try:
+        top = max(0, min(int(request.args.get("top", 5)), 7 * 24))
+    except ValueError:
+        return jsonify({"error": "invalid_format", "message": "top debe ser un número."}), 400
+
+    try:
+        tables = get_sheets_cached(get_gspread_client(), [TRIPS_WS_NAME, EXTRAS_WS_NAME])
+    except SheetsUnavailable:
+        raise
+    except Exception as e:
+        app.logger.error(f"Error generando mapa de calor: {e}")
+        return jsonify({"error": "Error interno al calcular el mapa de calor."}), 500
+
+    # Solo procesa las filas agregadas desde la última consulta
+    EARNINGS_HEATMAP.sync(tables)
+    heatmap = EARNINGS_HEATMAP.snapshot()
+
+    cells = [
+        (earnings, day, hour)
+        for day, row in enumerate(heatmap["earnings_per_hour"])
+        for hour, earnings in enumerate(row)
+        if heatmap["total_trips"][day][hour] > 0
+    ]
+    cells.sort(reverse=True)
+    heatmap["best_slots"] = [{
+        "weekday": day,
+        "label": f"{WEEKDAY_LABELS[day]} {hour:02d}:00",
+        "earnings_per_hour": earnings,
+        "trips_per_hour": heatmap["trips_per_hour"][day][hour],
+        "avg_duration_min": heatmap["avg_duration_min"][day][hour],
+    } for earnings, day, hour in cells[:top]]
+    heatmap["weekdays"] = WEEKDAY_LABELS
+    heatmap["rows"] = sum(len(t) for t in tables.values())
+    return jsonify(heatmap)
+
+# ----------------------------
+# API: Eventos en vivo (SSE)
+# ----------------------------
+@app.route("/api/events", methods=["GET"])
+def api_events():
+    """
+    Stream text/event-stream con los eventos del usuario ('trips', 'expenses', 'km').
+    Se cierra a los SSE_MAX_STREAM segundos; EventSource reconecta con Last-Event-ID
+    y recibe los eventos que se perdió mientras tanto.
+    """
+    email = session.get('email')
+    if not email:
+        return jsonify({"error":"not_authenticated"}), 401
+
+    with _STREAMS_LOCK:
+        if _ACTIVE_STREAMS["count"] >= SSE_MAX_STREAMS:
+            return jsonify({"error": "too_many_streams", "message": "Demasiadas conexiones en vivo; la página se actualizará al guardar."}), 503
+        _ACTIVE_STREAMS["count"] += 1
+
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or request.args.get("last_id") or -1)
+    except ValueError:
+        last_id = -1
+    if last_id < 0:
+        last_id = EVENTS.last_id()
+
+    def stream(last_id):
+        yield "retry: 3000\n: conectado\n\n"
+        deadline = time.time() + SSE_MAX_STREAM
+        last_sent = time.time()
+        while time.time() < deadline:
+            events = EVENTS.since(email, last_id)
+            for event_id, event_type, data in events:
+                yield f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+                last_id = event_id
+            now = time.time()
+            if events:
+                last_sent = now
+            elif now - last_sent >= SSE_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_sent = now
+            EVENTS.wait(SSE_POLL_INTERVAL)
+
+    def release_stream():
+        with _STREAMS_LOCK:
+            _ACTIVE_STREAMS["count"] -= 1
+
+    response = app.response_class(stream(last_id), mimetype="text/event-stream")
+    # El servidor cierra la respuesta al terminar o si el cliente se desconecta
+    response.call_on_close(release_stream)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 # ----------------------------
 # API: Reporte Mensual
 # ----------------------------
@@ -1017,6 +3282,8 @@ def api_summary():
 def api_monthly_report():
     """
     GET: Requiere ?month=MM&year=YYYY. Calcula el reporte del mes y lo guarda en TripCounter_Summaries.
+    Los meses cerrados se sirven desde el resumen guardado salvo que tengan cambios
+    (o se pida ?refresh=1).
     """
     if not session.get('email'):
         return jsonify({"error":"not_authenticated"}), 401
@@ -1049,6 +3316,20 @@ def api_monthly_report():
     except ValueError:
         return jsonify({"error": "invalid_date", "message": "Mes o año inválido."}), 400
 
+    # 1b. Mes cerrado sin cambios: snapshot inmutable, sin leer datos crudos
+    closed = is_closed_month(year, month)
+    snapshot_key = month_key(year, month)
+    if closed and request.args.get("refresh") != "1" and not is_month_dirty(snapshot_key):
+        try:
+            snapshot = get_closed_month_snapshot(client, year, month)
+            if snapshot is not None:
+                return jsonify({"report": snapshot, "details": [], "snapshot": True}), 200
+        except Exception as e:
+            app.logger.warning(f"No se pudo leer el snapshot de {snapshot_key}, se recalcula: {e}")
+    if closed:
+        # Se limpia antes de recalcular: una escritura durante el cálculo lo vuelve a marcar
+        clear_month_dirty(snapshot_key)
+
     # 2. Iterar por cada día del mes y consolidar datos
     monthly_summary = {
         "month": month,
@@ -1122,18 +3403,26 @@ def api_monthly_report():
             round(monthly_summary["total_bonus"], 2), 
             round(monthly_summary["total_expenses"], 2),
             round(monthly_summary["net_income"], 2),
-            productivity_per_km
+            productivity_per_km,
+            date.today().isoformat(),
         ]
         
         if existing_row_index > 0:
-            ws_summaries.update(f'A{existing_row_index}', [row_data])
+            ws_summaries.update(range_name=f'A{existing_row_index}', values=[row_data])
             app.logger.info(f"Reporte mensual actualizado para {month}/{year}")
         else:
             ws_summaries.append_row(row_data)
             app.logger.info(f"Reporte mensual guardado para {month}/{year}")
             
         # Invalida la caché de SUMMARIES
-        CACHE.pop(SUMMARIES_WS_NAME, None) 
+        invalidate_cache(SUMMARIES_WS_NAME) 
+
+        # El mes cerrado recién guardado queda como snapshot en memoria (con la generación nueva)
+        if closed:
+            MONTHLY_SNAPSHOTS[snapshot_key] = (
+                _cache_generation(SUMMARIES_WS_NAME),
+                summary_row_to_report(dict(zip(SUMMARIES_HEADERS, row_data))),
+            )
 
     except Exception as e:
         app.logger.error(f"Error al guardar el resumen en Sheets: {e}")
@@ -0,0 +1,135 @@
+# ----------------------------
+# MAPA DE CALOR DE GANANCIAS (día de la semana x hora)
+# ----------------------------
+# Acumula, por celda día-de-la-semana x hora de inicio, las ganancias, la cantidad de viajes
+# y los minutos de viaje de TripCounter_Trips y TripCounter_Extras. Los acumuladores son
+# matrices numpy 7x24 y cada carga se suma de una vez con bincount sobre la columna
+# numérica "Total" de la SheetTable (sin copiarla).
+#
+# Las hojas de viajes y extras solo crecen por append: cada sync procesa únicamente las
+# filas nuevas desde la última vez. Si una tabla se acorta o su última fila procesada ya
+# no coincide (filas editadas o borradas a mano), el mapa se reconstruye desde cero.
+import threading
+from datetime import date
+
+import numpy as np
+
+CELLS = 7 * 24
+_MINUTES = {}
+_WEEKDAYS = {}
+
+
+def _minutes(value):
+    """'HH:MM' -> minutos desde medianoche (-1 si no es una hora válida). Con memo: hay pocas horas distintas."""
+    minutes = _MINUTES.get(value)
+    if minutes is None:
+        try:
+            hh, mm = str(value).split(":")[:2]
+            minutes = int(hh) * 60 + int(mm)
+            if not 0 <= minutes < 24 * 60:
+                minutes = -1
+        except ValueError:
+            minutes = -1
+        if len(_MINUTES) < 10000:
+            _MINUTES[value] = minutes
+    return minutes
+
+
+def _weekday(value):
+    weekday = _WEEKDAYS.get(value)
+    if weekday is None:
+        try:
+            weekday = date.fromisoformat(str(value)).weekday()
+        except ValueError:
+            weekday = -1
+        if len(_WEEKDAYS) < 100000:
+            _WEEKDAYS[value] = weekday
+    return weekday
+
+
+def _row_key(record):
+    return (str(record.get("Fecha")), str(record.get("Numero")), str(record.get("Hora inicio")))
+
+
+class EarningsHeatmap:
+    """Ganancias, viajes y duración por celda (día de la semana, hora), alimentado por tablas cacheadas."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.earnings = np.zeros(CELLS)
+        self.trips = np.zeros(CELLS, dtype=np.int64)
+        self.duration_sum = np.zeros(CELLS)
+        self.duration_count = np.zeros(CELLS, dtype=np.int64)
+        self.days = [set() for _ in range(7)]
+        self.cursors = {}  # fuente -> (filas procesadas, clave de la última fila)
+
+    def _is_behind(self, source, table):
+        consumed, last_key = self.cursors.get(source, (0, None))
+        return len(table) < consumed or (consumed and _row_key(table[consumed - 1]) != last_key)
+
+    def _add(self, table, start):
+        rows = table.rows[start:] if hasattr(table, "rows") else list(table)[start:]
+        if not rows:
+            return
+        numeric = getattr(table, "numeric", {})
+        if "Total" in numeric:
+            totals = np.frombuffer(numeric["Total"], dtype=np.float64)[start:]
+        else:
+            totals = np.fromiter((float(r.get("Total") or 0) for r in rows), dtype=np.float64, count=len(rows))
+
+        weekdays = np.fromiter((_weekday(r.get("Fecha")) for r in rows), dtype=np.int64, count=len(rows))
+        starts = np.fromiter((_minutes(r.get("Hora inicio")) for r in rows), dtype=np.int64, count=len(rows))
+        ends = np.fromiter((_minutes(r.get("Hora fin")) for r in rows), dtype=np.int64, count=len(rows))
+
+        valid = (weekdays >= 0) & (starts >= 0)
+        cells = weekdays[valid] * 24 + starts[valid] // 60
+        self.earnings += np.bincount(cells, weights=totals[valid], minlength=CELLS)
+        self.trips += np.bincount(cells, minlength=CELLS)
+
+        # Duración en minutos; un viaje que cruza la medianoche termina "antes" de empezar
+        durations = (ends - starts) % (24 * 60)
+        timed = valid & (ends >= 0)
+        timed_cells = weekdays[timed] * 24 + starts[timed] // 60
+        self.duration_sum += np.bincount(timed_cells, weights=durations[timed], minlength=CELLS)
+        self.duration_count += np.bincount(timed_cells, minlength=CELLS)
+
+        for row, weekday in zip(rows, weekdays):
+            if weekday >= 0:
+                self.days[weekday].add(str(row.get("Fecha")))
+
+    def sync(self, tables):
+        """Incorpora las filas nuevas de {fuente: tabla}; reconstruye si alguna tabla cambió de forma."""
+        with self._lock:
+            if any(self._is_behind(source, table) for source, table in tables.items()):
+                self._reset()
+            for source, table in tables.items():
+                consumed, _ = self.cursors.get(source, (0, None))
+                if len(table) > consumed:
+                    self._add(table, consumed)
+                    self.cursors[source] = (len(table), _row_key(table[len(table) - 1]))
+
+    def snapshot(self):
+        """
+        Matrices 7x24 (0=Lunes): ganancia y viajes promedio por hora en un día trabajado
+        de ese día de la semana, y duración promedio de viaje (minutos) por celda.
+        """
+        with self._lock:
+            days = np.array([len(d) for d in self.days], dtype=np.float64)
+            earnings = self.earnings.reshape(7, 24).copy()
+            trips = self.trips.reshape(7, 24).astype(np.float64)
+            duration_sum = self.duration_sum.reshape(7, 24).copy()
+            duration_count = self.duration_count.reshape(7, 24).astype(np.float64)
+
+        per_day = np.where(days > 0, days, 1.0)[:, None]
+        avg_duration = np.divide(duration_sum, duration_count, out=np.zeros_like(duration_sum), where=duration_count > 0)
+        return {
+            "days_sampled": days.astype(int).tolist(),
+            "earnings_per_hour": np.round(earnings / per_day, 2).tolist(),
+            "trips_per_hour": np.round(trips / per_day, 2).tolist(),
+            "avg_duration_min": np.round(avg_duration, 1).tolist(),
+            "total_earnings": np.round(earnings, 2).tolist(),
+            "total_trips": trips.astype(int).tolist(),
+        }
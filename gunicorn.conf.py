@@ -0,0 +1,30 @@
+# ----------------------------
+# Configuración de gunicorn (Render: gunicorn -c gunicorn.conf.py app:app)
+# ----------------------------
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# Hilos por worker: un stream SSE (/api/events) ocupa un hilo mientras está abierto,
+# con workers "sync" bloquearía el worker completo.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+
+# Importa app.py (Flask, gspread, google-auth) una sola vez en el master;
+# los workers lo heredan por fork en lugar de importarlo cada uno.
+preload_app = True
+
+loglevel = os.environ.get("LOG_LEVEL", "debug")
+capture_output = True
+enable_stdio_inheritance = True
+
+
+def post_fork(server, worker):
+    """
+    Cada worker autoriza su propio cliente de GSheets (las conexiones HTTP no se
+    comparten entre procesos), abre todas las hojas y precarga la caché en segundo plano.
+    /ready responde 200 cuando termina.
+    """
+    from app import start_warm_up
+    start_warm_up()
@@ -0,0 +1,443 @@
+# ----------------------------
+# SERVIDOR FALSO DE GOOGLE SHEETS (pruebas de carga sin conexión)
+# ----------------------------
+# Implementa solo la parte de Sheets v4 / Drive v3 que usa gspread en app.py:
+#   GET  /v4/spreadsheets/{id}                      metadatos (open_by_key, get_worksheet)
+#   GET  /v4/spreadsheets/{id}/values/{rango}       row_values, col_values, get_all_records
+#   GET  /v4/spreadsheets/{id}/values:batchGet      batch_get (varios rangos en una llamada)
+#   PUT  /v4/spreadsheets/{id}/values/{rango}       insert_row (después de insertDimension)
+#   POST /v4/spreadsheets/{id}/values/{rango}:append   append_row / append_rows
+#   POST /v4/spreadsheets/{id}/values:batchUpdate   batch_update de celdas
+#   POST /v4/spreadsheets/{id}:batchUpdate          delete_rows / insert_row (dimensiones)
+#   GET  /drive/v3/files/{id}                       modifiedTime (probe de cambios)
+#   GET  /drive/v3/files                            client.open por nombre
+# Cada archivo se crea al primer uso con una sola pestaña "Sheet1". Los valores se
+# guardan como texto (como los devuelve FORMATTED_VALUE).
+#
+# Simulación de la API real:
+#   --latency-ms / --jitter-ms   retardo por llamada
+#   --error-rate                 fracción de llamadas que responden 429
+#   --quota-per-minute           429 al superar N llamadas en la última ventana de 60 s
+#
+# Endpoints de control (no cuentan como llamadas):
+#   GET  /_stats                 llamadas por tipo, 429 devueltos
+#   POST /_stats/reset           pone a cero los contadores
+#   POST /_seed/{id}             {"rows": [{cabecera: valor}, ...]} añade filas según la fila 1
+#   GET  /_sheet/{id}            contenido completo de la pestaña
+#
+# Uso: python -m loadtest.fake_sheets --port 8085 --latency-ms 120 --error-rate 0.01
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter, deque
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, unquote, parse_qs
+
+SHEET_TITLE = "Sheet1"
+ROW_COUNT = 1000
+COLUMN_COUNT = 26
+
+_CELL_RE = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+
+def column_index(letters):
+    """'A' -> 0, 'Z' -> 25, 'AA' -> 26."""
+    index = 0
+    for ch in letters.upper():
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1
+
+
+def column_letters(index):
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def parse_range(a1):
+    """
+    "'Sheet1'!A2:C5" -> (1, 0, 4, 2) como (fila0, col0, fila_fin, col_fin) inclusivos,
+    con None para los extremos abiertos ("A1:A", "A1:1", "'Sheet1'").
+    """
+    if "!" in a1:
+        a1 = a1.split("!", 1)[1]
+    elif a1.strip("'") == SHEET_TITLE:
+        a1 = ""
+    if not a1:
+        return 0, 0, None, None
+    start, _, end = a1.partition(":")
+    m1, m2 = _CELL_RE.match(start), _CELL_RE.match(end or start)
+    if not m1 or not m2:
+        raise ValueError(f"Unable to parse range: {a1}")
+
+    def bounds(m):
+        col = column_index(m.group(1)) if m.group(1) else None
+        row = int(m.group(2)) - 1 if m.group(2) else None
+        return row, col
+
+    r0, c0 = bounds(m1)
+    r1, c1 = bounds(m2)
+    return r0 or 0, c0 or 0, r1, c1
+
+
+def cell_text(value):
+    """Valor JSON escrito por gspread -> texto tal como lo mostraría Sheets."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    text = str(value)
+    if text in ("True", "False"):
+        return text.upper()
+    return text[1:] if text.startswith("'") else text
+
+
+def now_rfc3339():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class FakeSpreadsheet:
+    def __init__(self, spreadsheet_id, title=None):
+        self.id = spreadsheet_id
+        self.title = title or spreadsheet_id
+        self.rows = []  # list[list[str]]
+        self.modified = now_rfc3339()
+
+    def touch(self):
+        self.modified = now_rfc3339()
+
+    def metadata(self):
+        return {
+            "spreadsheetId": self.id,
+            "properties": {"title": self.title, "locale": "es_PE", "timeZone": "America/Lima"},
+            "sheets": [{
+                "properties": {
+                    "sheetId": 0,
+                    "title": SHEET_TITLE,
+                    "index": 0,
+                    "sheetType": "GRID",
+                    "gridProperties": {"rowCount": max(ROW_COUNT, len(self.rows)), "columnCount": COLUMN_COUNT},
+                }
+            }],
+            "spreadsheetUrl": f"http://fake-sheets/{self.id}",
+        }
+
+    # --- Lectura ---
+    def read(self, a1, major_dimension="ROWS"):
+        r0, c0, r1, c1 = parse_range(a1)
+        last_row = len(self.rows) - 1 if r1 is None else min(r1, len(self.rows) - 1)
+        values = []
+        for row in self.rows[r0:last_row + 1]:
+            end = len(row) if c1 is None else c1 + 1
+            values.append(row[c0:end])
+        # Sheets recorta las filas y celdas vacías del final
+        for row in values:
+            while row and row[-1] == "":
+                row.pop()
+        while values and not values[-1]:
+            values.pop()
+        if major_dimension == "COLUMNS":
+            width = max((len(r) for r in values), default=0)
+            values = [[r[c] if c < len(r) else "" for r in values] for c in range(width)]
+            for col in values:
+                while col and col[-1] == "":
+                    col.pop()
+        result = {"range": f"{SHEET_TITLE}!{a1.split('!')[-1] or 'A1:Z' + str(ROW_COUNT)}", "majorDimension": major_dimension}
+        if values:
+            result["values"] = values
+        return result
+
+    # --- Escritura ---
+    def write(self, r0, c0, values):
+        for i, row_values in enumerate(values):
+            r = r0 + i
+            while len(self.rows) <= r:
+                self.rows.append([])
+            row = self.rows[r]
+            for j, value in enumerate(row_values):
+                c = c0 + j
+                while len(row) <= c:
+                    row.append("")
+                row[c] = cell_text(value)
+        self.touch()
+        return sum(len(v) for v in values)
+
+    def update(self, a1, values):
+        r0, c0, _, _ = parse_range(a1)
+        cells = self.write(r0, c0, values)
+        return {"spreadsheetId": self.id, "updatedRange": a1, "updatedRows": len(values), "updatedCells": cells}
+
+    def append(self, a1, values):
+        _, c0, _, _ = parse_range(a1)
+        last = len(self.rows)
+        while last > 0 and not any(self.rows[last - 1]):
+            last -= 1
+        cells = self.write(last, c0, values)
+        first, end = last + 1, last + len(values)
+        updated = f"{SHEET_TITLE}!{column_letters(c0)}{first}:{column_letters(c0 + max(len(v) for v in values) - 1)}{end}"
+        return {
+            "spreadsheetId": self.id,
+            "tableRange": f"{SHEET_TITLE}!A1:{column_letters(COLUMN_COUNT - 1)}{last}",
+            "updates": {"spreadsheetId": self.id, "updatedRange": updated, "updatedRows": len(values), "updatedCells": cells},
+        }
+
+    def apply_request(self, req):
+        if "deleteDimension" in req:
+            rng = req["deleteDimension"]["range"]
+            if rng.get("dimension", "ROWS") == "ROWS":
+                del self.rows[rng["startIndex"]:rng["endIndex"]]
+        elif "insertDimension" in req:
+            rng = req["insertDimension"]["range"]
+            if rng.get("dimension", "ROWS") == "ROWS":
+                start = rng["startIndex"]
+                while len(self.rows) < start:
+                    self.rows.append([])
+                for _ in range(rng["endIndex"] - start):
+                    self.rows.insert(start, [])
+        # Otras peticiones (formato, propiedades) se aceptan sin efecto
+        self.touch()
+        return {}
+
+
+class FakeSheetsState:
+    """Archivos, contadores y parámetros de simulación (compartidos por todos los hilos)."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, quota_per_minute=0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.spreadsheets = {}
+        self.calls = Counter()
+        self.throttled = 0
+        self.window = deque()
+
+    def spreadsheet(self, spreadsheet_id):
+        sheet = self.spreadsheets.get(spreadsheet_id)
+        if sheet is None:
+            sheet = self.spreadsheets[spreadsheet_id] = FakeSpreadsheet(spreadsheet_id)
+        return sheet
+
+    def admit(self, kind):
+        """Registra la llamada; retorna False si debe responder 429."""
+        now = time.monotonic()
+        with self.lock:
+            self.calls[kind] += 1
+            while self.window and self.window[0] < now - 60:
+                self.window.popleft()
+            over_quota = self.quota_per_minute and len(self.window) >= self.quota_per_minute
+            if over_quota or (self.error_rate and self.random.random() < self.error_rate):
+                self.throttled += 1
+                return False
+            self.window.append(now)
+            return True
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0)
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "total": sum(self.calls.values()), "throttled": self.throttled}
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            self.throttled = 0
+            self.window.clear()
+
+
+class FakeSheetsHandler(BaseHTTPRequestHandler):
+    server_version = "FakeSheets/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    # --- Utilidades ---
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _send(self, code, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, code, status, message):
+        self._send(code, {"error": {"code": code, "message": message, "status": status}})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    # --- Rutas ---
+    def _dispatch(self, method):
+        parts = urlsplit(self.path)
+        path, query = unquote(parts.path), parse_qs(parts.query)
+        try:
+            body = self._body()
+            if path.startswith("/_"):
+                return self._control(method, path, body)
+            route = self._route(method, path)
+            if route is None:
+                return self._error(404, "NOT_FOUND", f"Unsupported call: {method} {path}")
+            kind, handler = route
+            if not self.state.admit(kind):
+                return self._error(429, "RESOURCE_EXHAUSTED",
+                                   "Quota exceeded for quota metric 'Read requests' (fake sheets)")
+            self.state.delay()
+            with self.state.lock:
+                code, payload = handler(query, body)
+            self._send(code, payload)
+        except ValueError as e:
+            self._error(400, "INVALID_ARGUMENT", str(e))
+
+    def _route(self, method, path):
+        state = self.state
+        m = re.match(r"^/v4/spreadsheets/([^/:]+)(.*)$", path)
+        if m:
+            sheet = state.spreadsheet(m.group(1))
+            rest = m.group(2)
+            if method == "GET" and rest == "":
+                return "metadata", lambda q, b: (200, sheet.metadata())
+            if method == "POST" and rest == ":batchUpdate":
+                return "batch_update", lambda q, b: (200, {
+                    "spreadsheetId": sheet.id,
+                    "replies": [sheet.apply_request(r) for r in b.get("requests", [])],
+                })
+            if method == "POST" and rest == "/values:batchUpdate":
+                def batch_values(q, b):
+                    cells = 0
+                    for item in b.get("data", []):
+                        cells += sheet.update(item["range"], item.get("values", []))["updatedCells"]
+                    return 200, {"spreadsheetId": sheet.id, "totalUpdatedCells": cells}
+                return "values_batch_update", batch_values
+            if method == "GET" and rest == "/values:batchGet":
+                return "values_batch_get", lambda q, b: (200, {
+                    "spreadsheetId": sheet.id,
+                    "valueRanges": [sheet.read(a1, q.get("majorDimension", ["ROWS"])[0]) for a1 in q.get("ranges", [])],
+                })
+            if rest.startswith("/values/"):
+                a1 = rest[len("/values/"):]
+                if method == "POST" and a1.endswith(":append"):
+                    return "values_append", lambda q, b: (200, sheet.append(a1[:-len(":append")], b.get("values", [])))
+                if method == "PUT":
+                    return "values_update", lambda q, b: (200, sheet.update(a1, b.get("values", [])))
+                if method == "GET":
+                    return "values_get", lambda q, b: (200, sheet.read(a1, q.get("majorDimension", ["ROWS"])[0]))
+            return None
+
+        m = re.match(r"^/drive/v3/files(?:/([^/]+))?$", path)
+        if m and method == "GET":
+            if m.group(1):
+                sheet = state.spreadsheet(m.group(1))
+                return "drive_get", lambda q, b: (200, {
+                    "id": sheet.id, "name": sheet.title, "modifiedTime": sheet.modified,
+                    "mimeType": "application/vnd.google-apps.spreadsheet",
+                })
+
+            def drive_list(q, b):
+                title = re.search(r'name\s*=\s*"([^"]*)"', q.get("q", [""])[0])
+                files = [s for s in state.spreadsheets.values() if title and s.title == title.group(1)]
+                if title and not files:
+                    # client.open(nombre): el archivo se crea con el nombre como id
+                    files = [state.spreadsheet(title.group(1))]
+                return 200, {"files": [{"id": s.id, "name": s.title, "modifiedTime": s.modified,
+                                        "mimeType": "application/vnd.google-apps.spreadsheet"} for s in files]}
+            return "drive_list", drive_list
+        return None
+
+    def _control(self, method, path, body):
+        state = self.state
+        if path == "/_stats" and method == "GET":
+            return self._send(200, state.stats())
+        if path == "/_stats/reset" and method == "POST":
+            state.reset_stats()
+            return self._send(200, {"ok": True})
+        m = re.match(r"^/_(seed|sheet)/([^/]+)$", path)
+        if m:
+            with state.lock:
+                sheet = state.spreadsheet(m.group(2))
+                if m.group(1) == "sheet" and method == "GET":
+                    return self._send(200, {"rows": sheet.rows, "modifiedTime": sheet.modified})
+                if m.group(1) == "seed" and method == "POST":
+                    headers = list(body.get("headers") or (sheet.rows[0] if sheet.rows else []))
+                    if not sheet.rows:
+                        sheet.write(0, 0, [headers])
+                    rows = [[r.get(h, "") for h in headers] for r in body.get("rows", [])]
+                    if rows:
+                        sheet.append("A1", rows)
+                    return self._send(200, {"rows": len(sheet.rows)})
+        return self._error(404, "NOT_FOUND", f"Unknown control path: {path}")
+
+
+class FakeSheetsServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, state=None, verbose=False):
+        super().__init__(address, FakeSheetsHandler)
+        self.state = state or FakeSheetsState()
+        self.verbose = verbose
+
+    @property
+    def host(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+
+def start_in_thread(host="127.0.0.1", port=0, **options):
+    """Arranca el servidor en un hilo daemon y lo retorna (port=0 elige un puerto libre)."""
+    verbose = options.pop("verbose", False)
+    server = FakeSheetsServer((host, port), FakeSheetsState(**options), verbose=verbose)
+    threading.Thread(target=server.serve_forever, name="fake-sheets", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso de Google Sheets para pruebas de carga")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8085)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota-per-minute", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    state = FakeSheetsState(args.latency_ms, args.jitter_ms, args.error_rate, args.quota_per_minute)
+    server = FakeSheetsServer((args.host, args.port), state, verbose=args.verbose)
+    print(f"Fake Google Sheets escuchando en http://{server.host} (GSHEETS_EMULATOR_HOST={server.host})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
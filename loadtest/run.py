@@ -0,0 +1,325 @@
+# ----------------------------
+# PRUEBA DE CARGA SIN CONEXIÓN (gunicorn + app:app + Google Sheets falso)
+# ----------------------------
+# 1. Arranca loadtest/fake_sheets.py en un hilo (con la latencia / 429 indicados).
+# 2. Carga datos de ejemplo (viajes, gastos y presupuesto de N usuarios).
+# 3. Lanza gunicorn con gunicorn.conf.py y GSHEETS_EMULATOR_HOST apuntando al falso,
+#    y espera a que /ready responda 200 (warm-up terminado).
+# 4. Ejecuta una mezcla de peticiones con varios hilos durante --duration segundos,
+#    con cookies de sesión firmadas con la misma FLASK_SECRET_KEY.
+# 5. Reporta por endpoint: peticiones/s, p50/p95/p99, errores y llamadas a Sheets por
+#    petición (leídas de la cabecera Server-Timing de la app), más el total de llamadas
+#    recibidas por el servidor falso.
+#
+# Uso (desde la raíz del repo):
+#   python -m loadtest.run --workers 2 --concurrency 16 --duration 30 --latency-ms 150
+#   python -m loadtest.run --error-rate 0.02 --json resultados.json
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from datetime import date, timedelta
+
+import requests
+
+from loadtest.fake_sheets import start_in_thread
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SHEET_ID_ENV = {
+    "TripCounter_Presupuesto": "PRESUPUESTO_SHEET_ID",
+    "TripCounter_Trips": "TRIPS_SHEET_ID",
+    "TripCounter_Bonuses": "BONUS_SHEET_ID",
+    "TripCounter_Gastos": "GASTOS_SHEET_ID",
+    "TripCounter_Extras": "EXTRAS_SHEET_ID",
+    "TripCounter_Kilometraje": "KM_SHEET_ID",
+    "TripCounter_Summaries": "SUMMARIES_SHEET_ID",
+}
+
+_SHEETS_CALLS_RE = re.compile(r'sheets;dur=([\d.]+);desc="(\d+) calls"')
+
+
+def percentile(sorted_values, p):
+    """Percentil por rango más cercano (lista ya ordenada)."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+# --- Datos de ejemplo ---
+def seed_data(sheets_url, headers, days, trips_per_day, users):
+    """Carga en el servidor falso viajes y gastos de los últimos `days` días y presupuesto por usuario."""
+    rnd = random.Random(42)
+    today = date.today()
+    trips, expenses = [], []
+    for d in range(days):
+        fecha = (today - timedelta(days=d)).isoformat()
+        for n in range(1, trips_per_day + 1):
+            hour = 6 + (n * 16) // max(trips_per_day, 1)
+            monto = round(rnd.uniform(8, 35), 2)
+            trips.append({
+                "Fecha": fecha, "Numero": n, "Hora inicio": f"{hour:02d}:00", "Hora fin": f"{hour:02d}:30",
+                "Monto": monto, "Propina": 0, "Aeropuerto": 0, "Total": monto,
+            })
+        expenses.append({"Fecha": fecha, "Hora": "13:00", "Monto": 12, "Categoría": "Combustible", "Descripción": "seed"})
+    presupuesto = []
+    for alias in users:
+        for i in range(3):
+            due = (today + timedelta(days=i * 5)).isoformat()
+            presupuesto.append({"alias": alias.split("@")[0], "categoria": f"Cuota {i + 1}", "monto": 100 + i,
+                                "tipo": "mensual", "fecha_pago": due, "pagado": "False"})
+
+    for ws_name, rows in (("TripCounter_Trips", trips), ("TripCounter_Gastos", expenses),
+                          ("TripCounter_Presupuesto", presupuesto)):
+        requests.post(f"{sheets_url}/_seed/{ws_name}", json={"headers": headers[ws_name], "rows": rows}).raise_for_status()
+    for ws_name in SHEET_ID_ENV:
+        if ws_name not in ("TripCounter_Trips", "TripCounter_Gastos", "TripCounter_Presupuesto"):
+            requests.post(f"{sheets_url}/_seed/{ws_name}", json={"headers": headers[ws_name], "rows": []}).raise_for_status()
+    return {"trips": len(trips), "expenses": len(expenses), "presupuesto": len(presupuesto)}
+
+
+# --- Escenarios (peso, etiqueta, función que arma la petición) ---
+def build_scenarios():
+    today = date.today()
+    last_month = today.replace(day=1) - timedelta(days=1)
+
+    def trip_body():
+        return {"monto": round(random.uniform(8, 35), 2), "hora_inicio": "10:00", "hora_fin": "10:25"}
+
+    def expense_body():
+        return {"monto": 5, "categoria": "Peaje", "descripcion": "loadtest"}
+
+    return [
+        (30, "GET /api/trips", lambda: ("GET", "/api/trips", None)),
+        (20, "GET /api/summary", lambda: ("GET", "/api/summary", None)),
+        (15, "POST /api/trips", lambda: ("POST", "/api/trips", trip_body())),
+        (10, "GET /api/expenses", lambda: ("GET", "/api/expenses", None)),
+        (5, "POST /api/expenses", lambda: ("POST", "/api/expenses", expense_body())),
+        (10, "GET /api/presupuesto", lambda: ("GET", "/api/presupuesto", None)),
+        (5, "GET /api/reminders", lambda: ("GET", "/api/reminders", None)),
+        (5, "GET /api/monthly_report", lambda: (
+            "GET", f"/api/monthly_report?month={last_month.month}&year={last_month.year}", None)),
+    ]
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.sheets_calls = defaultdict(int)
+
+    def add(self, label, ms, status, sheets_calls):
+        with self.lock:
+            self.latencies[label].append(ms)
+            self.statuses[label][status] += 1
+            self.sheets_calls[label] += sheets_calls
+
+    def report(self, elapsed):
+        rows = []
+        for label in sorted(self.latencies):
+            values = sorted(self.latencies[label])
+            count = len(values)
+            errors = sum(n for status, n in self.statuses[label].items() if status == "error" or status >= 500)
+            rows.append({
+                "endpoint": label,
+                "requests": count,
+                "rps": round(count / elapsed, 2),
+                "p50_ms": round(percentile(values, 50), 1),
+                "p95_ms": round(percentile(values, 95), 1),
+                "p99_ms": round(percentile(values, 99), 1),
+                "errors": errors,
+                "statuses": {str(k): v for k, v in self.statuses[label].items()},
+                "sheets_calls_per_request": round(self.sheets_calls[label] / count, 2) if count else 0.0,
+            })
+        return rows
+
+
+def session_cookie(secret_key, email):
+    """Cookie de sesión de Flask firmada (equivalente a haber pasado por /oauth2callback)."""
+    from flask import Flask
+    signer_app = Flask(__name__, root_path=ROOT)
+    signer_app.secret_key = secret_key
+    return signer_app.session_interface.get_signing_serializer(signer_app).dumps({"email": email})
+
+
+def run_load(base_url, cookies, duration, concurrency, results):
+    scenarios = build_scenarios()
+    weights = [w for w, _, _ in scenarios]
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        http = requests.Session()
+        http.cookies.set("session", cookies[index % len(cookies)])
+        rnd = random.Random(index)
+        while time.monotonic() < deadline:
+            _, label, make = rnd.choices(scenarios, weights=weights)[0]
+            method, path, body = make()
+            started = time.perf_counter()
+            try:
+                resp = http.request(method, base_url + path, json=body, timeout=60)
+                status = resp.status_code
+                match = _SHEETS_CALLS_RE.search(resp.headers.get("Server-Timing", ""))
+                calls = int(match.group(2)) if match else 0
+            except requests.RequestException:
+                status, calls = "error", 0
+            results.add(label, (time.perf_counter() - started) * 1000.0, status, calls)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.monotonic() - started
+
+
+def wait_ready(base_url, proc, timeout):
+    deadline = time.monotonic() + timeout
+    last = None
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó con código {proc.returncode}")
+        try:
+            resp = requests.get(base_url + "/ready", timeout=2)
+            last = resp.json()
+            if resp.status_code == 200:
+                return last
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"/ready no respondió 200 en {timeout}s (último estado: {last})")
+
+
+def print_report(rows, elapsed, upstream, workers, concurrency):
+    total = sum(r["requests"] for r in rows)
+    print()
+    print(f"Duración {elapsed:.1f}s · {workers} workers · {concurrency} hilos cliente · "
+          f"{total} peticiones ({total / elapsed:.1f} req/s)")
+    header = f"{'endpoint':<26}{'req':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'err':>6}{'sheets/req':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['endpoint']:<26}{r['requests']:>7}{r['rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+              f"{r['p99_ms']:>9}{r['errors']:>6}{r['sheets_calls_per_request']:>12}")
+    print("-" * len(header))
+    print(f"Servidor falso: {upstream['total']} llamadas ({upstream['throttled']} respondidas con 429) · "
+          f"{upstream['total'] / total if total else 0:.2f} por petición")
+    print("  por tipo: " + ", ".join(f"{k}={v}" for k, v in sorted(upstream["calls"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de app:app con Google Sheets falso")
+    parser.add_argument("--workers", type=int, default=2, help="workers de gunicorn")
+    parser.add_argument("--concurrency", type=int, default=16, help="hilos cliente")
+    parser.add_argument("--duration", type=float, default=30, help="segundos de carga")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--seed-days", type=int, default=45)
+    parser.add_argument("--trips-per-day", type=int, default=18)
+    parser.add_argument("--latency-ms", type=float, default=120, help="latencia simulada de Sheets")
+    parser.add_argument("--jitter-ms", type=float, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de llamadas con 429")
+    parser.add_argument("--quota-per-minute", type=int, default=0)
+    parser.add_argument("--port", type=int, default=18080, help="puerto de gunicorn")
+    parser.add_argument("--ready-timeout", type=float, default=60)
+    parser.add_argument("--json", help="guarda los resultados en este archivo")
+    parser.add_argument("--keep-logs", action="store_true", help="no borra el log de gunicorn")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tripcounter-loadtest-")
+    secret_key = "loadtest-secret"
+    env = dict(os.environ)
+    env.update({
+        "FLASK_SECRET_KEY": secret_key,
+        "SHARED_CACHE_PATH": os.path.join(workdir, "cache.sqlite3"),
+        "SNAPSHOT_DIR": os.path.join(workdir, "snapshots"),
+        "WEB_CONCURRENCY": str(args.workers),
+        "LOG_LEVEL": "warning",
+    })
+    for ws_name, var in SHEET_ID_ENV.items():
+        env[var] = ws_name
+
+    fake = start_in_thread(latency_ms=0)
+    sheets_url = f"http://{fake.host}"
+    env["GSHEETS_EMULATOR_HOST"] = fake.host
+
+    # Cabeceras tal como las define app.py (sin importar la app: evita abrir su caché)
+    headers = _sheet_headers()
+    users = [f"loadtest{i}@example.com" for i in range(args.users)]
+    seeded = seed_data(sheets_url, headers, args.seed_days, args.trips_per_day, users)
+    print(f"Datos de ejemplo: {seeded}")
+
+    # La latencia se activa después de sembrar (el warm-up ya la sufre)
+    fake.state.latency_ms = args.latency_ms
+    fake.state.jitter_ms = args.jitter_ms
+
+    log_path = os.path.join(workdir, "gunicorn.log")
+    base_url = f"http://127.0.0.1:{args.port}"
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+             "--bind", f"127.0.0.1:{args.port}", "--workers", str(args.workers), "app:app"],
+            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    try:
+        ready = wait_ready(base_url, proc, args.ready_timeout)
+        print(f"gunicorn listo ({args.workers} workers, warm-up: {ready['status']})")
+        # Los 429 solo durante la carga medida: con muchos errores el warm-up no terminaría
+        fake.state.error_rate = args.error_rate
+        fake.state.quota_per_minute = args.quota_per_minute
+        fake.state.reset_stats()
+
+        results = Results()
+        cookies = [session_cookie(secret_key, u) for u in users]
+        elapsed = run_load(base_url, cookies, args.duration, args.concurrency, results)
+        upstream = fake.state.stats()
+        rows = results.report(elapsed)
+        print_report(rows, elapsed, upstream, args.workers, args.concurrency)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"elapsed_s": round(elapsed, 2), "workers": args.workers, "concurrency": args.concurrency,
+                           "latency_ms": args.latency_ms, "error_rate": args.error_rate,
+                           "endpoints": rows, "upstream": upstream}, f, indent=2)
+            print(f"Resultados guardados en {args.json}")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake.shutdown()
+        if args.keep_logs:
+            print(f"Log de gunicorn: {log_path}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _sheet_headers():
+    """Lee SHEET_HEADERS de app.py sin ejecutarlo (solo las constantes de cabeceras)."""
+    import ast
+    with open(os.path.join(ROOT, "app.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name.endswith(("_HEADERS", "_WS_NAME")):
+                try:
+                    constants[name] = ast.literal_eval(node.value)
+                except ValueError:
+                    pass
+    return {constants[name]: constants[name.replace("_WS_NAME", "_HEADERS")]
+            for name in constants if name.endswith("_WS_NAME")}
+
+
+if __name__ == "__main__":
+    main()
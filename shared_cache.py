@@ -0,0 +1,377 @@
+# ----------------------------
+# CACHÉ COMPARTIDA ENTRE WORKERS (SQLite local)
+# ----------------------------
+# Con varios workers de gunicorn cada proceso tiene su propio CACHE en memoria:
+# sin una capa común, cada worker descarga las mismas hojas y una invalidación en
+# un worker no la ve el resto. Este módulo guarda en un archivo SQLite del mismo
+# host (modo WAL, lecturas concurrentes sin bloqueo):
+#   - entries:     la última copia de cada hoja, con su expiración, generación y la
+#                  señal de cambio (p. ej. modifiedTime) con la que se descargó.
+#   - generations: un contador por hoja que se incrementa en cada invalidación.
+#   - locks:       un candado por hoja para que solo un worker la descargue a la vez.
+#   - marks:       marcas simples compartidas (p. ej. meses cerrados con cambios).
+#   - write_queue: escrituras recibidas con Google Sheets caído, pendientes de reenviar.
+#   - events:      eventos recientes por usuario para los streams SSE de todos los workers.
+#   - idempotency: claves Idempotency-Key con su respuesta, para que un reintento que llega
+#                  a otro worker no repita la escritura.
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "tripcounter_cache.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    data BLOB NOT NULL,
+    signal TEXT
+);
+CREATE TABLE IF NOT EXISTS generations (
+    name TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS locks (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS marks (
+    name TEXT PRIMARY KEY,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS write_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    email TEXT NOT NULL,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    email TEXT NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_email ON events (email, id);
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    expires REAL NOT NULL,
+    status INTEGER,
+    mimetype TEXT,
+    body BLOB
+);
+CREATE INDEX IF NOT EXISTS idempotency_by_expires ON idempotency (expires);
+"""
+
+
+class SharedCache:
+    """
+    Caché de hojas compartida por todos los procesos del host.
+
+    Los datos se guardan ya serializados (bytes); quien llama decide el formato.
+    Cualquier error de SQLite se registra y se trata como un fallo de caché:
+    la aplicación sigue funcionando solo con su caché local.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._init_schema()
+
+    # --- Conexión por hilo y por proceso (las conexiones no sobreviven a un fork) ---
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_schema(self):
+        try:
+            conn = self._conn()
+            conn.executescript(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            if "signal" not in columns:
+                # Archivo creado por una versión anterior (la caché es desechable)
+                conn.execute("ALTER TABLE entries ADD COLUMN signal TEXT")
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida no disponible en {self.path}: {e}")
+
+    # --- Generaciones (invalidación entre procesos) ---
+    def generation(self, name):
+        """Generación actual de la hoja (0 si nunca se invalidó o si SQLite falla)."""
+        try:
+            row = self._conn().execute("SELECT generation FROM generations WHERE name = ?", (name,)).fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error leyendo generación de {name}: {e}")
+            return 0
+
+    def invalidate(self, name):
+        """Incrementa la generación y borra la copia: todos los workers recargarán la hoja."""
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO generations (name, generation) VALUES (?, 1) "
+                    "ON CONFLICT(name) DO UPDATE SET generation = generation + 1",
+                    (name,),
+                )
+                conn.execute("DELETE FROM entries WHERE name = ?", (name,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error invalidando {name}: {e}")
+
+    # --- Datos ---
+    def get(self, name):
+        """Retorna (generation, expires, data, signal) o None (aunque la copia haya expirado)."""
+        try:
+            row = self._conn().execute(
+                "SELECT generation, expires, data, signal FROM entries WHERE name = ?", (name,)
+            ).fetchone()
+            return tuple(row) if row else None
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error leyendo {name}: {e}")
+            return None
+
+    def put(self, name, data, expires, generation, signal=None):
+        """
+        Guarda la copia solo si la generación no cambió desde que se empezó a leer
+        la hoja (así no se publica un dato anterior a una invalidación).
+        """
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT generation FROM generations WHERE name = ?", (name,)).fetchone()
+                if (row[0] if row else 0) != generation:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (name, generation, expires, data, signal) VALUES (?, ?, ?, ?, ?)",
+                    (name, generation, expires, sqlite3.Binary(data), signal),
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error guardando {name}: {e}")
+            return False
+
+    def touch(self, name, generation, expires):
+        """Extiende la expiración de la copia (la hoja no cambió) sin reescribir los datos."""
+        try:
+            self._conn().execute(
+                "UPDATE entries SET expires = ? WHERE name = ? AND generation = ?",
+                (expires, name, generation),
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error extendiendo {name}: {e}")
+
+    # --- Candado de recarga (evita que N workers descarguen la misma hoja a la vez) ---
+    @staticmethod
+    def _lock_owner():
+        # Proceso + hilo: con gthread y las lecturas en paralelo varios hilos del mismo
+        # worker compiten por el mismo candado
+        return f"{os.getpid()}:{threading.get_ident()}"
+
+    def acquire_fill_lock(self, name, ttl=10.0):
+        now = time.time()
+        owner = self._lock_owner()
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT owner, expires FROM locks WHERE name = ?", (name,)).fetchone()
+                if row and str(row[0]) != owner and row[1] > now:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO locks (name, owner, expires) VALUES (?, ?, ?)",
+                    (name, owner, now + ttl),
+                )
+                conn.execute("COMMIT")
+                return True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error tomando candado de {name}: {e}")
+            # Sin candado coordinado: cada worker lee por su cuenta
+            return True
+
+    def release_fill_lock(self, name):
+        try:
+            self._conn().execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, self._lock_owner()))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error liberando candado de {name}: {e}")
+
+    # --- Marcas compartidas ---
+    def add_mark(self, name):
+        try:
+            self._conn().execute("INSERT OR REPLACE INTO marks (name, created) VALUES (?, ?)", (name, time.time()))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error guardando marca {name}: {e}")
+
+    def has_mark(self, name):
+        """True si la marca existe (o si SQLite falla: ante la duda, se recalcula)."""
+        try:
+            return self._conn().execute("SELECT 1 FROM marks WHERE name = ?", (name,)).fetchone() is not None
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error leyendo marca {name}: {e}")
+            return True
+
+    def clear_mark(self, name):
+        try:
+            self._conn().execute("DELETE FROM marks WHERE name = ?", (name,))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error borrando marca {name}: {e}")
+
+    # --- Cola de escrituras pendientes (modo degradado) ---
+    def enqueue_write(self, email, method, path, body):
+        """Guarda una escritura (body ya serializado) y retorna su id, o None si SQLite falla."""
+        try:
+            cur = self._conn().execute(
+                "INSERT INTO write_queue (created, email, method, path, body) VALUES (?, ?, ?, ?, ?)",
+                (time.time(), email, method, path, body),
+            )
+            return cur.lastrowid
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error encolando escritura {method} {path}: {e}")
+            return None
+
+    def queued_writes(self, limit=100):
+        """Escrituras pendientes en orden de llegada: [(id, email, method, path, body)]."""
+        try:
+            return [tuple(row) for row in self._conn().execute(
+                "SELECT id, email, method, path, body FROM write_queue ORDER BY id LIMIT ?", (limit,)
+            )]
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error leyendo la cola de escrituras: {e}")
+            return []
+
+    def queued_write_count(self):
+        try:
+            return self._conn().execute("SELECT COUNT(*) FROM write_queue").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error contando la cola de escrituras: {e}")
+            return 0
+
+    def delete_queued_write(self, queue_id):
+        try:
+            self._conn().execute("DELETE FROM write_queue WHERE id = ?", (queue_id,))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error borrando escritura {queue_id}: {e}")
+
+    # --- Eventos en vivo (SSE) ---
+    def add_event(self, email, event_type, data, retention=600.0):
+        """Guarda un evento (data ya serializado) y borra los de más de `retention` segundos."""
+        now = time.time()
+        try:
+            conn = self._conn()
+            cur = conn.execute(
+                "INSERT INTO events (created, email, type, data) VALUES (?, ?, ?, ?)",
+                (now, email, event_type, data),
+            )
+            conn.execute("DELETE FROM events WHERE created < ?", (now - retention,))
+            return cur.lastrowid
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error guardando evento {event_type}: {e}")
+            return None
+
+    def events_since(self, email, last_id, limit=100):
+        """Eventos del usuario posteriores a last_id: [(id, type, data)]."""
+        try:
+            return [tuple(row) for row in self._conn().execute(
+                "SELECT id, type, data FROM events WHERE email = ? AND id > ? ORDER BY id LIMIT ?",
+                (email, last_id, limit),
+            )]
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error leyendo eventos: {e}")
+            return []
+
+    def last_event_id(self):
+        try:
+            return self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error leyendo el último evento: {e}")
+            return 0
+
+    # --- Claves de idempotencia ---
+    def claim_idempotency_key(self, key, fingerprint, expires, max_keys=None):
+        """
+        Reserva la clave (respuesta pendiente hasta `expires`) si no existe o ya expiró.
+        Con max_keys, al reservar se borran las claves más antiguas que sobren.
+        Retorna (True, None) si se reservó, (False, (fingerprint, status, mimetype, body)) si
+        ya estaba tomada (status None = en curso), o None si SQLite falla.
+        """
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM idempotency WHERE expires <= ?", (now,))
+                row = conn.execute(
+                    "SELECT fingerprint, status, mimetype, body FROM idempotency WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO idempotency (key, fingerprint, expires) VALUES (?, ?, ?)",
+                        (key, fingerprint, expires),
+                    )
+                    if max_keys:
+                        conn.execute(
+                            "DELETE FROM idempotency WHERE rowid IN (SELECT rowid FROM idempotency ORDER BY rowid "
+                            "LIMIT max(0, (SELECT COUNT(*) FROM idempotency) - ?))",
+                            (max_keys,),
+                        )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error reservando clave de idempotencia: {e}")
+            return None
+        if row is None:
+            return True, None
+        fingerprint, status, mimetype, body = row
+        return False, (fingerprint, status, mimetype, bytes(body) if body is not None else None)
+
+    def finish_idempotency_key(self, key, status, mimetype, body, expires):
+        """Guarda la respuesta de la clave reservada; los reintentos la recibirán hasta `expires`."""
+        try:
+            self._conn().execute(
+                "UPDATE idempotency SET status = ?, mimetype = ?, body = ?, expires = ? WHERE key = ?",
+                (status, mimetype, sqlite3.Binary(body), expires, key),
+            )
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error guardando respuesta idempotente: {e}")
+            return False
+
+    def release_idempotency_key(self, key):
+        """Libera una clave sin respuesta guardada (error del servidor: el cliente puede reintentar)."""
+        try:
+            self._conn().execute("DELETE FROM idempotency WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Caché compartida: error liberando clave de idempotencia: {e}")
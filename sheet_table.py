@@ -0,0 +1,243 @@
+# ----------------------------
+# REPRESENTACIÓN COMPACTA DE UNA HOJA EN CACHÉ
+# ----------------------------
+# get_all_records() devuelve una lista de dicts: cada fila repite todas las cabeceras
+# como claves y los números llegan mezclados como str/int/float. Aquí cada fila es
+# una tupla (SheetRecord) con solo sus valores de texto, y las columnas numéricas se
+# convierten una sola vez al cargar y viven únicamente en arrays tipados por columna
+# (8 bytes por celda, sin un objeto float por valor), que además sirven para sumas rápidas.
+import re
+import sys
+import json
+import marshal
+import threading
+from array import array
+
+_ABSENT = object()  # celda más allá del final de la fila (gspread recorta las filas vacías al final)
+_NUMBER = object()
+_MAX_EXACT = 2 ** 53  # enteros mayores no caben exactos en un double: se guardan como valor aparte
+
+# Los números de fila se guardan en cada tupla; los objetos int se comparten entre tablas
+_ROW_NUMBERS = []
+_ROW_NUMBERS_LOCK = threading.Lock()
+
+_THOUSANDS_RE = re.compile(r"^[+-]?\d{1,3}(,\d{3})+$")
+
+
+def _row_numbers(n):
+    if len(_ROW_NUMBERS) < n:
+        with _ROW_NUMBERS_LOCK:
+            _ROW_NUMBERS.extend(range(len(_ROW_NUMBERS), n))
+    return _ROW_NUMBERS
+
+
+class SheetRecord(tuple):
+    """
+    Fila compacta: (número de fila, valores de texto...). Se comporta como el dict de
+    gspread para lectura: r.get("Fecha"), r["Total"], r.keys(), r.to_dict().
+    Cada tabla crea su subclase, que apunta a sus arrays numéricos.
+    """
+    __slots__ = ()
+    _fields = ()
+    _text = {}     # cabecera -> posición en la tupla
+    _numeric = {}  # cabecera -> array('d') de la tabla
+    _other = {}    # cabecera -> {fila: valor} celdas no numéricas de una columna numérica
+
+    def get(self, key, default=None):
+        i = self._text.get(key)
+        if i is not None:
+            return tuple.__getitem__(self, i) if i < tuple.__len__(self) else default
+        column = self._numeric.get(key)
+        if column is None:
+            return default
+        row = tuple.__getitem__(self, 0)
+        other = self._other.get(key)
+        if other:
+            value = other.get(row, _NUMBER)
+            if value is not _NUMBER:
+                return default if value is _ABSENT else value
+        value = column[row]
+        return int(value) if value.is_integer() else value
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            return self.values()[key]
+        value = self.get(key, _ABSENT)
+        if value is _ABSENT:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self._text or key in self._numeric
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def __len__(self):
+        return len(self.values())
+
+    def __eq__(self, other):
+        if isinstance(other, SheetRecord):
+            return self._fields == other._fields and self.values() == other.values()
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash((self._fields, tuple(self.values())))
+
+    def values(self):
+        """Valores de la fila en orden de cabeceras (sin las celdas recortadas del final)."""
+        values = [self.get(h, _ABSENT) for h in self._fields]
+        while values and values[-1] is _ABSENT:
+            values.pop()
+        return [None if v is _ABSENT else v for v in values]
+
+    def keys(self):
+        return self._fields
+
+    def items(self):
+        return zip(self._fields, self.values())
+
+    def to_dict(self):
+        return dict(zip(self._fields, self.values()))
+
+
+def parse_number(value):
+    """
+    Convierte a int/float si es posible; las celdas vacías y los textos se mantienen.
+    La coma es separador de miles solo si va seguida de grupos de tres dígitos ("1,250")
+    o si después hay un punto decimal ("1,250.50"); si no, es la coma decimal ("6,50").
+    """
+    if isinstance(value, (int, float)) or value is None or value == "":
+        return value
+    text = str(value).strip()
+    if "," in text:
+        if "." in text and text.rfind(".") < text.rfind(","):
+            text = text.replace(".", "").replace(",", ".")  # "1.250,50"
+        elif "." in text or _THOUSANDS_RE.match(text):
+            text = text.replace(",", "")
+        else:
+            text = text.replace(",", ".")
+    try:
+        number = float(text)
+    except ValueError:
+        return value
+    return int(number) if number.is_integer() and "." not in text else number
+
+
+def _is_number(value):
+    return (type(value) is float) or (type(value) is int and -_MAX_EXACT <= value <= _MAX_EXACT)
+
+
+class SheetTable:
+    """
+    Copia inmutable de una hoja: filas compactas + columnas numéricas en array('d').
+    Es iterable e indexable como la lista que devolvía get_all_records().
+    """
+    __slots__ = ("headers", "rows", "numeric", "other", "nbytes")
+
+    def __init__(self, headers, raw_rows, numeric_columns=()):
+        """raw_rows: listas de valores en el orden de `headers` (pueden venir recortadas)."""
+        self.headers = tuple(headers)
+        numeric_idx = {self.headers.index(c): c for c in numeric_columns if c in self.headers}
+        text_idx = [i for i in range(len(self.headers)) if i not in numeric_idx]
+        self.numeric = {col: array("d") for col in numeric_idx.values()}
+        self.other = {col: {} for col in numeric_idx.values()}
+        record_cls = type("SheetRecord", (SheetRecord,), {
+            "__slots__": (),
+            "_fields": self.headers,
+            "_text": {self.headers[i]: pos for pos, i in enumerate(text_idx, start=1)},
+            "_numeric": self.numeric,
+            "_other": self.other,
+        })
+
+        numbers = _row_numbers(len(raw_rows))
+        rows = []
+        for row, raw in enumerate(raw_rows):
+            width = len(raw)
+            for i, col in numeric_idx.items():
+                v = parse_number(raw[i]) if i < width else _ABSENT
+                if _is_number(v):
+                    self.numeric[col].append(v)
+                else:
+                    self.numeric[col].append(0.0)
+                    self.other[col][row] = v
+            values = [numbers[row]]
+            for i in text_idx:
+                if i >= width:
+                    break
+                v = raw[i]
+                if isinstance(v, str):
+                    # Fechas, horas, categorías y alias se repiten mucho entre filas
+                    v = sys.intern(v)
+                values.append(v)
+            rows.append(record_cls(values))
+        self.rows = rows
+        self.nbytes = self._estimate_nbytes()
+
+    @classmethod
+    def from_records(cls, records, headers, numeric_columns=()):
+        """Construye la tabla desde la lista de dicts de gspread (o de filas en lista)."""
+        if records and isinstance(records[0], dict):
+            headers = list(records[0].keys())
+            raw_rows = [[r.get(h, "") for h in headers] for r in records]
+        else:
+            raw_rows = [list(r) for r in records or []]
+        return cls(headers, raw_rows, numeric_columns)
+
+    # --- Interfaz de lista (compatibilidad con el código que recibía list[dict]) ---
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return self.rows[i]
+
+    def records(self):
+        """Lista de dicts (para jsonify)."""
+        return [r.to_dict() for r in self.rows]
+
+    # --- Serialización para la caché compartida ---
+    def to_bytes(self):
+        return json.dumps({"h": self.headers, "r": [r.values() for r in self.rows]}, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, blob, numeric_columns=()):
+        payload = json.loads(blob)
+        return cls.from_records(payload["r"], payload["h"], numeric_columns)
+
+    # --- Serialización para los snapshots en disco (marshal: rápido, ligado a la versión de Python) ---
+    def to_marshal(self):
+        return marshal.dumps((self.headers, [tuple(r.values()) for r in self.rows]))
+
+    @classmethod
+    def from_marshal(cls, blob, numeric_columns=()):
+        headers, rows = marshal.loads(blob)
+        return cls.from_records(rows, list(headers), numeric_columns)
+
+    # --- Medición de memoria ---
+    def _estimate_nbytes(self):
+        """
+        Estimación de bytes ocupados: lista de filas, tuplas, valores de texto no compartidos
+        entre filas, arrays numéricos y celdas no numéricas de esas columnas. Los números
+        de fila (compartidos por todas las tablas) cuentan solo como el puntero de la tupla.
+        """
+        total = sys.getsizeof(self.rows)
+        seen = set()
+        for row in self.rows:
+            total += sys.getsizeof(row)
+            for v in tuple.__getitem__(row, slice(1, None)):
+                if id(v) not in seen:
+                    seen.add(id(v))
+                    total += sys.getsizeof(v)
+        for col, arr in self.numeric.items():
+            total += arr.buffer_info()[1] * arr.itemsize
+            other = self.other[col]
+            if other:
+                total += sys.getsizeof(other) + sum(sys.getsizeof(v) for v in other.values() if v is not _ABSENT)
+        return total
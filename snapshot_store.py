@@ -0,0 +1,113 @@
+# ----------------------------
+# SNAPSHOTS DE HOJAS EN DISCO (arranque en frío)
+# ----------------------------
+# La caché en memoria (y la compartida en SQLite, si vive en un disco efímero) se pierde
+# en cada reinicio o deploy: sin snapshots, el primer minuto de cada worker descarga
+# todas las hojas. Aquí cada hoja se guarda en un archivo propio:
+#
+#   cabecera fija  "TCSNAP" + versión de formato (uint16) + largo de metadatos (uint32)
+#   metadatos      JSON: hoja, generación, señal de cambio, fecha, filas, crc32, Python
+#   datos          marshal de (cabeceras, filas) -> carga mucho más rápida que JSON
+#
+# marshal no garantiza compatibilidad entre versiones de Python: un snapshot escrito por
+# otra versión (o corrupto) se ignora y la hoja se descarga como siempre.
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), "tripcounter_snapshots")
+MAGIC = b"TCSNAP"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<6sHI")
+
+
+class SnapshotStore:
+    """
+    Un archivo por hoja, escrito de forma atómica (archivo temporal + os.replace), así un
+    proceso que lee nunca ve un snapshot a medio escribir. Los errores de disco se registran
+    y se tratan como "no hay snapshot".
+    """
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"⚠️ Snapshots no disponibles en {directory}: {e}")
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.snap")
+
+    def save(self, name, payload, generation=0, signal=None):
+        """Guarda el payload (bytes de SheetTable.to_marshal) con sus metadatos de versión."""
+        meta = json.dumps({
+            "name": name,
+            "generation": generation,
+            "signal": signal,
+            "saved_at": time.time(),
+            "crc32": zlib.crc32(payload),
+            "size": len(payload),
+            "python": list(sys.version_info[:2]),
+        }).encode("utf-8")
+        path = self._path(name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with self._lock, open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(meta)))
+                f.write(meta)
+                f.write(payload)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logger.warning(f"⚠️ Snapshot: error guardando {name}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+    def discard(self, name):
+        """Borra el snapshot de la hoja (ya no refleja lo que hay en Sheets)."""
+        try:
+            with self._lock:
+                os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"⚠️ Snapshot: error borrando {name}: {e}")
+
+    def load(self, name):
+        """Retorna (metadatos, payload) o None si no hay snapshot válido para esta hoja."""
+        try:
+            with open(self._path(name), "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"⚠️ Snapshot: error leyendo {name}: {e}")
+            return None
+
+        try:
+            magic, version, meta_len = _HEADER.unpack_from(blob)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"formato {magic!r} v{version} no soportado")
+            meta = json.loads(blob[_HEADER.size:_HEADER.size + meta_len])
+            payload = blob[_HEADER.size + meta_len:]
+            if len(payload) != meta["size"] or zlib.crc32(payload) != meta["crc32"]:
+                raise ValueError("datos truncados o corruptos")
+            if meta["python"] != list(sys.version_info[:2]):
+                raise ValueError(f"escrito con Python {meta['python']}")
+        except (struct.error, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Snapshot de {name} ignorado: {e}")
+            return None
+        return meta, payload
+
@@ -7,6 +7,47 @@ function formatCurrency(value) {
     return `S/${parseFloat(value).toFixed(2)}`;
 }
 
+// --- Escrituras idempotentes: si la red falla y el usuario reenvía el mismo contenido,
+// se reutiliza la misma Idempotency-Key y el servidor devuelve la respuesta original. ---
+const pendingIdempotencyKeys = {};
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+}
+
+// --- Eventos en vivo (SSE): un solo EventSource por página, compartido por los módulos ---
+const liveEvents = { source: null, connected: false };
+
+function subscribeLiveEvent(type, handler) {
+    if (!window.EventSource) return;
+    if (!liveEvents.source) {
+        liveEvents.source = new EventSource('/api/events', { withCredentials: true });
+        liveEvents.source.onopen = () => { liveEvents.connected = true; };
+        // El navegador reconecta solo (y recupera lo perdido con Last-Event-ID)
+        liveEvents.source.onerror = () => { liveEvents.connected = false; };
+    }
+    liveEvents.source.addEventListener(type, (e) => handler(JSON.parse(e.data)));
+}
+
+// Si Google Sheets no está disponible, el servidor guarda los POST y responde
+// 202 {queued: true, message}: los formularios muestran ese mensaje y se limpian igual.
+async function sendJSON(url, method, data) {
+    const body = JSON.stringify(data);
+    const pendingId = `${method} ${url} ${body}`;
+    if (!pendingIdempotencyKeys[pendingId]) pendingIdempotencyKeys[pendingId] = newIdempotencyKey();
+
+    const response = await fetch(url, {
+        method: method,
+        headers: {'Content-Type': 'application/json', 'Idempotency-Key': pendingIdempotencyKeys[pendingId]},
+        body: body,
+        credentials: 'include'
+    });
+    // Hubo respuesta del servidor: la próxima escritura con el mismo contenido es una operación nueva
+    delete pendingIdempotencyKeys[pendingId];
+    return response;
+}
+
 // =========================================================
 // INICIALIZACIÓN GLOBAL SEGURA
 // =========================================================
@@ -41,6 +82,71 @@ function initializeTripsPage() {
 
     if (!tripForm || !tripsListDiv || !fechaInput) return;
     
+    // Dibuja la lista y el resumen del día (desde /api/trips o desde un evento en vivo)
+    function renderTrips(trips, bonusValue) {
+        const bonus = parseFloat(bonusValue || 0);
+        
+        let html = '';
+        
+        if (trips.length > 0) {
+            html += `
+                <p>Total de servicios hoy: <strong>${trips.length}</strong></p>
+                <table class="table table-striped summary-table">
+                    <thead>
+                        <tr><th>#</th><th>Inicio</th><th>Fin</th><th>Monto</th><th>Propina</th><th>Aerop.</th><th>Total</th></tr>
+                    </thead>
+                    <tbody>
+            `;
+            let totalMonto = 0;
+            let totalPropina = 0;
+            let totalDiaViajes = 0; 
+
+            trips.forEach(trip => {
+                const monto = parseFloat(trip.Monto);
+                const propina = parseFloat(trip.Propina);
+                const rowTotal = parseFloat(trip.Total);
+                
+                totalMonto += monto;
+                totalPropina += propina;
+                totalDiaViajes += rowTotal;
+                
+                html += `
+                    <tr>
+                        <td>${trip.Numero}</td>
+                        <td>${trip['Hora inicio']}</td>
+                        <td>${trip['Hora fin']}</td>
+                        <td>${formatCurrency(monto)}</td>
+                        <td>${formatCurrency(propina)}</td>
+                        <td>${trip.Aeropuerto > 0 ? 'S/6.50' : 'No'}</td>
+                        <td><strong>${formatCurrency(rowTotal)}</strong></td>
+                    </tr>
+                `;
+            });
+            
+            html += `</tbody></table>`;
+
+            const totalFinalDia = totalDiaViajes + bonus;
+
+            html += `
+                <hr>
+                <div class="card p-3 mt-3">
+                    <h4>Resumen de Ingresos</h4>
+                    <p>Monto base: <strong>${formatCurrency(totalMonto)}</strong></p>
+                    <p>Propina total: <strong>${formatCurrency(totalPropina)}</strong></p>
+                    <p>Subtotal (sin Bono): <strong>${formatCurrency(totalDiaViajes)}</strong></p>
+                    <h4>💰 Bono: <strong class="text-success">${formatCurrency(bonus)}</strong></h4>
+                    <hr>
+                    <p class="h4">Total de Ingresos del Día: <strong class="text-primary">${formatCurrency(totalFinalDia)}</strong></p>
+                </div>
+            `;
+
+        } else {
+            html = '<div class="message-box alert alert-warning">Aún no hay viajes registrados para este día.</div>';
+        }
+
+        tripsListDiv.innerHTML = html;
+    }
+
     // Función de renderizado (GET) - LOCAL
     async function fetchAndDisplayTrips(date) {
         if (tripsListDiv) tripsListDiv.innerHTML = 'Cargando viajes...';
@@ -53,68 +159,7 @@ function initializeTripsPage() {
                 return;
             }
 
-            const trips = data.trips;
-            const bonus = parseFloat(data.bonus || 0); 
-            
-            let html = '';
-            
-            if (trips.length > 0) {
-                html += `
-                    <p>Total de servicios hoy: <strong>${trips.length}</strong></p>
-                    <table class="table table-striped summary-table">
-                        <thead>
-                            <tr><th>#</th><th>Inicio</th><th>Fin</th><th>Monto</th><th>Propina</th><th>Aerop.</th><th>Total</th></tr>
-                        </thead>
-                        <tbody>
-                `;
-                let totalMonto = 0;
-                let totalPropina = 0;
-                let totalDiaViajes = 0; 
-
-                trips.forEach(trip => {
-                    const monto = parseFloat(trip.Monto);
-                    const propina = parseFloat(trip.Propina);
-                    const rowTotal = parseFloat(trip.Total);
-                    
-                    totalMonto += monto;
-                    totalPropina += propina;
-                    totalDiaViajes += rowTotal;
-                    
-                    html += `
-                        <tr>
-                            <td>${trip.Numero}</td>
-                            <td>${trip['Hora inicio']}</td>
-                            <td>${trip['Hora fin']}</td>
-                            <td>${formatCurrency(monto)}</td>
-                            <td>${formatCurrency(propina)}</td>
-                            <td>${trip.Aeropuerto > 0 ? 'S/6.50' : 'No'}</td>
-                            <td><strong>${formatCurrency(rowTotal)}</strong></td>
-                        </tr>
-                    `;
-                });
-                
-                html += `</tbody></table>`;
-
-                const totalFinalDia = totalDiaViajes + bonus;
-
-                html += `
-                    <hr>
-                    <div class="card p-3 mt-3">
-                        <h4>Resumen de Ingresos</h4>
-                        <p>Monto base: <strong>${formatCurrency(totalMonto)}</strong></p>
-                        <p>Propina total: <strong>${formatCurrency(totalPropina)}</strong></p>
-                        <p>Subtotal (sin Bono): <strong>${formatCurrency(totalDiaViajes)}</strong></p>
-                        <h4>💰 Bono: <strong class="text-success">${formatCurrency(bonus)}</strong></h4>
-                        <hr>
-                        <p class="h4">Total de Ingresos del Día: <strong class="text-primary">${formatCurrency(totalFinalDia)}</strong></p>
-                    </div>
-                `;
-
-            } else {
-                html = '<div class="message-box alert alert-warning">Aún no hay viajes registrados para este día.</div>';
-            }
-            
-            if (tripsListDiv) tripsListDiv.innerHTML = html;
+            renderTrips(data.trips, data.bonus);
 
 
         } catch (error) {
@@ -128,6 +173,11 @@ function initializeTripsPage() {
         fetchAndDisplayTrips(e.target.value);
     });
 
+    // ** Eventos en vivo: viajes registrados en esta u otra pestaña/dispositivo **
+    subscribeLiveEvent('trips', (event) => {
+        if (event.fecha === fechaInput.value) renderTrips(event.trips, event.new_bonus);
+    });
+
     // Manejar el envío del formulario (POST)
     tripForm.addEventListener('submit', async function(e) {
         e.preventDefault();
@@ -142,16 +192,11 @@ function initializeTripsPage() {
         };
         
         try {
-            const response = await fetch('/api/trips', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(data),
-                credentials: 'include'
-            });
+            const response = await sendJSON('/api/trips', 'POST', data);
             const result = await response.json();
             
             if (response.ok) {
-                alert(`Viaje #${result.trip.Numero} registrado. Bono total actualizado a ${formatCurrency(result.new_bonus)}.`);
+                alert(result.queued ? result.message : `Viaje #${result.trip.Numero} registrado. Bono total actualizado a ${formatCurrency(result.new_bonus)}.`);
                 
                 tripForm.hora_inicio.value = '';
                 tripForm.hora_fin.value = '';
@@ -159,7 +204,8 @@ function initializeTripsPage() {
                 tripForm.propina.value = '0';
                 tripForm.aeropuerto.checked = false;
                 
-                fetchAndDisplayTrips(data.fecha);
+                // Con el stream en vivo conectado, el evento 'trips' ya redibuja la lista
+                if (!liveEvents.connected || result.queued) fetchAndDisplayTrips(data.fecha);
             } else {
                 alert(`Error al registrar el viaje: ${result.error || response.statusText}`);
             }
@@ -265,16 +311,11 @@ function initializeExtrasPage() {
         };
         
         try {
-            const response = await fetch('/api/extras', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(data),
-                credentials: 'include'
-            });
+            const response = await sendJSON('/api/extras', 'POST', data);
             const result = await response.json();
             
             if (response.ok) {
-                alert(`Viaje Extra #${result.extra.Numero} registrado.`);
+                alert(result.queued ? result.message : `Viaje Extra #${result.extra.Numero} registrado.`);
                 
                 extraForm.hora_inicio_extra.value = '';
                 extraForm.hora_fin_extra.value = '';
@@ -384,16 +425,11 @@ function initializeExpensesPage() {
         };
         
         try {
-            const response = await fetch('/api/expenses', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(data),
-                credentials: 'include'
-            });
+            const response = await sendJSON('/api/expenses', 'POST', data);
             const result = await response.json();
             
             if (response.ok) {
-                alert(`Gasto en ${data.categoria} de ${formatCurrency(data.monto)} registrado.`);
+                alert(result.queued ? result.message : `Gasto en ${data.categoria} de ${formatCurrency(data.monto)} registrado.`);
                 
                 // Limpiar solo los campos de monto/categoría/descripción, manteniendo fecha/hora
                 expenseForm.monto.value = '';
@@ -558,16 +594,11 @@ function initializeKilometrajePage() {
         };
         
         try {
-            const response = await fetch('/api/kilometraje', {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(data),
-                credentials: 'include'
-            });
+            const response = await sendJSON('/api/kilometraje', 'POST', data);
             const result = await response.json();
             
             if (response.ok) {
-                alert(action === 'start' ? `KM de inicio ${result.km_inicio} registrado.` : `KM de fin ${result.km_fin} registrado. Recorrido: ${result.recorrido} KM.`);
+                alert(result.queued ? result.message : action === 'start' ? `KM de inicio ${result.km_inicio} registrado.` : `KM de fin ${result.km_fin} registrado. Recorrido: ${result.recorrido} KM.`);
                 fetchAndDisplayKM(data.fecha);
                 form.reset();
             } else {
@@ -632,12 +663,20 @@ function initializeBudgetPage() {
         if (tableBody) tableBody.innerHTML = '<tr><td colspan="6" class="text-center">Cargando presupuestos...</td></tr>';
 
         try {
-            const response = await fetch(PRESUPUESTO_API_URL, { method: 'GET', credentials: 'include'});
-            const records = await response.json();
-
-            if (!response.ok) {
-                if (tableBody) tableBody.innerHTML = `<tr><td colspan="6" class="message-box error">❌ Error al cargar datos: ${records.error || 'No autorizado.'}</td></tr>`;
-                return;
+            // La API devuelve solo los ítems del usuario, por páginas (cursor en X-Next-Cursor)
+            let records = [];
+            let url = PRESUPUESTO_API_URL;
+            while (url) {
+                const response = await fetch(url, { method: 'GET', credentials: 'include'});
+                const page = await response.json();
+
+                if (!response.ok) {
+                    if (tableBody) tableBody.innerHTML = `<tr><td colspan="6" class="message-box error">❌ Error al cargar datos: ${page.error || 'No autorizado.'}</td></tr>`;
+                    return;
+                }
+                records = records.concat(page);
+                const nextCursor = response.headers.get('X-Next-Cursor');
+                url = nextCursor ? `${PRESUPUESTO_API_URL}?cursor=${encodeURIComponent(nextCursor)}` : null;
             }
 
             if (tableBody) {
@@ -648,8 +687,8 @@ function initializeBudgetPage() {
                 
                 tableBody.innerHTML = '';
                 
-                records.forEach((r, i) => {
-                    const rowIndex = i + 2; 
+                records.forEach((r) => {
+                    const rowIndex = r.row_index; 
                     const isPaid = r.pagado === true || r.pagado === 'True' || r.pagado === 'TRUE';
                     
                     const row = tableBody.insertRow();
@@ -661,9 +700,9 @@ function initializeBudgetPage() {
                         <td>
                             ${isPaid ? 
                                 `<span class="text-success me-2">Pagado</span>` : 
-                                `<button class="mark-paid-btn me-2" data-row-index="${rowIndex}">Marcar</button>`
+                                `<button class="mark-paid-btn me-2" data-id="${r.id || ''}" data-row-index="${rowIndex}">Marcar</button>`
                             }
-                            <button class="btn btn-sm btn-danger delete-btn" data-row-index="${rowIndex}">
+                            <button class="btn btn-sm btn-danger delete-btn" data-id="${r.id || ''}" data-row-index="${rowIndex}">
                                 Eliminar
                             </button>
                         </td>
@@ -704,17 +743,12 @@ function initializeBudgetPage() {
         };
         
         try {
-            const response = await fetch(PRESUPUESTO_API_URL, {
-                method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify(data),
-                credentials: 'include'
-            });
+            const response = await sendJSON(PRESUPUESTO_API_URL, 'POST', data);
 
             const result = await response.json();
 
-            if (response.ok && result.status === 'ok') {
-                budgetMessageDiv.innerHTML = '✅ ¡Presupuesto añadido con éxito!';
+            if (response.ok && (result.status === 'ok' || result.queued)) {
+                budgetMessageDiv.innerHTML = result.queued ? `⏳ ${result.message}` : '✅ ¡Presupuesto añadido con éxito!';
                 budgetMessageDiv.className = 'message-box alert alert-success';
                 budgetForm.reset(); 
                 if (fijoRadio) fijoRadio.checked = true;
@@ -736,8 +770,12 @@ function initializeBudgetPage() {
     if (budgetListContainer) {
          budgetListContainer.addEventListener('click', async (event) => {
             const target = event.target;
+            const itemId = target.dataset.id;
             const rowIndex = target.dataset.rowIndex;
-            if (!rowIndex) return;
+            if (!itemId && !rowIndex) return;
+            // El id no cambia al borrar otras filas; row_index solo para ítems aún sin id
+            const payload = itemId ? { id: itemId } : { row_index: rowIndex };
+            const tableRow = target.closest('tr');
 
             if (target.classList.contains('mark-paid-btn')) {
                 // Lógica Marcar como Pagado (PUT)
@@ -747,17 +785,18 @@ function initializeBudgetPage() {
                 target.textContent = 'Actualizando...';
                 
                 try {
-                    const response = await fetch(PRESUPUESTO_API_URL, {
-                        method: 'PUT',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({ row_index: rowIndex }),
-                        credentials: 'include'
-                    });
+                    const response = await sendJSON(PRESUPUESTO_API_URL, 'PUT', payload);
                     
                     const result = await response.json();
 
                     if (response.ok && result.status === 'ok') {
-                        loadBudgets(); 
+                        if (itemId && tableRow) {
+                            // Actualiza solo esta fila, sin volver a pedir la lista
+                            tableRow.cells[4].textContent = '✅ SÍ';
+                            target.outerHTML = '<span class="text-success me-2">Pagado</span>';
+                        } else {
+                            loadBudgets();
+                        }
                     } else {
                         alert(`Error al marcar como pagado: ${result.error || 'Error desconocido'}`);
                     }
@@ -773,17 +812,17 @@ function initializeBudgetPage() {
                 target.textContent = 'Eliminando...';
                 
                 try {
-                    const response = await fetch(PRESUPUESTO_API_URL, {
-                        method: 'DELETE',
-                        headers: {'Content-Type': 'application/json'},
-                        body: JSON.stringify({ row_index: rowIndex }),
-                        credentials: 'include'
-                    });
+                    const response = await sendJSON(PRESUPUESTO_API_URL, 'DELETE', payload);
                     
                     const result = await response.json();
 
                     if (response.ok && result.status === 'ok') {
-                        loadBudgets(); 
+                        // Con ids las demás filas siguen siendo válidas: basta con quitar esta
+                        if (itemId && tableRow && tableRow.parentElement.rows.length > 1) {
+                            tableRow.remove();
+                        } else {
+                            loadBudgets();
+                        }
                     } else {
                         alert(`Error al eliminar: ${result.message || result.error || 'Error desconocido'}`);
                     }
@@ -810,10 +849,11 @@ function initializeHomeReminders() {
     
     const handleHomeAction = async (event, method) => {
         const target = event.target;
+        const itemId = target.dataset.id;
         const row_index = target.dataset.rowIndex;
         const category = target.dataset.category;
         
-        if (!row_index) return;
+        if (!itemId && !row_index) return;
         
         let confirmMsg = '';
         if (method === 'PUT') {
@@ -828,12 +868,7 @@ function initializeHomeReminders() {
         target.textContent = 'Actualizando...';
         
         try {
-            const response = await fetch(PRESUPUESTO_API_URL, {
-                method: method,
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({ row_index: row_index }),
-                credentials: 'include'
-            });
+            const response = await sendJSON(PRESUPUESTO_API_URL, method, itemId ? { id: itemId } : { row_index: row_index });
             
             const data = await response.json();
 
@@ -873,8 +908,38 @@ function initializeSummaryPage() {
     
     if (!fechaInput || !resultsDiv) return;
 
+    // Último resumen mostrado: los eventos en vivo lo actualizan sin volver a pedirlo
+    let currentSummary = null;
+
+    // Dibuja la tabla del resumen - LOCAL
+    function renderSummary(summary) {
+        currentSummary = summary;
+
+        // Renderizado de la tabla con la clase summary-table
+        let html = `
+            <table class="summary-table">
+                <thead>
+                    <tr><th>Métrica</th><th>Valor</th></tr>
+                </thead>
+                <tbody>
+                    <tr><td>Viajes Totales</td><td>${summary.num_trips}</td></tr>
+                    <tr><td>KM Recorrido</td><td>${summary.total_km} KM</td></tr>
+                    <tr><td>Ingreso Bruto</td><td>${formatCurrency(summary.total_income)}</td></tr>
+                    <tr><td>Gasto Total</td><td>${formatCurrency(summary.total_expenses)}</td></tr>
+                    <tr><td>Bono Aplicado</td><td>${formatCurrency(summary.current_bonus)}</td></tr>
+                    <tr><td>Ganancia Neta</td><td><strong>${formatCurrency(summary.net_income)}</strong></td></tr>
+                    <tr><td>Productividad S/KM</td><td><strong>${formatCurrency(summary.productivity_per_km)}/KM</strong></td></tr>
+                </tbody>
+            </table>
+            ${summary.is_complete ? '' : '<div class="message-box warning mt-3">⚠️ Información incompleta: Asegúrate de registrar viajes y KM final.</div>'}
+        `;
+        
+        resultsDiv.innerHTML = html;
+    }
+
     // Función para obtener y mostrar el resumen - LOCAL
     async function fetchAndDisplaySummary(date) {
+        currentSummary = null;
         resultsDiv.innerHTML = '<p>Calculando resumen...</p>';
 
         try {
@@ -886,26 +951,7 @@ function initializeSummaryPage() {
                 return;
             }
 
-            // Renderizado de la tabla con la clase summary-table
-            let html = `
-                <table class="summary-table">
-                    <thead>
-                        <tr><th>Métrica</th><th>Valor</th></tr>
-                    </thead>
-                    <tbody>
-                        <tr><td>Viajes Totales</td><td>${summary.num_trips}</td></tr>
-                        <tr><td>KM Recorrido</td><td>${summary.total_km} KM</td></tr>
-                        <tr><td>Ingreso Bruto</td><td>${formatCurrency(summary.total_income)}</td></tr>
-                        <tr><td>Gasto Total</td><td>${formatCurrency(summary.total_expenses)}</td></tr>
-                        <tr><td>Bono Aplicado</td><td>${formatCurrency(summary.current_bonus)}</td></tr>
-                        <tr><td>Ganancia Neta</td><td><strong>${formatCurrency(summary.net_income)}</strong></td></tr>
-                        <tr><td>Productividad S/KM</td><td><strong>${formatCurrency(summary.productivity_per_km)}/KM</strong></td></tr>
-                    </tbody>
-                </table>
-                ${summary.is_complete ? '' : '<div class="message-box warning mt-3">⚠️ Información incompleta: Asegúrate de registrar viajes y KM final.</div>'}
-            `;
-            
-            resultsDiv.innerHTML = html;
+            renderSummary(summary);
 
         } catch (error) {
             console.error('Error al cargar el resumen:', error);
@@ -918,6 +964,34 @@ function initializeSummaryPage() {
         fetchAndDisplaySummary(e.target.value);
     });
 
+    // ** Eventos en vivo: recalcula el resumen del día mostrado con los mismos criterios del servidor **
+    function applyLiveUpdate(event, update) {
+        if (!currentSummary || event.fecha !== fechaInput.value) return;
+        const summary = { ...currentSummary };
+        update(summary);
+        summary.net_income = Math.round((summary.total_income - summary.total_expenses) * 100) / 100;
+        summary.productivity_per_km = summary.total_km > 0
+            ? Math.round(summary.net_income / summary.total_km * 100) / 100
+            : 0;
+        summary.is_complete = summary.num_trips > 0 && summary.total_km > 0;
+        renderSummary(summary);
+    }
+
+    subscribeLiveEvent('trips', (event) => applyLiveUpdate(event, (summary) => {
+        summary.num_trips = event.day.num_trips;
+        summary.current_bonus = event.day.bonus;
+        summary.total_income = event.day.total_income;
+    }));
+
+    subscribeLiveEvent('expenses', (event) => applyLiveUpdate(event, (summary) => {
+        const added = event.expenses.reduce((sum, e) => sum + (parseFloat(e.Monto) || 0), 0);
+        summary.total_expenses = Math.round((summary.total_expenses + added) * 100) / 100;
+    }));
+
+    subscribeLiveEvent('km', (event) => applyLiveUpdate(event, (summary) => {
+        summary.total_km = parseInt(event.recorrido, 10) || 0;
+    }));
+
     // Carga inicial al iniciar la página
     fetchAndDisplaySummary(fechaInput.value);
 }
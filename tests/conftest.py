@@ -0,0 +1,76 @@
+# ----------------------------
+# PRUEBAS: app.py contra el servidor falso de Google Sheets (loadtest/fake_sheets.py)
+# ----------------------------
+# Las variables de entorno se fijan antes de importar app.py (lee los ids de hojas, la
+# caché compartida y los snapshots al importarse). Cada prueba empieza con las hojas
+# vacías y sin cachés ni estado en memoria de la anterior.
+import os
+import sys
+import tempfile
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadtest.fake_sheets import start_in_thread  # noqa: E402
+from loadtest.run import SHEET_ID_ENV  # noqa: E402
+
+FAKE_SHEETS = start_in_thread(latency_ms=0)
+_WORKDIR = tempfile.mkdtemp(prefix="tripcounter-tests-")
+os.environ.update({
+    "FLASK_SECRET_KEY": "tests-secret",
+    "GSHEETS_EMULATOR_HOST": FAKE_SHEETS.host,
+    "SHARED_CACHE_PATH": os.path.join(_WORKDIR, "cache.sqlite3"),
+    "SNAPSHOT_DIR": os.path.join(_WORKDIR, "snapshots"),
+})
+for _ws_name, _var in SHEET_ID_ENV.items():
+    os.environ[_var] = _ws_name
+
+import app as tripcounter  # noqa: E402
+
+
+def reset_process_state():
+    """Lo que un worker nuevo no tendría: caché local, índices, idempotencia, snapshots de meses."""
+    with tripcounter._CACHE_LOCK:
+        tripcounter.CACHE.clear()
+    tripcounter.DERIVED_INDEXES.clear()
+    tripcounter.IDEMPOTENCY_STORE.clear()
+    tripcounter.MONTHLY_SNAPSHOTS.clear()
+
+
+@pytest.fixture
+def app_module():
+    with FAKE_SHEETS.state.lock:
+        FAKE_SHEETS.state.spreadsheets.clear()
+    tripcounter.WORKSHEETS.clear()
+    tripcounter.SHEETS_BREAKER.record_success()
+    for queued in tripcounter.queued_writes():
+        tripcounter._remove_queued_write(queued[0])
+    for ws_name in SHEET_ID_ENV:
+        tripcounter.invalidate_cache(ws_name)
+        seed_sheet(ws_name, [])
+    reset_process_state()
+    return tripcounter
+
+
+@pytest.fixture
+def client(app_module):
+    test_client = app_module.app.test_client()
+    with test_client.session_transaction() as s:
+        s["email"] = "tester@example.com"
+    return test_client
+
+
+def seed_sheet(ws_name, rows):
+    """Crea la hoja con las cabeceras de app.py y le añade filas ({cabecera: valor})."""
+    requests.post(
+        f"http://{FAKE_SHEETS.host}/_seed/{ws_name}",
+        json={"headers": tripcounter.SHEET_HEADERS[ws_name], "rows": rows},
+    ).raise_for_status()
+
+
+def sheet_rows(ws_name):
+    """Filas tal como están en el servidor falso (incluida la cabecera)."""
+    return requests.get(f"http://{FAKE_SHEETS.host}/_sheet/{ws_name}").json()["rows"]
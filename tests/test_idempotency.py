@@ -0,0 +1,50 @@
+from conftest import reset_process_state, sheet_rows
+
+TRIP = {"fecha": "2026-10-02", "hora_inicio": "08:00", "hora_fin": "08:20", "monto": 14}
+
+
+def test_retry_on_another_worker_replays_the_stored_response(client):
+    headers = {"Idempotency-Key": "retry-other-worker"}
+    first = client.post("/api/trips", json=TRIP, headers=headers)
+    assert first.status_code == 201, first.get_json()
+
+    # El reintento llega a un worker sin nada en memoria: solo comparte la caché SQLite
+    reset_process_state()
+    retry = client.post("/api/trips", json=TRIP, headers=headers)
+
+    assert retry.status_code == 201
+    assert retry.headers.get("Idempotent-Replayed") == "true"
+    assert retry.get_json() == first.get_json()
+    assert len(sheet_rows("TripCounter_Trips")) == 2  # cabecera + un solo viaje
+
+
+def test_same_key_with_different_body_is_rejected(client):
+    headers = {"Idempotency-Key": "reused-key"}
+    assert client.post("/api/trips", json=TRIP, headers=headers).status_code == 201
+
+    reset_process_state()
+    response = client.post("/api/trips", json=dict(TRIP, monto=99), headers=headers)
+
+    assert response.status_code == 422
+    assert response.get_json()["error"] == "idempotency_key_reused"
+
+
+def test_shared_store_is_bounded_by_key_count(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "IDEMPOTENCY_MAX_KEYS", 3)
+    cache = app_module.SHARED_CACHE
+    for i in range(5):
+        assert app_module._claim_idempotency_key(f"bounded-{i}", "fp", 1e12) is None
+
+    conn = cache._conn()
+    keys = [row[0] for row in conn.execute("SELECT key FROM idempotency WHERE key LIKE 'bounded-%' ORDER BY rowid")]
+    assert keys == ["bounded-2", "bounded-3", "bounded-4"]
+
+
+def test_same_key_on_another_query_string_is_a_different_write(client):
+    headers = {"Idempotency-Key": "km-start"}
+    first = client.post("/api/kilometraje?date=2026-09-01", json={"km_value": 100, "action": "start"}, headers=headers)
+    second = client.post("/api/kilometraje?date=2026-09-02", json={"km_value": 200, "action": "start"}, headers=headers)
+
+    assert first.status_code == 201 and second.status_code == 201
+    assert "Idempotent-Replayed" not in second.headers
+    assert [row[0] for row in sheet_rows("TripCounter_Kilometraje")[1:]] == ["2026-09-01", "2026-09-02"]
@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+
+
+def trip(fecha, hora):
+    return {"fecha": fecha, "hora_inicio": hora, "hora_fin": hora[:3] + "40", "monto": 10}
+
+
+@pytest.fixture
+def clock(app_module, monkeypatch):
+    """Fija date.today() dentro de app.py."""
+    def set_today(year, month, day):
+        class FixedDate(date):
+            @classmethod
+            def today(cls):
+                return cls(year, month, day)
+        monkeypatch.setattr(app_module, "date", FixedDate)
+    return set_today
+
+
+def report(client, **params):
+    response = client.get("/api/monthly_report", query_string=dict({"month": 10, "year": 2026}, **params))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_summary_saved_while_month_was_open_is_not_served_as_snapshot(client, clock):
+    clock(2026, 10, 19)
+    client.post("/api/trips", json=trip("2026-10-05", "08:00"))
+    assert report(client)["report"]["total_trips"] == 1
+
+    client.post("/api/trips", json=trip("2026-10-06", "09:00"))
+    client.post("/api/trips", json=trip("2026-10-07", "10:00"))
+
+    clock(2026, 11, 2)
+    first = report(client)
+    assert first["report"]["total_trips"] == 3
+    assert "snapshot" not in first
+
+    second = report(client)
+    assert second["snapshot"] is True
+    assert second["report"]["total_trips"] == 3
+
+
+def test_in_memory_snapshot_is_dropped_when_another_worker_recomputes(client, clock, app_module):
+    clock(2026, 11, 2)
+    client.post("/api/trips", json=trip("2026-10-05", "08:00"))
+    assert report(client)["report"]["total_trips"] == 1
+    assert report(client)["snapshot"] is True
+
+    # Otro worker recalcula el mes: reescribe la fila e invalida Summaries (nueva generación)
+    stale = app_module.MONTHLY_SNAPSHOTS["2026-10"]
+    client.post("/api/trips", json=trip("2026-10-06", "09:00"))
+    assert report(client, refresh="1")["report"]["total_trips"] == 2
+    app_module.MONTHLY_SNAPSHOTS["2026-10"] = stale
+
+    assert report(client)["report"]["total_trips"] == 2
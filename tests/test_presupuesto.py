@@ -0,0 +1,54 @@
+import pytest
+
+from conftest import seed_sheet, sheet_rows
+
+
+@pytest.fixture
+def budgets(client):
+    seed_sheet("TripCounter_Presupuesto", [
+        {"alias": "tester@example.com", "categoria": "Luz", "monto": 80, "tipo": "Fijo", "fecha_pago": "2026-10-25", "pagado": "False"},
+        {"alias": "other@example.com", "categoria": "Agua", "monto": 40, "tipo": "Fijo", "fecha_pago": "2026-10-26", "pagado": "False"},
+    ])
+    items = client.get("/api/presupuesto").get_json()
+    assert [item["categoria"] for item in items] == ["Luz"]
+    other = next(row for row in sheet_rows("TripCounter_Presupuesto")[1:] if row[0] == "other@example.com")
+    return {"mine": items[0]["id"], "other": other[6], "other_row": 3}
+
+
+@pytest.mark.parametrize("method", ["PUT", "DELETE"])
+def test_items_of_another_user_are_not_found(client, budgets, method):
+    response = client.open("/api/presupuesto", method=method, json={"id": budgets["other"]})
+
+    assert response.status_code == 404
+    assert response.get_json()["ids"] == [budgets["other"]]
+    assert [str(row[5]).lower() for row in sheet_rows("TripCounter_Presupuesto")[1:]] == ["false", "false"]
+
+
+@pytest.mark.parametrize("method", ["PUT", "DELETE"])
+def test_legacy_row_index_of_another_user_is_not_found(client, budgets, method):
+    response = client.open("/api/presupuesto", method=method, json={"row_index": budgets["other_row"]})
+
+    assert response.status_code == 404
+    assert len(sheet_rows("TripCounter_Presupuesto")) == 3
+
+
+def test_stale_copy_falls_back_to_the_sheet_and_still_checks_the_owner(client, app_module, budgets, monkeypatch):
+    # La confirmación no coincide (copia vieja): se relee la hoja
+    monkeypatch.setattr(app_module, "read_budget_owners", lambda ws, rows: {row: ("", "") for row in rows})
+
+    assert client.put("/api/presupuesto", json={"ids": [budgets["mine"], budgets["other"]]}).status_code == 404
+    response = client.put("/api/presupuesto", json={"id": budgets["mine"]})
+
+    assert response.status_code == 200, response.get_json()
+    assert [str(row[5]).lower() for row in sheet_rows("TripCounter_Presupuesto")[1:]] == ["true", "false"]
+
+
+def test_decimal_comma_amounts_are_read_as_decimals(client):
+    seed_sheet("TripCounter_Presupuesto", [
+        {"alias": "tester@example.com", "categoria": "Peaje", "monto": "20,5", "tipo": "Fijo", "fecha_pago": "2026-10-25", "pagado": "False"},
+        {"alias": "tester@example.com", "categoria": "Seguro", "monto": "1,250", "tipo": "Fijo", "fecha_pago": "2026-10-26", "pagado": "False"},
+    ])
+
+    items = client.get("/api/presupuesto").get_json()
+
+    assert [item["monto"] for item in items] == [20.5, 1250]
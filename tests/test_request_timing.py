@@ -0,0 +1,67 @@
+import re
+import threading
+import time
+
+from conftest import FAKE_SHEETS, reset_process_state
+
+SHEETS_METRIC = re.compile(r'sheets;dur=([\d.]+);desc="(\d+) calls"')
+PYTHON_METRIC = re.compile(r"python;dur=([\d.]+)")
+TOTAL_METRIC = re.compile(r"total;dur=([\d.]+)")
+
+
+def cold_summary(client, app_module):
+    """Resumen diario sin nada en caché: ni copias locales ni hojas abiertas."""
+    client.post("/api/trips", json={"fecha": "2026-10-03", "hora_inicio": "08:00", "hora_fin": "08:30", "monto": 10})
+    reset_process_state()
+    app_module.WORKSHEETS.clear()
+    for ws_name in app_module.SHEET_HEADERS:
+        app_module.invalidate_cache(ws_name)
+    FAKE_SHEETS.state.reset_stats()
+    return client.get("/api/summary?date=2026-10-03")
+
+
+def test_server_timing_counts_every_sheets_call_of_a_parallel_read(client, app_module):
+    # El resumen diario lee viajes, gastos, km y bonos en paralelo (hilos del fan-out).
+    # Con las hojas sin abrir, cada una cuesta 5 llamadas: buscarla en Drive, dos de
+    # metadatos al abrirla, la sonda de cambios y la lectura de valores.
+    response = cold_summary(client, app_module)
+
+    assert response.status_code == 200, response.get_json()
+    duration, calls = SHEETS_METRIC.search(response.headers["Server-Timing"]).groups()
+    assert int(calls) == FAKE_SHEETS.state.stats()["total"] == 4 * 5
+    assert float(duration) > 0
+
+
+def test_parallel_sheets_calls_count_wall_clock_time_once(client, app_module):
+    FAKE_SHEETS.state.latency_ms = 50
+    try:
+        response = cold_summary(client, app_module)
+    finally:
+        FAKE_SHEETS.state.latency_ms = 0
+
+    header = response.headers["Server-Timing"]
+    sheets = float(SHEETS_METRIC.search(header).group(1))
+    python = float(PYTHON_METRIC.search(header).group(1))
+    total = float(TOTAL_METRIC.search(header).group(1))
+    # Veinte llamadas de 50 ms, cuatro a la vez: la suma pasa de 1 s, el reloj no
+    assert sheets <= total
+    assert abs(sheets + python - total) < 1
+
+
+def test_overlapping_calls_are_merged(app_module):
+    timing = app_module.RequestTiming()
+
+    def call():
+        started = timing.sheets_call_started()
+        time.sleep(0.1)
+        timing.sheets_call_finished(started)
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert timing.sheets_calls == 2
+    assert 100 <= timing.sheets_ms < 180
+    assert timing.sheets_call_ms >= 200
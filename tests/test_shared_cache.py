@@ -0,0 +1,24 @@
+import threading
+
+from shared_cache import SharedCache
+
+
+def in_thread(fn):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_fill_lock_is_exclusive_between_threads_of_one_process(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache.sqlite3"))
+    assert cache.acquire_fill_lock("TripCounter_Trips")
+
+    assert in_thread(lambda: cache.acquire_fill_lock("TripCounter_Trips")) is False
+    # Liberar desde otro hilo no suelta el candado ajeno
+    in_thread(lambda: cache.release_fill_lock("TripCounter_Trips"))
+    assert in_thread(lambda: cache.acquire_fill_lock("TripCounter_Trips")) is False
+
+    cache.release_fill_lock("TripCounter_Trips")
+    assert in_thread(lambda: cache.acquire_fill_lock("TripCounter_Trips")) is True
@@ -0,0 +1,40 @@
+from sheet_table import SheetTable, parse_number
+
+HEADERS = ["Fecha", "Numero", "Monto", "Total"]
+NUMERIC = ("Numero", "Monto", "Total")
+
+
+def test_parse_number_decimal_and_thousands_commas():
+    assert parse_number("6,50") == 6.5
+    assert parse_number("-3,5") == -3.5
+    assert parse_number("1,250") == 1250
+    assert parse_number("1,250,000") == 1250000
+    assert parse_number("1,250.50") == 1250.5
+    assert parse_number("1.250,50") == 1250.5
+    assert parse_number("Cuota 1,2") == "Cuota 1,2"
+
+
+def test_numeric_cells_live_only_in_the_typed_columns():
+    table = SheetTable.from_records([
+        {"Fecha": "2026-10-01", "Numero": 1, "Monto": "6,50", "Total": 6.5},
+        {"Fecha": "2026-10-01", "Numero": 2, "Monto": "", "Total": "N/A"},
+    ], HEADERS, NUMERIC)
+
+    assert table.records() == [
+        {"Fecha": "2026-10-01", "Numero": 1, "Monto": 6.5, "Total": 6.5},
+        {"Fecha": "2026-10-01", "Numero": 2, "Monto": "", "Total": "N/A"},
+    ]
+    assert list(table.numeric["Monto"]) == [6.5, 0.0]
+    # La tupla de cada fila guarda su número y los textos, no los números
+    assert not any(isinstance(v, float) for row in table.rows for v in tuple.__iter__(row))
+
+
+def test_round_trips_keep_short_rows_and_text_cells():
+    table = SheetTable.from_records([["2026-10-01", 3, "x", 9], ["2026-10-02"]], HEADERS, NUMERIC)
+
+    for copy in (SheetTable.from_bytes(table.to_bytes(), NUMERIC), SheetTable.from_marshal(table.to_marshal(), NUMERIC)):
+        assert copy.records() == [
+            {"Fecha": "2026-10-01", "Numero": 3, "Monto": "x", "Total": 9},
+            {"Fecha": "2026-10-02"},
+        ]
+        assert copy[1].get("Total", "vacío") == "vacío"
@@ -0,0 +1,43 @@
+from conftest import reset_process_state, seed_sheet
+
+WS = "TripCounter_Trips"
+
+
+def flush_snapshot_writer(app_module):
+    app_module._SNAPSHOT_WRITER.submit(lambda: None).result()
+
+
+def snapshot_of_trips(app_module):
+    seed_sheet(WS, [{"Fecha": "2026-10-04", "Numero": 1, "Monto": 10, "Total": 10}])
+    app_module.invalidate_cache(WS)
+    flush_snapshot_writer(app_module)
+    client = app_module.get_gspread_client()
+    ws = app_module.ensure_sheet_with_headers(client, WS, app_module.SHEET_HEADERS[WS])
+    table = app_module.get_all_records_cached(ws, WS)
+    flush_snapshot_writer(app_module)  # el guardado en segundo plano de esta lectura
+    app_module.SNAPSHOTS.save(WS, table.to_marshal(), app_module._cache_generation(WS))
+
+
+def test_snapshot_of_an_older_generation_is_not_loaded(app_module):
+    snapshot_of_trips(app_module)
+    # Otro worker escribió en la hoja después de guardarse el snapshot
+    app_module.SHARED_CACHE.invalidate(WS)
+    reset_process_state()
+
+    assert WS not in app_module.load_snapshots()
+    assert app_module._cache_get(WS) is None
+
+
+def test_snapshot_of_the_current_generation_is_loaded(app_module):
+    snapshot_of_trips(app_module)
+    reset_process_state()
+
+    assert app_module.load_snapshots()[WS]["rows"] == 1
+
+
+def test_invalidate_cache_discards_the_snapshot(app_module):
+    snapshot_of_trips(app_module)
+    app_module.invalidate_cache(WS)
+    flush_snapshot_writer(app_module)
+
+    assert app_module.SNAPSHOTS.load(WS) is None
@@ -0,0 +1,29 @@
+from conftest import sheet_rows
+
+
+def test_bulk_numbers_trips_by_parsed_start_time(client):
+    response = client.post("/api/trips/bulk", json={"trips": [
+        {"fecha": "2026-10-01", "hora_inicio": "10:00", "hora_fin": "10:20", "monto": 10},
+        {"fecha": "2026-10-01", "hora_inicio": "9:30", "hora_fin": "9:50", "monto": 12},
+        {"fecha": "2026-10-01", "hora_inicio": "18:05", "hora_fin": "18:30", "monto": 15},
+    ]})
+
+    assert response.status_code == 201, response.get_json()
+    numbered = {t["Hora inicio"]: t["Numero"] for t in response.get_json()["trips"]}
+    assert numbered == {"9:30": 1, "10:00": 2, "18:05": 3}
+    assert [row[2] for row in sheet_rows("TripCounter_Trips")[1:]] == ["9:30", "10:00", "18:05"]
+
+
+def test_bulk_rejects_items_that_are_not_objects(client):
+    response = client.post("/api/trips/bulk", json={
+        "trips": [{"hora_inicio": "08:00", "hora_fin": "08:10", "monto": 9}, 1],
+        "expenses": ["x"],
+    })
+
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body["error"] == "validation_failed"
+    assert [(d["type"], d["index"], d["error"]) for d in body["details"]] == [
+        ("trip", 1, "invalid_item"), ("expense", 0, "invalid_item"),
+    ]
+    assert sheet_rows("TripCounter_Trips")[1:] == []
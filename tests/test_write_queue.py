@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from conftest import sheet_rows
+
+
+@pytest.fixture
+def open_circuit(app_module, monkeypatch):
+    """Abre el circuito de Sheets sin lanzar el hilo de recuperación (la prueba reenvía a mano)."""
+    breaker = app_module.SHEETS_BREAKER
+    monkeypatch.setattr(breaker, "reset_timeout", 60)
+
+    def open_():
+        with breaker._lock:
+            breaker.state = "open"
+            breaker.opened_at = time.time()
+    yield open_
+    breaker.record_success()
+
+
+def test_queued_km_write_replays_on_the_requested_date(client, app_module, open_circuit):
+    open_circuit()
+    queued = client.post("/api/kilometraje?date=2026-09-30", json={"km_value": 1200, "action": "start"})
+    assert queued.status_code == 202
+    assert queued.get_json()["queued"] is True
+
+    app_module.SHEETS_BREAKER.record_success()
+    assert app_module.replay_queued_writes() == 1
+
+    assert [[str(v) for v in row[:2]] for row in sheet_rows("TripCounter_Kilometraje")[1:]] == [["2026-09-30", "1200"]]
+
+
+def test_post_while_the_half_open_trial_is_in_flight_is_queued(client, app_module, open_circuit):
+    breaker = app_module.SHEETS_BREAKER
+    open_circuit()
+    with breaker._lock:
+        breaker.opened_at -= 120  # ya pasó reset_timeout: toca la llamada de prueba
+    assert breaker.allow_request()  # otro hilo tomó la prueba y aún no responde
+    assert not breaker.is_open()
+
+    queued = client.post("/api/trips", json={"fecha": "2026-09-30", "hora_inicio": "08:00", "hora_fin": "08:20", "monto": 12})
+
+    assert queued.status_code == 202, queued.get_json()
+    assert app_module.queued_write_count() == 1
+
+
+def test_replayed_expense_keeps_the_time_it_was_received(client, app_module, open_circuit, monkeypatch):
+    open_circuit()
+    assert client.post("/api/expenses", json={"monto": 30, "categoria": "Peaje"}).status_code == 202
+
+    class Later(app_module.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return app_module.datetime.now(tz) + app_module.timedelta(hours=3)
+
+    received = app_module.datetime.now().strftime("%H:%M")
+    monkeypatch.setattr(app_module, "datetime", Later)
+    app_module.SHEETS_BREAKER.record_success()
+    assert app_module.replay_queued_writes() == 1
+
+    assert [str(row[1]) for row in sheet_rows("TripCounter_Gastos")[1:]] == [received]
+
+
+def test_km_post_uses_the_date_in_the_body(client):
+    start = client.post("/api/kilometraje", json={"km_value": 500, "action": "start", "fecha": "2026-09-29"})
+    end = client.post("/api/kilometraje", json={"km_value": 530, "action": "end", "fecha": "2026-09-29"})
+
+    assert start.status_code == 201 and end.status_code == 200
+    assert [[str(v) for v in row[:4]] for row in sheet_rows("TripCounter_Kilometraje")[1:]] == [["2026-09-29", "500", "530", "30"]]
+
+
+def test_summary_without_cached_copy_returns_503_while_circuit_is_open(client, open_circuit):
+    open_circuit()
+    response = client.get("/api/summary?date=2026-09-30")
+
+    assert response.status_code == 503
+    assert response.get_json()["error"] == "sheets_unavailable"